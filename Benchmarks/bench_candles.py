@@ -0,0 +1,92 @@
+﻿"""
+Compare the per-dict candle loops used before CandleBatch with the vectorised
+versions used by ingestion and gap repair: zero-candle and current-day
+filtering, the local hour and local day of every hourly candle, and the rows
+handed to the bulk insert.
+
+Usage: python -m Benchmarks.bench_candles [hours]
+Pure CPU, no database or network needed.
+"""
+import sys
+import time
+import random
+from datetime import datetime
+import pytz
+from Scripts.candles import CandleBatch
+
+LocalTz = pytz.timezone('Europe/London')
+
+
+def make_entries(hours: int, start: int = 1262304000):
+    entries = []
+    price = 100.0
+    for i in range(hours):
+        if i < hours // 10:
+            # Leading all-zero candles, as the API returns before a coin traded
+            entries.append({"time": start + i * 3600, "open": 0, "high": 0, "low": 0, "close": 0})
+            continue
+        open_price = price
+        price = max(0.01, price * (1 + random.uniform(-0.01, 0.01)))
+        entries.append({
+            "time": start + i * 3600,
+            "open": open_price,
+            "close": price,
+            "high": max(open_price, price) * 1.005,
+            "low": min(open_price, price) * 0.995,
+        })
+    return entries
+
+
+def legacy(entries, cutoff):
+    """The previous shape of the work: one Python pass per candle."""
+    valid = []
+    for entry in entries:
+        if entry["time"] >= cutoff:
+            continue
+        if entry["high"] == 0 and entry["low"] == 0 and entry["open"] == 0 and entry["close"] == 0:
+            continue
+        valid.append(entry)
+    days = []
+    hours = []
+    for entry in valid:
+        local = datetime.fromtimestamp(entry["time"], LocalTz)
+        days.append(int(LocalTz.localize(local.replace(tzinfo=None, hour=0, minute=0, second=0)).timestamp()))
+        hours.append(local.hour)
+    rows = [{"timestamp": entry["time"], "open": entry["open"], "high": entry["high"],
+             "low": entry["low"], "close": entry["close"]} for entry in valid]
+    return days, hours, rows
+
+
+def vectorised(entries, cutoff):
+    candles = CandleBatch.from_api(entries)
+    candles = candles.select(candles.between(end=cutoff) & ~candles.zero_mask())
+    days = candles.local_day_start(LocalTz)
+    hours = (candles.time + candles.utc_offsets(LocalTz)) % 86400 // 3600
+    return days, hours, candles.to_rows()
+
+
+def run(hours: int = 24 * 365 * 5):
+    entries = make_entries(hours)
+    cutoff = entries[-1]["time"] - 12 * 3600
+    results = {}
+
+    started = time.perf_counter()
+    legacy_days, legacy_hours, legacy_rows = legacy(entries, cutoff)
+    results["legacy"] = hours / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    batch_days, batch_hours, batch_rows = vectorised(entries, cutoff)
+    results["vectorised"] = hours / (time.perf_counter() - started)
+
+    assert legacy_days == batch_days.tolist(), "local days differ"
+    assert legacy_hours == batch_hours.tolist(), "local hours differ"
+    assert legacy_rows == batch_rows, "rows differ"
+
+    for name, rate in results.items():
+        print(f"{name:>10}: {rate:,.0f} candles/sec")
+    print(f"speedup: {results['vectorised'] / results['legacy']:.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 24 * 365 * 5)
@@ -0,0 +1,50 @@
+﻿"""
+Indicator maintenance costs: the vectorised pass used for backfills against
+feeding the same history through the per-candle running state, and one new
+candle folded into the running state against recomputing the whole series.
+
+Usage: python -m Benchmarks.bench_indicators [candles]
+Pure CPU, no database or network needed.
+"""
+import sys
+import time
+import numpy as np
+from Scripts.indicators import compute_indicators, RunningIndicators
+
+
+def main():
+    candles = int(sys.argv[1]) if len(sys.argv) > 1 else 10 * 365
+    np.random.seed(1)
+    close = 100 * np.cumprod(1 + np.random.uniform(-0.03, 0.03, candles + 1))
+    history, new_close = close[:-1], float(close[-1])
+
+    started = time.perf_counter()
+    _, state = compute_indicators(history)
+    vectorised = time.perf_counter() - started
+
+    started = time.perf_counter()
+    running = RunningIndicators({"closes": [], "count": 0})
+    for value in history.tolist():
+        running.update(value)
+    looped = time.perf_counter() - started
+
+    repeats = 1000
+    started = time.perf_counter()
+    for _ in range(repeats):
+        RunningIndicators(state).update(new_close)
+    incremental = (time.perf_counter() - started) / repeats
+
+    started = time.perf_counter()
+    for _ in range(10):
+        compute_indicators(close)
+    recompute = (time.perf_counter() - started) / 10
+
+    print(f"{candles} candles of history")
+    print(f"  backfill, per-candle loop : {looped * 1000:9.2f} ms")
+    print(f"  backfill, vectorised      : {vectorised * 1000:9.2f} ms  ({looped / vectorised:.1f}x faster)")
+    print(f"  new candle, full recompute: {recompute * 1e6:9.1f} us")
+    print(f"  new candle, running state : {incremental * 1e6:9.1f} us  ({recompute / incremental:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+﻿"""
+Compare rows/sec of the old per-row commit write path against the bulk
+INSERT ... ON CONFLICT path in save_historic_data_to_db.
+
+Usage: python -m Benchmarks.bench_save_historic [rows]
+Runs against the configured database with a throwaway coin that is removed afterwards.
+"""
+import sys
+import time
+import random
+from Models.coins import Coin, CoinHistoric, SessionLocal
+from Scripts.get_historic_coin_data import save_historic_data_to_db
+from Scripts.candles import CandleBatch
+
+
+def make_entries(rows: int, start: int = 1262304000):
+    entries = []
+    price = 100.0
+    for i in range(rows):
+        open_price = price
+        price = max(0.01, price * (1 + random.uniform(-0.05, 0.05)))
+        entries.append({
+            "time": start + i * 86400,
+            "open": open_price,
+            "close": price,
+            "high": max(open_price, price) * 1.01,
+            "low": min(open_price, price) * 0.99,
+        })
+    return entries
+
+
+def legacy_save(session, coin_id, entries):
+    """The previous write path: one bulk_save_objects + commit per row."""
+    for entry in entries:
+        session.bulk_save_objects([CoinHistoric(
+            coin_id=coin_id,
+            high=entry["high"],
+            low=entry["low"],
+            open=entry["open"],
+            close=entry["close"],
+            timestamp=entry["time"],
+        )])
+        session.commit()
+
+
+def run(rows: int = 1500):
+    session = SessionLocal()
+    coin = Coin(symbol=f"BENCH{int(time.time())}", name="Benchmark", content_created=0,
+                last_time_tracked=0, webhook_url="")
+    session.add(coin)
+    session.commit()
+    results = {}
+    try:
+        entries = make_entries(rows)
+
+        started = time.perf_counter()
+        legacy_save(session, coin.id, entries)
+        results["legacy"] = rows / (time.perf_counter() - started)
+        session.query(CoinHistoric).filter_by(coin_id=coin.id).delete()
+        session.commit()
+
+        candles = CandleBatch.from_api(entries)
+        started = time.perf_counter()
+        save_historic_data_to_db(session, coin.id, candles)
+        results["bulk"] = rows / (time.perf_counter() - started)
+
+        # Re-running the same page must insert nothing
+        started = time.perf_counter()
+        duplicates = save_historic_data_to_db(session, coin.id, candles)
+        results["bulk_rerun"] = rows / (time.perf_counter() - started)
+        assert duplicates == 0, f"re-run inserted {duplicates} duplicate rows"
+    finally:
+        session.query(CoinHistoric).filter_by(coin_id=coin.id).delete()
+        session.delete(coin)
+        session.commit()
+        session.close()
+
+    for name, rate in results.items():
+        print(f"{name:>10}: {rate:,.0f} rows/sec")
+    print(f"speedup: {results['bulk'] / results['legacy']:.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1500)
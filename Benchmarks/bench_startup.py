@@ -0,0 +1,52 @@
+﻿"""
+Measure process start-up cost: module import time of the scheduler and of the
+data layer, and the time until the first query returns.
+
+Usage: python -m Benchmarks.bench_startup [runs]
+Each measurement runs in a fresh interpreter so nothing is cached between runs.
+"""
+import statistics
+import subprocess
+import sys
+
+
+SNIPPETS = {
+    "import Models.coins": "import Models.coins",
+    "import main": "import main",
+    "first query": (
+        "from db import SessionLocal\n"
+        "from sqlalchemy import text\n"
+        "s = SessionLocal(); s.execute(text('SELECT 1')); s.close()"
+    ),
+}
+
+
+def measure(snippet: str, runs: int):
+    code = (
+        "import time\n"
+        "started = time.perf_counter()\n"
+        f"{snippet}\n"
+        "print(time.perf_counter() - started)\n"
+    )
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", code], text=True)
+        samples.append(float(output.strip().splitlines()[-1]))
+    return samples
+
+
+def run(runs: int = 5):
+    results = {}
+    for name, snippet in SNIPPETS.items():
+        try:
+            samples = measure(snippet, runs)
+        except subprocess.CalledProcessError:
+            print(f"{name:>20}: failed (is the database reachable?)")
+            continue
+        results[name] = statistics.median(samples)
+        print(f"{name:>20}: median {results[name] * 1000:8.1f}ms over {runs} runs")
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
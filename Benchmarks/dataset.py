@@ -0,0 +1,80 @@
+﻿"""
+Synthetic dataset generator: N coins x M years of daily and hourly candles,
+written straight to the database with the same deterministic prices the fake
+market server returns.
+"""
+from datetime import datetime, timedelta
+import pytz
+from sqlalchemy.dialects.postgresql import insert
+from Models.coins import (
+    Coin, CoinHistoric, CoinHourly, CoinRollup, BackfillWindow, CoinCycleClaim, CoinStreamCandle, AlertRule,
+    CoinIndicator, CoinIndicatorState,
+)
+from Scripts.fake_market_server import synthetic_candle
+from Scripts.rollups import merge_into_rollups
+
+
+BENCH_SYMBOL_PREFIX = "BENCH"
+INSERT_CHUNK = 5000
+
+
+def bench_symbols(coins: int):
+    return [f"{BENCH_SYMBOL_PREFIX}{i:04d}" for i in range(coins)]
+
+
+def create_bench_coins(session, coins: int, years: float, webhook_url: str):
+    """Add the benchmark coins, tracked from `years` ago and not backfilled yet."""
+    start = int((datetime.now(pytz.utc) - timedelta(days=365 * years)).timestamp())
+    created = []
+    for symbol in bench_symbols(coins):
+        coin = Coin(
+            symbol=symbol,
+            name=f"Benchmark {symbol}",
+            content_created=start,
+            last_time_tracked=start,
+            history_check=False,
+            webhook_url=webhook_url,
+        )
+        session.add(coin)
+        created.append(coin)
+    session.commit()
+    return created
+
+
+def _insert_chunks(session, model, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        session.execute(insert(model).values(rows[start:start + INSERT_CHUNK]).on_conflict_do_nothing())
+
+
+def generate_candles(session, coin: Coin, years: float, hourly_days: int):
+    """Write `years` of daily candles and the last `hourly_days` of hourly candles for one coin."""
+    today = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = int((today - timedelta(days=int(365 * years))).timestamp())
+    last_day = int(today.timestamp())
+    daily = []
+    for ts in range(first_day, last_day, 86400):
+        candle = synthetic_candle(coin.symbol, ts, 86400, listed_since=0)
+        daily.append({"coin_id": coin.id, "timestamp": ts, **{k: candle[k] for k in ("open", "high", "low", "close")}})
+    hourly = []
+    for ts in range(last_day - hourly_days * 86400, last_day, 3600):
+        candle = synthetic_candle(coin.symbol, ts, 3600, listed_since=0)
+        hourly.append({"coin_id": coin.id, "timestamp": ts, **{k: candle[k] for k in ("open", "high", "low", "close")}})
+    _insert_chunks(session, CoinHistoric, daily)
+    _insert_chunks(session, CoinHourly, hourly)
+    merge_into_rollups(session, coin.id, first_day, last_day)
+    coin.history_check = True
+    session.commit()
+    return len(daily), len(hourly)
+
+
+def drop_bench_coins(session):
+    """Remove every benchmark coin and all rows that reference it."""
+    coin_ids = [coin_id for (coin_id,) in session.query(Coin.id).filter(Coin.symbol.like(f"{BENCH_SYMBOL_PREFIX}%"))]
+    if not coin_ids:
+        return 0
+    for model in (CoinHistoric, CoinHourly, CoinRollup, BackfillWindow, CoinCycleClaim, CoinStreamCandle, AlertRule,
+                  CoinIndicator, CoinIndicatorState):
+        session.query(model).filter(model.coin_id.in_(coin_ids)).delete(synchronize_session=False)
+    session.query(Coin).filter(Coin.id.in_(coin_ids)).delete(synchronize_session=False)
+    session.commit()
+    return len(coin_ids)
@@ -0,0 +1,160 @@
+﻿"""
+End-to-end benchmarks for ingestion, the hourly cycle and reporting.
+
+Usage:
+    python -m Benchmarks.run [--coins 20] [--years 3] [--workers 8] [--output FILE]
+    python -m Benchmarks.run --compare OLD.json NEW.json
+
+Runs against the configured database (use a dedicated benchmark database) and
+a local fake market server, so no network access or API quota is needed.
+Results are written as JSON tagged with the current git commit, so runs from
+different commits can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Benchmark the code paths, not the production quota or the on-disk cache
+os.environ.setdefault("API_RATE_LIMIT_PER_SECOND", "1000")
+os.environ.setdefault("API_CACHE_MAX_BYTES", "0")
+
+from Models.coins import Coin, CoinHistoric, SessionLocal
+from Scripts.fake_market_server import FakeMarketServer
+from Scripts.providers import HttpProvider, provider_urls, set_provider
+from Scripts.report import INTERVALS
+from Scripts.report_export import export_report
+from Scripts.webhook_dispatcher import get_dispatcher
+from Benchmarks.dataset import BENCH_SYMBOL_PREFIX, create_bench_coins, drop_bench_coins, generate_candles
+import main as scheduler
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def count_bench_rows(session):
+    return session.query(CoinHistoric).join(Coin).filter(Coin.symbol.like(f"{BENCH_SYMBOL_PREFIX}%")).count()
+
+
+def timed(name, results, func, **extra):
+    started = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - started
+    results[name] = {"seconds": round(seconds, 4), **extra}
+    print(f"{name:>20}: {seconds:8.3f}s")
+    return value, results[name]
+
+
+def run(args):
+    server = FakeMarketServer(latency=args.latency).start()
+    set_provider(HttpProvider(provider_urls(server.base_url)))
+    webhook_url = f"{server.base_url}/webhook"
+    results = {}
+    session = SessionLocal()
+    try:
+        others = session.query(Coin).filter(~Coin.symbol.like(f"{BENCH_SYMBOL_PREFIX}%")).count()
+        if others and not args.force:
+            sys.exit(f"Database has {others} non-benchmark coins; use a benchmark database or pass --force")
+        drop_bench_coins(session)
+        coins = create_bench_coins(session, args.coins, args.years, webhook_url)
+
+        if args.generate:
+            _, entry = timed("generate", results, lambda: [generate_candles(session, coin, args.years, args.hourly_days) for coin in coins])
+        else:
+            requests_before = server.counters["requests"]
+            _, entry = timed("backfill", results, lambda: scheduler.process_all_cryptos(args.workers))
+            entry["api_requests"] = server.counters["requests"] - requests_before
+        rows = count_bench_rows(session)
+        entry["rows"] = rows
+        entry["rows_per_second"] = round(rows / entry["seconds"], 1) if entry["seconds"] else None
+
+        requests_before = server.counters["requests"]
+        _, entry = timed("hourly_cycle", results, lambda: scheduler.process_all_cryptos(args.workers))
+        entry["api_requests"] = server.counters["requests"] - requests_before
+
+        end_ts = int(time.time())
+        start_ts = end_ts - int(args.years * 365 * 86400)
+        for interval in INTERVALS:
+            def reports():
+                sizes = []
+                for coin in coins:
+                    buffer, _ = export_report(session, coin.id, start_ts, end_ts, interval, compress=False)
+                    sizes.append(len(buffer.getvalue()))
+                return sizes
+            sizes, entry = timed(f"report_{interval}", results, reports)
+            entry["reports"] = len(sizes)
+            entry["seconds_per_report"] = round(entry["seconds"] / len(sizes), 5) if sizes else None
+            entry["bytes"] = sum(sizes)
+
+        results["webhooks"] = get_dispatcher().stats()
+        results["fake_server"] = dict(server.counters)
+    finally:
+        if not args.keep:
+            drop_bench_coins(session)
+        session.close()
+        server.shutdown()
+
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "params": {
+            "coins": args.coins,
+            "years": args.years,
+            "workers": args.workers,
+            "latency": args.latency,
+            "generate": args.generate,
+            "hourly_days": args.hourly_days,
+        },
+        "results": results,
+    }
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'benchmark':>20} {old['commit']:>10} {new['commit']:>10}  change")
+    for name, entry in new["results"].items():
+        if "seconds" not in entry or name not in old["results"]:
+            continue
+        before = old["results"][name]["seconds"]
+        after = entry["seconds"]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{name:>20} {before:>9.3f}s {after:>9.3f}s  {change:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--coins", type=int, default=20)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--workers", type=int, default=scheduler.INGEST_MAX_WORKERS)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated API latency in seconds")
+    parser.add_argument("--generate", action="store_true", help="Write candles directly instead of backfilling through the API")
+    parser.add_argument("--hourly-days", type=int, default=30, help="Days of hourly candles written by --generate")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark coins afterwards")
+    parser.add_argument("--force", action="store_true", help="Run even if the database has real coins")
+    parser.add_argument("--output", default=None, help="JSON results file (default bench_results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run(args)
+    output = args.output or os.path.join("bench_results", f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
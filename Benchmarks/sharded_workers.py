@@ -0,0 +1,155 @@
+﻿"""
+Local multi-process demo of sharded scheduler workers.
+
+Starts a fake market server, creates benchmark coins with generated history
+and then runs the hourly cycle as separate worker processes that share the
+coins through coin_cycle_claims:
+
+    1. one worker, as the baseline
+    2. --workers workers, to show the coins split between them
+    3. --workers workers where the first one crashes part way through, to show
+       its coins being taken over once the lease expires
+
+After each run it checks that every coin was claimed and finished exactly once
+and has its hourly candles.
+
+Usage: python -m Benchmarks.sharded_workers [--coins 40] [--workers 3] [--latency 0.2]
+Runs against the configured database (use a dedicated benchmark database).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+import pytz
+
+os.environ.setdefault("API_RATE_LIMIT_PER_SECOND", "1000")
+os.environ.setdefault("API_CACHE_MAX_BYTES", "0")
+
+from sqlalchemy import func
+from Models.coins import Coin, CoinHistoric, CoinHourly, CoinCycleClaim, SessionLocal
+from Scripts.fake_market_server import FakeMarketServer
+from Scripts.providers import HttpProvider, provider_urls, set_provider
+from Benchmarks.dataset import BENCH_SYMBOL_PREFIX, create_bench_coins, drop_bench_coins, generate_candles
+import main as scheduler
+
+DEMO_LEASE_SECONDS = 6
+
+
+def run_worker(args):
+    """Child process: run one sharded cycle and print what it did as JSON."""
+    set_provider(HttpProvider(provider_urls(args.base_url)))
+    if args.crash_after is not None:
+        started = {"count": 0}
+        lock = threading.Lock()
+        process_coin = scheduler.process_coin
+
+        def crashing_process_coin(*a, **kw):
+            with lock:
+                started["count"] += 1
+                if started["count"] > args.crash_after:
+                    os._exit(1)
+            return process_coin(*a, **kw)
+
+        scheduler.process_coin = crashing_process_coin
+    timings = scheduler.process_all_cryptos(args.threads, sharded=True)
+    print(json.dumps({"worker": os.environ["WORKER_ID"], "coins": sorted(timings)}))
+
+
+def spawn_workers(count, base_url, threads, crash_first=None):
+    processes = []
+    for index in range(count):
+        env = dict(os.environ, WORKER_ID=f"demo-{index}", WORKER_LEASE_SECONDS=str(DEMO_LEASE_SECONDS))
+        command = [sys.executable, "-m", "Benchmarks.sharded_workers", "--worker", base_url, "--threads", str(threads)]
+        if index == 0 and crash_first is not None:
+            command += ["--crash-after", str(crash_first)]
+        processes.append(subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True))
+    results = {}
+    for index, process in enumerate(processes):
+        output, _ = process.communicate()
+        lines = [line for line in output.splitlines() if line.startswith("{")]
+        results[f"demo-{index}"] = json.loads(lines[-1])["coins"] if lines else f"exited with {process.returncode}"
+    return results
+
+
+def reset_cycle(session, coin_ids, today_start):
+    """Forget this cycle's claims and today's hours so the next run has the same work."""
+    session.query(CoinCycleClaim).filter(CoinCycleClaim.coin_id.in_(coin_ids)).delete(synchronize_session=False)
+    session.query(CoinHourly).filter(
+        CoinHourly.coin_id.in_(coin_ids), CoinHourly.timestamp >= today_start
+    ).delete(synchronize_session=False)
+    session.query(CoinHistoric).filter(
+        CoinHistoric.coin_id.in_(coin_ids), CoinHistoric.timestamp >= today_start - 86400 + 1
+    ).delete(synchronize_session=False)
+    session.commit()
+
+
+def check_cycle(session, coin_ids, today_start):
+    claims = session.query(CoinCycleClaim.worker_id, func.count(), func.count(CoinCycleClaim.finished_at)).filter(
+        CoinCycleClaim.coin_id.in_(coin_ids)
+    ).group_by(CoinCycleClaim.worker_id).all()
+    hours = dict(session.query(CoinHourly.coin_id, func.count()).filter(
+        CoinHourly.coin_id.in_(coin_ids), CoinHourly.timestamp >= today_start
+    ).group_by(CoinHourly.coin_id).all())
+    finished = sum(done for _, _, done in claims)
+    return {
+        "finished_by_worker": {worker: done for worker, _, done in claims},
+        "claims": sum(total for _, total, _ in claims),
+        "finished": finished,
+        "coins_with_hours": len(hours),
+        "exactly_once": finished == len(coin_ids) and sum(total for _, total, _ in claims) == len(coin_ids),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worker", metavar="BASE_URL", dest="base_url", help=argparse.SUPPRESS)
+    parser.add_argument("--crash-after", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--coins", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=2, help="Ingestion threads per worker")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated API latency in seconds")
+    parser.add_argument("--force", action="store_true", help="Run even if the database has real coins")
+    args = parser.parse_args()
+    if args.base_url:
+        run_worker(args)
+        return
+
+    server = FakeMarketServer(latency=args.latency).start()
+    session = SessionLocal()
+    today_start = int(datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+    try:
+        others = session.query(Coin).filter(~Coin.symbol.like(f"{BENCH_SYMBOL_PREFIX}%")).count()
+        if others and not args.force:
+            sys.exit(f"Database has {others} non-benchmark coins; use a benchmark database or pass --force")
+        drop_bench_coins(session)
+        coins = create_bench_coins(session, args.coins, 1, f"{server.base_url}/webhook")
+        for coin in coins:
+            generate_candles(session, coin, 1, 2)
+        coin_ids = [coin.id for coin in coins]
+
+        runs = [("single worker", 1, None), (f"{args.workers} workers", args.workers, None),
+                (f"{args.workers} workers, demo-0 crashes", args.workers, 2)]
+        for name, workers, crash_first in runs:
+            reset_cycle(session, coin_ids, today_start)
+            webhooks_before = server.counters["webhooks"]
+            started = time.perf_counter()
+            results = spawn_workers(workers, server.base_url, args.threads, crash_first)
+            elapsed = time.perf_counter() - started
+            check = check_cycle(session, coin_ids, today_start)
+            print(f"\n== {name}: {elapsed:.2f}s")
+            for worker, coins_done in results.items():
+                print(f"  {worker}: {coins_done if isinstance(coins_done, str) else f'{len(coins_done)} coins'}")
+            print(f"  webhook posts: {server.counters['webhooks'] - webhooks_before}")
+            print(f"  {check}")
+    finally:
+        drop_bench_coins(session)
+        session.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+﻿"""
+Run streaming ingestion against the fake market server and report how long
+closed candles take to reach the database.
+
+Usage: python -m Benchmarks.stream_latency [--coins 50] [--seconds 150] [--poll 1]
+Runs against the configured database (use a dedicated benchmark database).
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("API_RATE_LIMIT_PER_SECOND", "1000")
+os.environ.setdefault("API_CACHE_MAX_BYTES", "0")
+
+from sqlalchemy import func
+from Models.coins import Coin, CoinStreamCandle, SessionLocal
+from Scripts.fake_market_server import FakeMarketServer
+from Scripts.providers import HttpProvider, provider_urls, set_provider
+from Scripts.stream_ingest import StreamIngestor
+from Benchmarks.dataset import BENCH_SYMBOL_PREFIX, create_bench_coins, drop_bench_coins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--coins", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=150, help="How long to stream")
+    parser.add_argument("--poll", type=float, default=1.0, help="Seconds between price polls")
+    parser.add_argument("--flush", type=float, default=2.0, help="Seconds between database flushes")
+    parser.add_argument("--force", action="store_true", help="Run even if the database has real coins")
+    args = parser.parse_args()
+
+    server = FakeMarketServer().start()
+    set_provider(HttpProvider(provider_urls(server.base_url)))
+    session = SessionLocal()
+    try:
+        others = session.query(Coin).filter(~Coin.symbol.like(f"{BENCH_SYMBOL_PREFIX}%")).count()
+        if others and not args.force:
+            sys.exit(f"Database has {others} non-benchmark coins; use a benchmark database or pass --force")
+        drop_bench_coins(session)
+        coins = create_bench_coins(session, args.coins, 1, f"{server.base_url}/webhook")
+        coin_ids = [coin.id for coin in coins]
+
+        ingestor = StreamIngestor(poll_seconds=args.poll, flush_seconds=args.flush)
+        stop = threading.Event()
+        worker = threading.Thread(target=ingestor.run, args=(stop,), daemon=True)
+        worker.start()
+        time.sleep(args.seconds)
+        stop.set()
+        worker.join()
+
+        stored = session.query(CoinStreamCandle.period, func.count()).filter(
+            CoinStreamCandle.coin_id.in_(coin_ids)
+        ).group_by(CoinStreamCandle.period).all()
+        print(f"Streamed {args.coins} coins for {args.seconds:.0f}s (poll {args.poll}s, flush {args.flush}s)")
+        print(f"  stored candles by period: {dict(stored)}")
+        print(f"  ingestor: {ingestor.stats()}")
+        print(f"  fake server: {server.counters}")
+        print(f"  worst close-to-stored latency: {ingestor.max_latency:.2f}s (hourly cron: up to 3600s)")
+    finally:
+        drop_bench_coins(session)
+        session.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
-﻿from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, Numeric, JSON
+﻿from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, Numeric, JSON, UniqueConstraint
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from db import get_engine
+from sqlalchemy.orm import relationship
+from db import SessionLocal
 
 
-engine = get_engine()
 Base = declarative_base()
 
 
@@ -24,6 +23,10 @@ class Coin(Base):
 
 class CoinHistoric(Base):
     __tablename__ = "coin_historic"
+    # One daily candle per coin; backfills upsert against this key
+    __table_args__ = (
+        UniqueConstraint("coin_id", "timestamp", name="uq_coin_historic_coin_id_timestamp"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     coin_id = Column(
         Integer, ForeignKey("coins.id"), nullable=False
@@ -33,11 +36,102 @@ class CoinHistoric(Base):
     open = Column(Numeric, nullable=False)
     close = Column(Numeric, nullable=False)
     timestamp = Column(Integer, nullable=False)
+    # Legacy storage for hourly candles, superseded by coin_hourly (see migration 0002)
     hourly_historic = Column(MutableList.as_mutable(JSON), default=[])
 
     # Define relationship with Coin
     coin = relationship("Coin", back_populates="historics")
 
 
-Base.metadata.create_all(engine)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class BackfillWindow(Base):
+    """Checkpoint for a daily backfill window that has been fetched and stored."""
+    __tablename__ = "backfill_windows"
+    coin_id = Column(Integer, ForeignKey("coins.id"), primary_key=True)
+    window_start = Column(Integer, primary_key=True)  # Unix time of the first daily candle
+    window_end = Column(Integer, primary_key=True)  # Unix time of the last daily candle
+    rows_inserted = Column(Integer, nullable=False, default=0)
+
+
+class CoinRollup(Base):
+    """Pre-aggregated weekly/monthly/yearly OHLC, maintained from coin_historic."""
+    __tablename__ = "coin_rollups"
+    coin_id = Column(Integer, ForeignKey("coins.id"), primary_key=True)
+    interval = Column(String, primary_key=True)  # "weekly", "monthly" or "yearly"
+    period_start = Column(Integer, primary_key=True)  # Unix start of the period, Europe/London
+    open = Column(Numeric, nullable=False)
+    high = Column(Numeric, nullable=False)
+    low = Column(Numeric, nullable=False)
+    close = Column(Numeric, nullable=False)
+    first_ts = Column(Integer, nullable=False)  # Daily candle the open came from
+    last_ts = Column(Integer, nullable=False)  # Daily candle the close came from
+
+
+class CoinHourly(Base):
+    __tablename__ = "coin_hourly"
+    coin_id = Column(Integer, ForeignKey("coins.id"), primary_key=True)
+    timestamp = Column(Integer, primary_key=True)  # Unix start of the hour
+    high = Column(Numeric, nullable=False)
+    low = Column(Numeric, nullable=False)
+    open = Column(Numeric, nullable=False)
+    close = Column(Numeric, nullable=False)
+
+
+class CoinCycleClaim(Base):
+    """Lease on one coin for one scheduler cycle, held by the worker that ingests it."""
+    __tablename__ = "coin_cycle_claims"
+    coin_id = Column(Integer, ForeignKey("coins.id"), primary_key=True)
+    cycle_start = Column(Integer, primary_key=True)  # Unix start of the cycle's hour
+    worker_id = Column(String, nullable=False)
+    heartbeat_at = Column(Integer, nullable=False)  # Unix time the holder last renewed the lease
+    finished_at = Column(Integer, nullable=True)
+
+
+class CoinStreamCandle(Base):
+    """Minute and hour candles aggregated from the live price stream."""
+    __tablename__ = "coin_stream_candles"
+    coin_id = Column(Integer, ForeignKey("coins.id"), primary_key=True)
+    period = Column(Integer, primary_key=True)  # Candle length in seconds (60 or 3600)
+    timestamp = Column(Integer, primary_key=True)  # Unix start of the candle
+    open = Column(Numeric, nullable=False)
+    high = Column(Numeric, nullable=False)
+    low = Column(Numeric, nullable=False)
+    close = Column(Numeric, nullable=False)
+
+
+class AlertRule(Base):
+    """A user's price alert on one coin, evaluated as hourly candles are ingested."""
+    __tablename__ = "alert_rules"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    coin_id = Column(Integer, ForeignKey("coins.id"), nullable=False, index=True)
+    kind = Column(String, nullable=False)  # "move", "level" or "extreme"
+    value = Column(Float, nullable=False)  # Percent for move, price for level, days for extreme
+    window = Column(Integer, nullable=True)  # Hours a move is measured over
+    direction = Column(String, nullable=False, default="any")  # "up", "down" or "any"
+    created_by = Column(String, nullable=False)
+    created_at = Column(Integer, nullable=False)
+    last_triggered_at = Column(Integer, nullable=True)
+    enabled = Column(Boolean, nullable=False, default=True)
+
+
+class CoinIndicator(Base):
+    """SMA/EMA/RSI/volatility after each daily or hourly candle; NULL until enough candles exist."""
+    __tablename__ = "coin_indicators"
+    coin_id = Column(Integer, ForeignKey("coins.id"), primary_key=True)
+    period = Column(Integer, primary_key=True)  # Candle length in seconds (86400 or 3600)
+    timestamp = Column(Integer, primary_key=True)  # Unix start of the candle
+    # Single precision keeps the table small; indicators do not need more
+    sma_20 = Column(Float(24))
+    sma_50 = Column(Float(24))
+    ema_12 = Column(Float(24))
+    ema_26 = Column(Float(24))
+    rsi_14 = Column(Float(24))
+    volatility_20 = Column(Float(24))  # Std. deviation of the last 20 log returns, in percent
+
+
+class CoinIndicatorState(Base):
+    """Running indicator state after the latest candle, so the next one is an O(1) update."""
+    __tablename__ = "coin_indicator_state"
+    coin_id = Column(Integer, ForeignKey("coins.id"), primary_key=True)
+    period = Column(Integer, primary_key=True)
+    timestamp = Column(Integer, nullable=False)  # Last candle folded in
+    state = Column(JSON, nullable=False)
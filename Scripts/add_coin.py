@@ -1,14 +1,13 @@
-﻿import requests
-import os
+﻿import os
 from dotenv import load_dotenv
 from datetime import datetime
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
 from Models.coins import *
 import time
-from db import get_engine
+from db import SessionLocal
+from sqlalchemy.dialects.postgresql import insert
 from Scripts.sendDiscordMessage import send_message
-from Scripts.get_historic_coin_data import main as get_coin_historic
+from Scripts.providers import COININFO
+from Scripts.get_historic_coin_data import main as get_coin_historic, make_api_request
 
 
 
@@ -22,47 +21,137 @@ elif ENVIROMENT == 'production':
 else:
     load_dotenv(encoding="utf-8-sig")  # Default to a standard .env file
 API_KEY = os.getenv("API_KEY")
-API_COIN_INFO_BASE_URL = os.getenv("API_COIN_INFO_BASE_URL")
+# Symbols per coininfo request; the API takes a comma-separated fsym list
+COININFO_BATCH_SIZE = int(os.getenv("COININFO_BATCH_SIZE", "50"))
 
 
-def get_content_created(symbol):
-    """Fetch content_created from an API"""
-    apiUrl = f"{API_COIN_INFO_BASE_URL}{symbol}&api_key={API_KEY}"
+def parse_coin_info(info):
+    """{"name", "ContentCreatedOn"} from one coininfo entry, or None without a usable launch date."""
+    try:
+        date_obj = datetime.strptime(info["AssetLaunchDate"], "%Y-%m-%d")
+    except (KeyError, TypeError, ValueError):
+        return None
+    return {"name": info["FullName"], "ContentCreatedOn": int(time.mktime(date_obj.timetuple()))}
 
-    response = requests.get(apiUrl)
 
-    data = response.json()
+def get_content_created(symbol):
+    """Fetch content_created from an API"""
+    data = make_api_request(COININFO, {"fsym": symbol, "api_key": API_KEY})
     if data["Response"] == "Success":
-        name = data["Data"][symbol]["FullName"]
-        date_obj = datetime.strptime(data["Data"][symbol]["AssetLaunchDate"], "%Y-%m-%d")
-        ContentCreatedOn = int(time.mktime(date_obj.timetuple()))
-        FinalData = {"name": name, "ContentCreatedOn": ContentCreatedOn}
-        return FinalData
+        FinalData = parse_coin_info(data["Data"].get(symbol, {}))
+        return FinalData if FinalData is not None else "Error"
     else:
         return data["Response"]
 
-def add_coin(symbol,webhook):
-    engine = get_engine()
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def get_coins_info(symbols):
+    """
+    Metadata for many symbols with one coininfo request per COININFO_BATCH_SIZE
+    symbols. Returns {symbol: {"name", "ContentCreatedOn"}}; unknown symbols are
+    left out. A batch the API rejects is retried one symbol at a time.
+    """
+    found = {}
+    for start in range(0, len(symbols), COININFO_BATCH_SIZE):
+        batch = symbols[start:start + COININFO_BATCH_SIZE]
+        data = make_api_request(COININFO, {"fsym": ",".join(batch), "api_key": API_KEY})
+        if data["Response"] == "Success":
+            for symbol in batch:
+                info = parse_coin_info(data["Data"].get(symbol, {})) if symbol in data["Data"] else None
+                if info is not None:
+                    found[symbol] = info
+            continue
+        for symbol in batch:
+            info = get_content_created(symbol)
+            if isinstance(info, dict):
+                found[symbol] = info
+    return found
+
+
+def parse_symbols(text):
+    """Upper-case, de-duplicated symbols from a comma, space or newline separated list."""
+    symbols = []
+    for symbol in text.replace(",", " ").split():
+        symbol = symbol.strip().upper()
+        if symbol and symbol not in symbols:
+            symbols.append(symbol)
+    return symbols
+
+
+def add_coins(symbols, webhook):
+    """
+    Add many coins at once without backfilling them. Metadata comes from batched
+    coininfo requests and every new row is inserted in one transaction.
+    Returns (added coins, {symbol: reason} for the ones that were skipped).
+    """
+    skipped = {}
+    session = SessionLocal()
+    try:
+        existing = {symbol for (symbol,) in session.query(Coin.symbol).filter(Coin.symbol.in_(symbols))}
+        for symbol in existing:
+            skipped[symbol] = "already tracked"
+        session.commit()
+        pending = [symbol for symbol in symbols if symbol not in existing]
+        info = get_coins_info(pending)
+        for symbol in pending:
+            if symbol not in info:
+                skipped[symbol] = "unknown symbol"
+        rows = [
+            {
+                "symbol": symbol,
+                "name": info[symbol]["name"],
+                "content_created": info[symbol]["ContentCreatedOn"],
+                "last_time_tracked": info[symbol]["ContentCreatedOn"],
+                "webhook_url": webhook,
+            }
+            for symbol in pending if symbol in info
+        ]
+        added = []
+        if rows:
+            # A coin added concurrently by someone else is skipped, not an error
+            statement = insert(Coin).values(rows).on_conflict_do_nothing(index_elements=["symbol"]).returning(Coin.id)
+            new_ids = [coin_id for (coin_id,) in session.execute(statement)]
+            session.commit()
+            added = session.query(Coin).filter(Coin.id.in_(new_ids)).order_by(Coin.symbol).all()
+            for coin in added:
+                session.expunge(coin)
+            added_symbols = {coin.symbol for coin in added}
+            for row in rows:
+                if row["symbol"] not in added_symbols:
+                    skipped[row["symbol"]] = "already tracked"
+        return added, skipped
+    finally:
+        session.close()
+
+def add_coin(symbol, webhook, backfill=True):
+    """
+    Add a coin and, unless `backfill` is False, run its historic backfill.
+    Returns the new Coin, or None if the symbol is unknown to the API.
+    """
     # Fetch content_created from API
     
 
     data = get_content_created(symbol)
     if data == "Error":
-        return
+        return None
     else:
         name = data["name"]
         ContentCreatedOn = data["ContentCreatedOn"]
         # Add coin to the database
         session = SessionLocal()
-        new_coin = Coin(
-            symbol=symbol,
-            name=name,
-            content_created=ContentCreatedOn,
-            last_time_tracked=ContentCreatedOn,
-            webhook_url = webhook
-        )
-        session.add(new_coin)
-        session.commit()
-        get_coin_historic(new_coin, False)
-
+        try:
+            new_coin = Coin(
+                symbol=symbol,
+                name=name,
+                content_created=ContentCreatedOn,
+                last_time_tracked=ContentCreatedOn,
+                webhook_url = webhook
+            )
+            session.add(new_coin)
+            session.commit()
+            session.refresh(new_coin)
+            session.expunge(new_coin)
+        finally:
+            session.close()
+        if backfill:
+            get_coin_historic(new_coin, False)
+        return new_coin
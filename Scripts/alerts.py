@@ -0,0 +1,434 @@
+﻿"""
+Per-coin price alerts, evaluated as hourly candles are ingested.
+
+A rule is one of:
+    move     the close moved `value` percent over the last `window` hours
+    level    the close crossed the price `value`
+    extreme  the candle set a new `value`-day high (up) or low (down)
+
+Each coin keeps one rolling structure per distinct move window and per
+distinct extreme length, shared by every rule that uses it, so a new candle
+costs amortised O(1) per structure plus one comparison per rule. History is
+read from the database once, when a coin is first seen (or after the process
+missed some of its hours), never per update.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from sqlalchemy.orm import Session
+from Models.coins import AlertRule, Coin, CoinHistoric, CoinHourly
+from Scripts.sendDiscordMessage import send_message
+from Scripts import metrics
+
+
+HOUR_SECONDS = 3600
+DAY_SECONDS = 86400
+KINDS = ("move", "level", "extreme")
+DIRECTIONS = ("up", "down", "any")
+# Longest move window and extreme length a rule may use
+MAX_MOVE_HOURS = 24 * 30
+MAX_EXTREME_DAYS = 365
+
+
+class WindowMove:
+    """Closes of the last `seconds` seconds, for the percentage move across the window."""
+    __slots__ = ("seconds", "points", "first_seen")
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        self.points = deque()
+        self.first_seen = None
+
+    def push(self, timestamp: int, close: float):
+        if self.first_seen is None:
+            self.first_seen = timestamp
+        self.points.append((timestamp, close))
+        cutoff = timestamp - self.seconds
+        while self.points[0][0] < cutoff:
+            self.points.popleft()
+
+    def change(self):
+        """Percent move from the start of the window, or None until a full window was seen."""
+        if not self.points or self.first_seen > self.points[-1][0] - self.seconds:
+            return None
+        first = self.points[0][1]
+        return (self.points[-1][1] - first) / first * 100 if first else None
+
+
+class WindowExtreme:
+    """Highest (or lowest) value of the last `seconds` seconds, kept in a monotonic deque."""
+    __slots__ = ("seconds", "highest", "points", "first_seen")
+
+    def __init__(self, seconds: int, highest: bool):
+        self.seconds = seconds
+        self.highest = highest
+        self.points = deque()
+        self.first_seen = None
+
+    def current(self, timestamp: int):
+        """Extreme of the window ending at `timestamp`, or None until a full window was seen."""
+        cutoff = timestamp - self.seconds
+        while self.points and self.points[0][0] < cutoff:
+            self.points.popleft()
+        # Daily candles stand for a whole day, so a window starting within the first one counts as full
+        if not self.points or self.first_seen > cutoff + DAY_SECONDS:
+            return None
+        return self.points[0][1]
+
+    def push(self, timestamp: int, value: float):
+        if self.first_seen is None:
+            self.first_seen = timestamp
+        if self.highest:
+            while self.points and self.points[-1][1] <= value:
+                self.points.pop()
+        else:
+            while self.points and self.points[-1][1] >= value:
+                self.points.pop()
+        self.points.append((timestamp, value))
+
+
+class ActiveRule:
+    """Plain copy of an AlertRule, cheaper to read on every candle than the ORM object."""
+    __slots__ = ("id", "coin_id", "kind", "value", "window", "direction", "created_by", "last_triggered_at", "seconds")
+
+    def __init__(self, rule: AlertRule):
+        self.id = rule.id
+        self.coin_id = rule.coin_id
+        self.kind = rule.kind
+        self.value = float(rule.value)
+        self.window = rule.window
+        self.direction = rule.direction
+        self.created_by = rule.created_by
+        self.last_triggered_at = rule.last_triggered_at
+        # Length of the move window or of the high/low window
+        if rule.kind == "move":
+            self.seconds = rule.window * HOUR_SECONDS
+        elif rule.kind == "extreme":
+            self.seconds = int(rule.value) * DAY_SECONDS
+        else:
+            self.seconds = None
+
+
+def structure_keys(rules):
+    """Move windows and extreme lengths (in seconds) the coin's rules need."""
+    moves = frozenset(rule.seconds for rule in rules if rule.kind == "move")
+    extremes = frozenset(rule.seconds for rule in rules if rule.kind == "extreme")
+    return moves, extremes
+
+
+class CoinAlertState:
+    """Rolling state of one coin: last close, move windows and high/low windows."""
+
+    def __init__(self, keys):
+        self.keys = keys
+        moves, extremes = keys
+        self.moves = {seconds: WindowMove(seconds) for seconds in moves}
+        self.highs = {seconds: WindowExtreme(seconds, True) for seconds in extremes}
+        self.lows = {seconds: WindowExtreme(seconds, False) for seconds in extremes}
+        self.last_close = None
+        self.last_time = None
+
+    def push_daily(self, timestamp: int, high: float, low: float):
+        """Older history for the high/low windows, from daily candles."""
+        for seconds, window in self.highs.items():
+            window.push(timestamp, high)
+            self.lows[seconds].push(timestamp, low)
+
+    def push_hour(self, timestamp: int, high: float, low: float, close: float):
+        for seconds, window in self.highs.items():
+            window.push(timestamp, high)
+            self.lows[seconds].push(timestamp, low)
+        for window in self.moves.values():
+            window.push(timestamp, close)
+        self.last_close = close
+        self.last_time = timestamp
+
+    def update(self, timestamp: int, high: float, low: float, close: float):
+        """
+        Fold in one hourly candle and return what the rules compare against:
+        the previous close, the moves and the highs/lows before this candle.
+        """
+        previous = {
+            "close": self.last_close,
+            "highs": {seconds: window.current(timestamp) for seconds, window in self.highs.items()},
+            "lows": {seconds: window.current(timestamp) for seconds, window in self.lows.items()},
+        }
+        self.push_hour(timestamp, high, low, close)
+        previous["moves"] = {seconds: window.change() for seconds, window in self.moves.items()}
+        return previous
+
+
+def check_rule(rule, state, timestamp: int, high: float, low: float, close: float):
+    """Return (text, color) if `rule` fires on this candle, else None."""
+    if rule.kind == "move":
+        change = state["moves"].get(rule.seconds)
+        if change is None:
+            return None
+        if rule.last_triggered_at and timestamp - rule.last_triggered_at < rule.seconds:
+            return None
+        if change >= rule.value and rule.direction != "down":
+            return f"Price rose {change:+.2f}% in the last {rule.window}h (close {close}).", "green"
+        if change <= -rule.value and rule.direction != "up":
+            return f"Price fell {change:+.2f}% in the last {rule.window}h (close {close}).", "red"
+    elif rule.kind == "level":
+        previous = state["close"]
+        if previous is None:
+            return None
+        if previous < rule.value <= close and rule.direction != "down":
+            return f"Price crossed above {rule.value} (close {close}).", "green"
+        if previous > rule.value >= close and rule.direction != "up":
+            return f"Price crossed below {rule.value} (close {close}).", "red"
+    elif rule.kind == "extreme":
+        if rule.last_triggered_at and timestamp - rule.last_triggered_at < DAY_SECONDS:
+            return None
+        prior_high = state["highs"].get(rule.seconds)
+        prior_low = state["lows"].get(rule.seconds)
+        if prior_high is not None and high > prior_high and rule.direction != "down":
+            return f"New {int(rule.value)}-day high of {high} (previous {prior_high}).", "green"
+        if prior_low is not None and low < prior_low and rule.direction != "up":
+            return f"New {int(rule.value)}-day low of {low} (previous {prior_low}).", "red"
+    return None
+
+
+def warm_state(session: Session, coin_id: int, keys, until: int):
+    """Build a coin's state from the candles stored before `until`."""
+    state = CoinAlertState(keys)
+    moves, extremes = keys
+    longest = max(moves | extremes, default=0)
+    if not longest:
+        return state
+    hours = session.query(CoinHourly.timestamp, CoinHourly.high, CoinHourly.low, CoinHourly.close).filter(
+        CoinHourly.coin_id == coin_id,
+        CoinHourly.timestamp >= until - longest,
+        CoinHourly.timestamp < until,
+        CoinHourly.open > 0,
+    ).order_by(CoinHourly.timestamp).all()
+    if extremes:
+        first_hour = hours[0][0] if hours else until
+        days = session.query(CoinHistoric.timestamp, CoinHistoric.high, CoinHistoric.low).filter(
+            CoinHistoric.coin_id == coin_id,
+            CoinHistoric.timestamp >= until - max(extremes),
+            CoinHistoric.timestamp < first_hour,
+            CoinHistoric.open > 0,
+        ).order_by(CoinHistoric.timestamp).all()
+        for timestamp, high, low in days:
+            state.push_daily(timestamp, float(high), float(low))
+    for timestamp, high, low, close in hours:
+        state.push_hour(timestamp, float(high), float(low), float(close))
+    return state
+
+
+class AlertEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = {}  # coin_id -> [AlertRule]
+        self._states = {}  # coin_id -> CoinAlertState
+        self._triggered = {}  # rule id -> candle time it last fired at, not stored yet
+        self.evaluations = 0
+        self.fired = 0
+
+    def set_rules(self, rules):
+        """Replace the rule set; coins whose windows changed are rebuilt on their next candle."""
+        rules = [ActiveRule(rule) for rule in rules]
+        by_coin = {}
+        for rule in rules:
+            by_coin.setdefault(rule.coin_id, []).append(rule)
+        with self._lock:
+            for rule in rules:
+                if rule.id in self._triggered:
+                    rule.last_triggered_at = max(rule.last_triggered_at or 0, self._triggered[rule.id])
+            self._rules = by_coin
+            self._states = {
+                coin_id: state for coin_id, state in self._states.items()
+                if coin_id in by_coin and state.keys == structure_keys(by_coin[coin_id])
+            }
+        metrics.set_gauge("alert_rules", len(rules))
+
+    def sync(self, session: Session):
+        """Reload the enabled rules; one query, meant for the start of each cycle."""
+        rules = session.query(AlertRule).filter(AlertRule.enabled == True).all()
+        for rule in rules:
+            session.expunge(rule)
+        self.set_rules(rules)
+        return len(rules)
+
+    def _state(self, session: Session, coin_id: int, first_time: int):
+        """The coin's state, (re)built from the database if it is new or missed some hours."""
+        with self._lock:
+            rules = self._rules.get(coin_id)
+            if not rules:
+                return None, None
+            state = self._states.get(coin_id)
+        if state is None or state.last_time is None or first_time > state.last_time + HOUR_SECONDS:
+            if session is None:
+                state = CoinAlertState(structure_keys(rules))
+            else:
+                state = warm_state(session, coin_id, structure_keys(rules), first_time)
+                metrics.inc("alert_state_warmups_total")
+            with self._lock:
+                self._states[coin_id] = state
+        return state, rules
+
+    def on_candles(self, coin_id: int, candles, session: Session = None):
+        """
+        Fold newly stored hourly candles (a CandleBatch) into the coin's state
+        and return [(rule, text, color)] for every rule that fired.
+        """
+        if not len(candles):
+            return []
+        state, rules = self._state(session, coin_id, int(candles.time[0]))
+        if state is None:
+            return []
+        fired = []
+        with self._lock:
+            for timestamp, high, low, close in zip(
+                candles.time.tolist(), candles.high.tolist(), candles.low.tolist(), candles.close.tolist()
+            ):
+                if state.last_time is not None and timestamp <= state.last_time:
+                    continue  # Already folded in
+                if not close:
+                    continue  # Placeholder candle
+                previous = state.update(timestamp, high, low, close)
+                candle_close = timestamp + HOUR_SECONDS
+                for rule in rules:
+                    alert = check_rule(rule, previous, candle_close, high, low, close)
+                    if alert is not None:
+                        rule.last_triggered_at = candle_close
+                        self._triggered[rule.id] = candle_close
+                        fired.append((rule, *alert))
+                self.evaluations += len(rules)
+            self.fired += len(fired)
+        if fired:
+            metrics.inc("alerts_fired_total", len(fired))
+        return fired
+
+    def notify(self, coin: Coin, candles, session: Session = None):
+        """on_candles, then post each alert to the coin's webhook."""
+        for rule, text, color in self.on_candles(coin.id, candles, session):
+            send_message(f"<@{rule.created_by}> {text}", coin.webhook_url, coin.name, 'historic', True, color,
+                         title=f" {coin.name} Alert #{rule.id}")
+
+    def persist(self, session: Session):
+        """Store when rules last fired, so cooldowns survive a restart."""
+        with self._lock:
+            triggered, self._triggered = self._triggered, {}
+        for rule_id, fired_at in triggered.items():
+            session.query(AlertRule).filter(AlertRule.id == rule_id).update(
+                {"last_triggered_at": fired_at}, synchronize_session=False
+            )
+        session.commit()
+        return len(triggered)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "coins": len(self._rules),
+                "rules": sum(len(rules) for rules in self._rules.values()),
+                "warm_coins": len(self._states),
+                "evaluations": self.evaluations,
+                "fired": self.fired,
+            }
+
+
+def validate_rule(kind: str, value: float, window: int = None, direction: str = "any"):
+    """Error text for an invalid rule, or None."""
+    if kind not in KINDS:
+        return f"Unknown alert kind {kind}."
+    if direction not in DIRECTIONS:
+        return f"Unknown direction {direction}."
+    if value is None or value <= 0:
+        return "The value must be positive."
+    if kind == "move" and not (window and 1 <= window <= MAX_MOVE_HOURS):
+        return f"A move alert needs a window between 1 and {MAX_MOVE_HOURS} hours."
+    if kind == "extreme" and not (value == int(value) and 1 <= value <= MAX_EXTREME_DAYS):
+        return f"A high/low alert needs a whole number of days between 1 and {MAX_EXTREME_DAYS}."
+    return None
+
+
+def add_rule(session: Session, coin_id: int, kind: str, value: float, window: int, direction: str, created_by: str):
+    rule = AlertRule(
+        coin_id=coin_id,
+        kind=kind,
+        value=value,
+        window=window if kind == "move" else None,
+        direction=direction,
+        created_by=str(created_by),
+        created_at=int(time.time()),
+        enabled=True,
+    )
+    session.add(rule)
+    session.commit()
+    return rule.id
+
+
+def list_rules(session: Session, created_by: str = None, coin_id: int = None):
+    """Enabled rules with their coin symbol, as [(rule, symbol)]."""
+    query = session.query(AlertRule, Coin.symbol).join(Coin, Coin.id == AlertRule.coin_id).filter(
+        AlertRule.enabled == True
+    )
+    if created_by is not None:
+        query = query.filter(AlertRule.created_by == str(created_by))
+    if coin_id is not None:
+        query = query.filter(AlertRule.coin_id == coin_id)
+    return query.order_by(Coin.symbol, AlertRule.id).all()
+
+
+def remove_rule(session: Session, rule_id: int, created_by: str = None):
+    """Delete a rule; with `created_by`, only that user's. Returns whether a rule was removed."""
+    query = session.query(AlertRule).filter(AlertRule.id == rule_id)
+    if created_by is not None:
+        query = query.filter(AlertRule.created_by == str(created_by))
+    removed = query.delete(synchronize_session=False)
+    session.commit()
+    return bool(removed)
+
+
+def describe_rule(rule, symbol: str):
+    if rule.kind == "move":
+        sign = {"up": "+", "down": "-", "any": "±"}[rule.direction]
+        return f"#{rule.id} {symbol} moves {sign}{rule.value:g}% within {rule.window}h"
+    if rule.kind == "level":
+        side = {"up": "above", "down": "below", "any": "above or below"}[rule.direction]
+        return f"#{rule.id} {symbol} crosses {side} {rule.value:g}"
+    side = {"up": "high", "down": "low", "any": "high or low"}[rule.direction]
+    return f"#{rule.id} {symbol} sets a new {int(rule.value)}-day {side}"
+
+
+_alert_engine = None
+_alert_engine_lock = threading.Lock()
+
+
+def get_alert_engine() -> AlertEngine:
+    global _alert_engine
+    if _alert_engine is None:
+        with _alert_engine_lock:
+            if _alert_engine is None:
+                _alert_engine = AlertEngine()
+    return _alert_engine
+
+
+def sync_alert_rules(session_factory):
+    """Start-of-cycle reload of the rules; the previous rules stay in use if it fails."""
+    session = session_factory()
+    try:
+        return get_alert_engine().sync(session)
+    except Exception as e:
+        session.rollback()
+        logging.exception(f"Could not load alert rules: {e}")
+        return None
+    finally:
+        session.close()
+
+
+def persist_alert_triggers(session_factory):
+    """End-of-cycle write of the rules that fired."""
+    session = session_factory()
+    try:
+        return get_alert_engine().persist(session)
+    except Exception as e:
+        session.rollback()
+        logging.exception(f"Could not store fired alerts: {e}")
+        return None
+    finally:
+        session.close()
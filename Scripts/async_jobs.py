@@ -0,0 +1,105 @@
+﻿import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Scripts import metrics
+
+
+BOT_EXECUTOR_WORKERS = int(os.getenv("BOT_EXECUTOR_WORKERS", "4"))
+BOT_BACKFILL_WORKERS = int(os.getenv("BOT_BACKFILL_WORKERS", "2"))
+# Blocking DB/HTTP work from the bot runs here, never on the event loop
+blocking_executor = ThreadPoolExecutor(max_workers=BOT_EXECUTOR_WORKERS, thread_name_prefix="bot-blocking")
+# Backfills take minutes, keep them off the pool that serves interactive commands
+backfill_executor = ThreadPoolExecutor(max_workers=BOT_BACKFILL_WORKERS, thread_name_prefix="bot-backfill")
+_background_jobs = set()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the bounded executor and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_backfill(func, *args, **kwargs):
+    """Like run_blocking, but on the executor reserved for long backfills."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(backfill_executor, functools.partial(func, *args, **kwargs))
+
+
+def start_background_job(name, coro):
+    """
+    Schedule a long running coroutine without awaiting it. A reference is kept
+    until it finishes so the task is not garbage collected mid-run.
+    """
+    task = asyncio.get_running_loop().create_task(coro, name=name)
+    _background_jobs.add(task)
+
+    def _done(task):
+        _background_jobs.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Background job {name} failed: {task.exception()!r}")
+
+    task.add_done_callback(_done)
+    return task
+
+
+def background_job_count():
+    return len(_background_jobs)
+
+
+def threadsafe_notifier(loop, send):
+    """
+    Wrap an async `send(message)` so worker threads can call it synchronously,
+    e.g. to post backfill progress as interaction followups.
+    """
+    def notify(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop)
+    return notify
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed sleep."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.samples = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self._task = None
+
+    @property
+    def average_lag(self):
+        return self.total_lag / self.samples if self.samples else 0.0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="loop-lag-monitor")
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.samples += 1
+            self.last_lag = lag
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.set_gauge("event_loop_lag_seconds", lag)
+
+    def summary(self):
+        return (
+            f"Event loop lag: last {self.last_lag * 1000:.1f}ms, "
+            f"avg {self.average_lag * 1000:.1f}ms, max {self.max_lag * 1000:.1f}ms "
+            f"over {self.samples} samples; {background_job_count()} background jobs running"
+        )
+
+
+loop_lag_monitor = LoopLagMonitor()
@@ -0,0 +1,110 @@
+﻿"""
+Columnar candle batches backed by NumPy arrays, so validation, filtering and
+day-bucketing of API pages run as array operations instead of per-dict loops.
+"""
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+
+FIELDS = ("open", "high", "low", "close")
+
+
+class CandleBatch:
+    """Parallel arrays of unix `time` (int64) and open/high/low/close (float64)."""
+
+    __slots__ = ("time", "open", "high", "low", "close")
+
+    def __init__(self, time, open, high, low, close):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+
+    @classmethod
+    def from_api(cls, entries: list):
+        """Build a batch from the API's list of candle dicts."""
+        count = len(entries)
+        columns = {
+            name: np.fromiter((entry[name] for entry in entries), dtype=np.float64, count=count)
+            for name in FIELDS
+        }
+        time = np.fromiter((entry["time"] for entry in entries), dtype=np.int64, count=count)
+        return cls(time, **columns)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [])
+
+    def __len__(self):
+        return len(self.time)
+
+    def select(self, mask_or_index):
+        return CandleBatch(
+            self.time[mask_or_index],
+            self.open[mask_or_index],
+            self.high[mask_or_index],
+            self.low[mask_or_index],
+            self.close[mask_or_index],
+        )
+
+    def sorted(self):
+        if len(self) < 2 or np.all(self.time[1:] >= self.time[:-1]):
+            return self
+        return self.select(np.argsort(self.time, kind="stable"))
+
+    def zero_mask(self):
+        """True where all of open, high, low and close are 0 (no trading yet)."""
+        return (self.open == 0) & (self.high == 0) & (self.low == 0) & (self.close == 0)
+
+    def between(self, start=None, end=None):
+        """Mask of candles with start <= time < end (either bound optional)."""
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= self.time >= start
+        if end is not None:
+            mask &= self.time < end
+        return mask
+
+    def utc_offsets(self, tz):
+        """UTC offset in seconds of `tz` at every candle time."""
+        transitions = getattr(tz, "_utc_transition_times", None)
+        if transitions:
+            # pytz zones carry their DST transition table; look every candle up at once
+            edges = np.array(
+                [int(pytz.utc.localize(moment).timestamp()) if moment.year > 1 else np.iinfo(np.int64).min
+                 for moment in transitions],
+                dtype=np.int64,
+            )
+            offsets = np.array([int(info[0].total_seconds()) for info in tz._transition_info], dtype=np.int64)
+            index = np.searchsorted(edges, self.time, side="right") - 1
+            return offsets[np.clip(index, 0, len(offsets) - 1)]
+        # Fixed-offset zones (UTC) and anything without a table: one lookup per distinct hour
+        hours, inverse = np.unique(self.time // 3600, return_inverse=True)
+        offsets = np.array(
+            [int(pytz.utc.localize(datetime.utcfromtimestamp(int(hour) * 3600)).astimezone(tz).utcoffset().total_seconds())
+             for hour in hours],
+            dtype=np.int64,
+        )
+        return offsets[inverse]
+
+    def local_day_start(self, tz):
+        """Unix time of the local midnight (in `tz`) starting each candle's day."""
+        offsets = self.utc_offsets(tz)
+        local = self.time + offsets
+        day = local - local % 86400
+        # Midnight's offset can differ from the candle's on DST days; correct with a second lookup
+        midnight = CandleBatch(day - offsets, *([np.zeros(len(self))] * 4))
+        return day - midnight.utc_offsets(tz)
+
+    def to_rows(self, **extra):
+        """List of dicts for a bulk INSERT, with `extra` columns added to every row."""
+        return [
+            {**extra, "timestamp": int(t), "open": o, "high": h, "low": l, "close": c}
+            for t, o, h, l, c in zip(
+                self.time.tolist(), self.open.tolist(), self.high.tolist(), self.low.tolist(), self.close.tolist()
+            )
+        ]
+
@@ -0,0 +1,193 @@
+﻿"""
+Local stand-in for the CryptoCompare endpoints used by ingestion, for offline
+load tests and benchmarks.
+
+Usage: python -m Scripts.fake_market_server [--port 8765] [--latency 0.05]
+           [--error-rate 0.01] [--rate-limit 50] [--replay-dir DIR]
+
+Point the app at it with MARKET_DATA_BASE_URL=http://127.0.0.1:8765. Any POST
+is answered with 204, so it can also stand in for coin webhook URLs.
+Candles are synthetic but deterministic: the same symbol and time always give
+the same OHLC, so windows fetched in any order agree with each other.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from Scripts.providers import ENDPOINT_PATHS, HISTODAY, HISTOHOUR, COININFO, PRICE_MULTI, ReplayProvider
+from Scripts.rate_limiter import TokenBucket
+
+
+# Synthetic coins are listed on this date; earlier candles are all zeros like the real API
+DEFAULT_LISTED_SINCE = int(datetime(2015, 1, 1, tzinfo=timezone.utc).timestamp())
+DEFAULT_MAX_LIMIT = 2000
+
+
+def _unit(*parts):
+    """Deterministic pseudo-random float in [0, 1) for the given parts."""
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def synthetic_price(symbol: str, timestamp: int):
+    """Price of `symbol` at `timestamp`: a slow per-coin sine trend with per-second noise."""
+    base = 10 + 1000 * _unit(symbol)
+    phase = 2 * math.pi * _unit(symbol, "phase")
+    trend = 1 + 0.5 * math.sin(timestamp / (86400 * 180) + phase)
+    return base * trend * (1 + 0.02 * (_unit(symbol, timestamp) - 0.5))
+
+
+def synthetic_candle(symbol: str, timestamp: int, period: int, listed_since: int = DEFAULT_LISTED_SINCE):
+    if timestamp < listed_since:
+        return {"time": timestamp, "high": 0, "low": 0, "open": 0, "close": 0, "volumefrom": 0, "volumeto": 0}
+    open_price = synthetic_price(symbol, timestamp)
+    close_price = synthetic_price(symbol, timestamp + period)
+    spread = 0.01 * _unit(symbol, timestamp, "spread")
+    return {
+        "time": timestamp,
+        "open": round(open_price, 8),
+        "close": round(close_price, 8),
+        "high": round(max(open_price, close_price) * (1 + spread), 8),
+        "low": round(min(open_price, close_price) * (1 - spread), 8),
+        "volumefrom": round(1000 * _unit(symbol, timestamp, "volume"), 4),
+        "volumeto": 0,
+    }
+
+
+def history_response(symbol: str, period: int, to_ts: int, limit: int, listed_since: int):
+    last = to_ts - to_ts % period
+    first = last - limit * period
+    data = [synthetic_candle(symbol, t, period, listed_since) for t in range(first, last + period, period)]
+    return {"Aggregated": False, "TimeFrom": first, "TimeTo": last, "Data": data}
+
+
+class FakeMarketServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, error_rate=0.0, rate_limit=None,
+                 listed_since=DEFAULT_LISTED_SINCE, replay_dir=None, seed=None):
+        super().__init__(address, FakeMarketHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.listed_since = listed_since
+        self.replay = ReplayProvider(replay_dir) if replay_dir else None
+        self.random = random.Random(seed)
+        self.counters = {"requests": 0, "errors": 0, "rate_limited": 0, "webhooks": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def start(self):
+        """Serve from a daemon thread; returns the server for chaining."""
+        threading.Thread(target=self.serve_forever, name="fake-market-server", daemon=True).start()
+        return self
+
+
+class FakeMarketHandler(BaseHTTPRequestHandler):
+    ROUTES = {path: endpoint for endpoint, path in ENDPOINT_PATHS.items()}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        server.count("requests")
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        endpoint = self.ROUTES.get(url.path)
+        if server.latency:
+            time.sleep(server.latency)
+        if endpoint is None:
+            self._send_json(404, {"Response": "Error", "Message": f"Unknown path {url.path}"})
+            return
+        if server.bucket is not None and not server.bucket.try_acquire():
+            server.count("rate_limited")
+            self._send_json(429, {"Response": "Error", "Message": "You are over your rate limit please upgrade your account!"},
+                            {"Retry-After": "1"})
+            return
+        if server.error_rate and server.random.random() < server.error_rate:
+            server.count("errors")
+            self._send_json(500, {"Response": "Error", "Message": "Injected server error"})
+            return
+        if server.replay is not None:
+            self._send_json(200, server.replay.request(endpoint, params))
+            return
+        self._send_json(200, self.synthetic(endpoint, params))
+
+    def do_POST(self):
+        """Any POST is accepted as a Discord webhook delivery."""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.count("webhooks")
+        self.send_response(204)
+        self.end_headers()
+
+    def synthetic(self, endpoint, params):
+        server = self.server
+        now = int(time.time())
+        if endpoint == PRICE_MULTI:
+            # Like the real endpoint, live prices come back without the Response/Data envelope
+            return {
+                symbol: {tsym: round(synthetic_price(symbol, now), 8) for tsym in params["tsyms"].split(",")}
+                for symbol in params["fsyms"].split(",")
+            }
+        to_ts = int(params.get("toTs", now))
+        limit = min(int(params.get("limit", 30)), DEFAULT_MAX_LIMIT)
+        if endpoint == HISTODAY:
+            data = history_response(params["fsym"], 86400, to_ts, limit, server.listed_since)
+        elif endpoint == HISTOHOUR:
+            data = history_response(params["fsym"], 3600, to_ts, limit, server.listed_since)
+        elif endpoint == COININFO:
+            launch = datetime.fromtimestamp(server.listed_since, timezone.utc).strftime("%Y-%m-%d")
+            data = {
+                symbol: {"FullName": f"{symbol} ({symbol})", "Symbol": symbol, "AssetLaunchDate": launch}
+                for symbol in params["fsym"].split(",")
+            }
+        return {"Response": "Success", "Message": "", "Data": data}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Requests per second before answering 429")
+    parser.add_argument("--replay-dir", default=None, help="Serve responses recorded with MARKET_DATA_PROVIDER=record")
+    args = parser.parse_args()
+    server = FakeMarketServer((args.host, args.port), args.latency, args.error_rate, args.rate_limit,
+                              replay_dir=args.replay_dir)
+    print(f"Fake market data server on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served: {server.counters}")
+
+
+if __name__ == "__main__":
+    main()
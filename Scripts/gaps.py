@@ -0,0 +1,304 @@
+﻿"""
+Find holes in the stored daily and hourly candles and fetch only those.
+
+Usage:
+    python -m Scripts.gaps report [SYMBOL]
+    python -m Scripts.gaps repair [SYMBOL]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import pytz
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from Models.coins import Coin, CoinHistoric, CoinHourly, SessionLocal
+from Scripts.candles import CandleBatch
+from Scripts.indicators import record_indicators, PERIODS
+from Scripts.providers import HISTOHOUR
+from Scripts.rollups import rebuild_rollup_periods
+from Scripts.get_historic_coin_data import (
+    API_KEY, DAY_SECONDS, fetch_backfill_window, make_api_request, save_hourly_data_to_db, close_daily_candle,
+)
+
+
+LocalTz = pytz.timezone('Europe/London')
+HOUR_SECONDS = 3600
+# Hours are only checked this far back; older hourly data is not needed for anything
+GAP_HOURLY_DAYS = int(os.getenv("GAP_HOURLY_DAYS", "7"))
+# Largest number of candles the API returns for one request
+MAX_CANDLES_PER_REQUEST = 2000
+
+# Daily rows are stamped at UTC midnight by backfills but at local midnight by the
+# hourly path, so days are numbered by the nearest UTC midnight
+DAY_GAPS_SQL = """
+    WITH days AS (
+        SELECT coin_id,
+               (timestamp + 43200) / 86400 AS day,
+               LEAD((timestamp + 43200) / 86400) OVER (PARTITION BY coin_id ORDER BY timestamp) AS next_day
+        FROM coin_historic
+        WHERE open > 0 {coin_filter}
+    )
+    SELECT coin_id, day + 1 AS first_missing, COALESCE(next_day, :until_day) - 1 AS last_missing
+    FROM days
+    WHERE COALESCE(next_day, :until_day) - day > 1
+    ORDER BY coin_id, day
+"""
+
+HOUR_GAPS_SQL = """
+    WITH bounds AS (
+        SELECT coin_id, GREATEST(MIN(timestamp), :since) AS first_hour
+        FROM coin_hourly
+        WHERE true {coin_filter}
+        GROUP BY coin_id
+    )
+    SELECT b.coin_id, h.hour
+    FROM bounds b
+    CROSS JOIN LATERAL generate_series(b.first_hour, :until - 3600, 3600) AS h(hour)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM coin_hourly c WHERE c.coin_id = b.coin_id AND c.timestamp = h.hour
+    )
+    ORDER BY b.coin_id, h.hour
+"""
+
+DAY_STATS_SQL = """
+    SELECT coin_id, MIN(timestamp), MAX(timestamp), COUNT(DISTINCT (timestamp + 43200) / 86400)
+    FROM coin_historic
+    WHERE open > 0 {coin_filter}
+    GROUP BY coin_id
+"""
+
+
+def _coin_filter(coin_ids):
+    return "" if coin_ids is None else "AND coin_id = ANY(:coin_ids)"
+
+
+def _runs(values, step):
+    """Group sorted values into (first, last) runs of consecutive multiples of `step`."""
+    runs = []
+    for value in values:
+        if runs and value == runs[-1][1] + step:
+            runs[-1][1] = value
+        else:
+            runs.append([value, value])
+    return [tuple(run) for run in runs]
+
+
+def current_day_number():
+    """Day number (by UTC midnight) of today, whose candle is still open."""
+    return int(time.time()) // DAY_SECONDS
+
+
+def find_day_gaps(session: Session, coin_ids=None, until_day: int = None):
+    """
+    Missing daily candles between each coin's first stored day and yesterday,
+    found with one LEAD() pass. Returns {coin_id: [(first_day_ts, last_day_ts), ...]}.
+    """
+    until_day = current_day_number() if until_day is None else until_day
+    rows = session.execute(
+        text(DAY_GAPS_SQL.format(coin_filter=_coin_filter(coin_ids))),
+        {"until_day": until_day, "coin_ids": list(coin_ids or [])},
+    )
+    gaps = {}
+    for coin_id, first_missing, last_missing in rows:
+        gaps.setdefault(coin_id, []).append((int(first_missing) * DAY_SECONDS, int(last_missing) * DAY_SECONDS))
+    return gaps
+
+
+def find_hour_gaps(session: Session, coin_ids=None, days: int = GAP_HOURLY_DAYS, until: int = None):
+    """
+    Missing hourly candles in the last `days` days, from each coin's first stored
+    hour, up to but excluding the newest closed hour (the regular run's job).
+    Returns {coin_id: [(first_hour_ts, last_hour_ts), ...]}.
+    """
+    if until is None:
+        until = int(time.time()) // HOUR_SECONDS * HOUR_SECONDS - HOUR_SECONDS
+    since = until - days * DAY_SECONDS
+    rows = session.execute(
+        text(HOUR_GAPS_SQL.format(coin_filter=_coin_filter(coin_ids))),
+        {"since": since, "until": until, "coin_ids": list(coin_ids or [])},
+    )
+    hours = {}
+    for coin_id, hour in rows:
+        hours.setdefault(coin_id, []).append(int(hour))
+    return {coin_id: _runs(values, HOUR_SECONDS) for coin_id, values in hours.items()}
+
+
+def _chunks(first, last, step):
+    """Split [first, last] into ranges of at most MAX_CANDLES_PER_REQUEST candles."""
+    span = MAX_CANDLES_PER_REQUEST * step
+    while first <= last:
+        yield first, min(last, first + span - step)
+        first += span
+
+
+def stored_daily_candle(session: Session, coin_id: int, day_start: int):
+    """The daily row of the day starting at `day_start`, matched by day number like DAY_GAPS_SQL."""
+    midday = (day_start + 43200) // DAY_SECONDS * DAY_SECONDS
+    return session.query(CoinHistoric).filter(
+        CoinHistoric.coin_id == coin_id,
+        CoinHistoric.timestamp >= midday - 43200,
+        CoinHistoric.timestamp < midday + 43200,
+    ).order_by((CoinHistoric.open > 0).desc()).first()
+
+
+def repair_hours(session: Session, coin: Coin, runs, tsym: str = "USD"):
+    """
+    Fetch and store the missing hours, then close the past days they belong to
+    that now have every hour stored but no complete daily candle yet. Days the
+    backfill already closed are left alone.
+    """
+    inserted = 0
+    days = set()
+    for first, last in runs:
+        for start, end in _chunks(first, last, HOUR_SECONDS):
+            result = make_api_request(HISTOHOUR, {
+                "fsym": coin.symbol,
+                "tsym": tsym,
+                "limit": (end - start) // HOUR_SECONDS,
+                "toTs": end,
+                "api_key": API_KEY,
+            })
+            if result["Response"] != "Success":
+                raise RuntimeError(f"Error fetching hourly data: {result['Message']}")
+            candles = CandleBatch.from_api(result["Data"]["Data"])
+            candles = candles.select(candles.between(start, end + 1) & ~candles.zero_mask())
+            inserted += save_hourly_data_to_db(session, coin.id, candles.to_rows())
+            days.update(candles.local_day_start(LocalTz).tolist())
+    today = LocalTz.localize(datetime.now(LocalTz).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0))
+    closed = []
+    for day_start in sorted(day for day in days if day < today.timestamp()):
+        local_day = datetime.fromtimestamp(day_start, LocalTz).replace(tzinfo=None) + timedelta(days=1)
+        day_end = int(LocalTz.localize(local_day.replace(hour=0)).timestamp())
+        stored_hours = session.query(func.count(CoinHourly.timestamp)).filter(
+            CoinHourly.coin_id == coin.id,
+            CoinHourly.timestamp >= day_start,
+            CoinHourly.timestamp < day_end,
+        ).scalar()
+        if stored_hours < (day_end - day_start) // HOUR_SECONDS:
+            continue
+        coin_historic = stored_daily_candle(session, coin.id, day_start)
+        if coin_historic is not None and coin_historic.open > 0 and coin_historic.close > 0:
+            continue
+        if coin_historic is None:
+            coin_historic = CoinHistoric(coin_id=coin.id, open=0, high=0, low=0, close=0, timestamp=day_start)
+            session.add(coin_historic)
+        close_daily_candle(session, coin_historic, day_start, day_end, merge_rollups=False)
+        closed.append(coin_historic.timestamp)
+    if closed:
+        rebuild_rollup_periods(session, coin.id, min(closed), max(closed))
+    session.commit()
+    return inserted
+
+
+def repair_coin(coin: Coin, tsym: str = "USD"):
+    """Fill every detected daily and hourly gap of one coin. Returns (days, hours) inserted."""
+    session = SessionLocal()
+    try:
+        coin = session.merge(coin, load=False)
+        day_runs = find_day_gaps(session, [coin.id]).get(coin.id, [])
+        hour_runs = find_hour_gaps(session, [coin.id]).get(coin.id, [])
+        session.commit()
+        today_candle_ts = current_day_number() * DAY_SECONDS
+        days = 0
+        for first, last in day_runs:
+            for window in _chunks(first, last, DAY_SECONDS):
+                days += fetch_backfill_window(coin.id, coin.symbol, tsym, window, today_candle_ts, checkpoint=False)
+        hours = repair_hours(session, coin, hour_runs, tsym) if hour_runs else 0
+        if days or hours:
+            print(f"Repaired {coin.symbol}: {days} days and {hours} hours filled in.")
+            # Filled holes lie before the running state, so the series are recomputed
+            record_indicators(session, coin.id, PERIODS["daily"])
+        if hours:
+            record_indicators(session, coin.id, PERIODS["hourly"])
+        return days, hours
+    finally:
+        session.close()
+
+
+def repair_all_gaps():
+    """Scheduled pass: repair every backfilled coin that has a hole."""
+    session = SessionLocal()
+    try:
+        coins = session.query(Coin).filter(Coin.history_check == True).all()
+        day_gaps = find_day_gaps(session)
+        hour_gaps = find_hour_gaps(session)
+        for coin in coins:
+            session.expunge(coin)
+    finally:
+        session.close()
+    repaired = {}
+    for coin in coins:
+        if coin.id not in day_gaps and coin.id not in hour_gaps:
+            continue
+        try:
+            repaired[coin.symbol] = repair_coin(coin)
+        except Exception as e:
+            print(f"Error repairing gaps of {coin.symbol}: {e}")
+    return repaired
+
+
+def coverage_report(session: Session, coin_ids=None):
+    """Per-coin coverage: first/last stored day, days stored and missing, missing recent hours."""
+    stats = {
+        coin_id: (first, last, stored)
+        for coin_id, first, last, stored in session.execute(
+            text(DAY_STATS_SQL.format(coin_filter=_coin_filter(coin_ids))),
+            {"coin_ids": list(coin_ids or [])},
+        )
+    }
+    day_gaps = find_day_gaps(session, coin_ids)
+    hour_gaps = find_hour_gaps(session, coin_ids)
+    query = session.query(Coin.id, Coin.symbol).order_by(Coin.symbol)
+    if coin_ids is not None:
+        query = query.filter(Coin.id.in_(coin_ids))
+    report = []
+    for coin_id, symbol in query:
+        first, last, stored = stats.get(coin_id, (None, None, 0))
+        missing_days = sum((end - start) // DAY_SECONDS + 1 for start, end in day_gaps.get(coin_id, []))
+        missing_hours = sum((end - start) // HOUR_SECONDS + 1 for start, end in hour_gaps.get(coin_id, []))
+        report.append({
+            "symbol": symbol,
+            "first_day": first,
+            "last_day": last,
+            "days_stored": stored,
+            "missing_days": missing_days,
+            "missing_hours": missing_hours,
+            "coverage": stored / (stored + missing_days) if stored + missing_days else 0.0,
+        })
+    return report
+
+
+def format_coverage(report):
+    lines = [f"{'coin':<8} {'first day':<10} {'last day':<10} {'days':>6} {'missing':>7} {'hours':>5} {'cover':>6}"]
+    for row in report:
+        first = datetime.utcfromtimestamp(row["first_day"]).strftime("%Y-%m-%d") if row["first_day"] else "-"
+        last = datetime.utcfromtimestamp(row["last_day"]).strftime("%Y-%m-%d") if row["last_day"] else "-"
+        lines.append(
+            f"{row['symbol']:<8} {first:<10} {last:<10} {row['days_stored']:>6} {row['missing_days']:>7} "
+            f"{row['missing_hours']:>5} {row['coverage']:>6.1%}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("report", "repair"):
+        print(__doc__)
+        sys.exit(1)
+    session = SessionLocal()
+    try:
+        coin = None
+        if len(sys.argv) > 2:
+            coin = session.query(Coin).filter(Coin.symbol == sys.argv[2].upper()).first()
+            if coin is None:
+                print(f"{sys.argv[2].upper()} is not in the database")
+                sys.exit(1)
+            session.expunge(coin)
+        if sys.argv[1] == "report":
+            print(format_coverage(coverage_report(session, None if coin is None else [coin.id])))
+        elif coin is None:
+            print(repair_all_gaps())
+        else:
+            print(repair_coin(coin))
+    finally:
+        session.close()
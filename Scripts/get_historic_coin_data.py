@@ -1,18 +1,27 @@
-﻿import requests
-import os
+﻿import os
 from dotenv import load_dotenv
+import threading
 import time
 from datetime import datetime, timezone, timedelta
-from sqlalchemy.orm import sessionmaker, Session
-from Models.coins import Coin, CoinHistoric
-from db import get_engine
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert, array_agg, aggregate_order_by
+from Models.coins import Coin, CoinHistoric, CoinHourly, BackfillWindow
+from db import SessionLocal
 from Scripts.sendDiscordMessage import send_message
+from Scripts.rate_limiter import get_api_rate_limiter
+from Scripts.providers import get_provider, HISTODAY, HISTOHOUR
+from Scripts.response_cache import ResponseCache
+from Scripts.rollups import merge_into_rollups
+from Scripts.candles import CandleBatch
+from Scripts.price_cache import notify_written
+from Scripts.alerts import get_alert_engine
+from Scripts.indicators import record_indicators, PERIODS
+from Scripts import metrics
 import pytz
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
-engine = get_engine()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Load environment variables from .env file
 ENVIROMENT = os.getenv('ENVIRONMENT', 'development')
 
@@ -23,44 +32,97 @@ elif ENVIROMENT == 'production':
 else:
     load_dotenv(encoding="utf-8-sig")  # Default to a standard .env file
 API_KEY = os.getenv("API_KEY")
-API_HISTORIC_BASE_URL = os.getenv("API_HISTORIC_BASE_URL")
-API_HISTORIC_BASE_URL_HOURLY = os.getenv("API_HISTORIC_BASE_URL_HOURLY")
+API_CACHE_DIR = os.getenv("API_CACHE_DIR", ".cache/api")
+API_CACHE_MAX_BYTES = int(os.getenv("API_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+_response_cache = None
+# Marks "not loaded by the caller" where None is a meaningful value
+UNKNOWN = object()
+_response_cache_lock = threading.Lock()
 
 LocalTz = pytz.timezone('Europe/London')
+# Rows per INSERT statement; 6 bind params per row stays well below Postgres' 65535 limit
+INSERT_BATCH_SIZE = 5000
+DAY_SECONDS = 24 * 3600
+BACKFILL_WINDOW_WORKERS = int(os.getenv("BACKFILL_WINDOW_WORKERS", "4"))
 
 
 def get_session():
     return SessionLocal()
 
-def make_api_request(url, params):
-    """Make an API request with the given URL and parameters."""
-    response = requests.get(url, params=params)
-    result = response.json()
+def get_response_cache():
+    """Cache for closed daily candles, or None when API_CACHE_MAX_BYTES is 0."""
+    global _response_cache
+    if _response_cache is None and API_CACHE_MAX_BYTES > 0:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(API_CACHE_DIR, API_CACHE_MAX_BYTES)
+    return _response_cache
+
+
+def is_closed_period(endpoint, params):
+    """Daily pages ending before today's UTC midnight only hold closed candles."""
+    if endpoint != HISTODAY or "toTs" not in params:
+        return False
+    today_start = int(datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+    return params["toTs"] < today_start
+
+
+def make_api_request(endpoint, params):
+    """
+    Make an API request to one of the provider endpoints (HISTODAY, HISTOHOUR,
+    COININFO) with the given parameters.
+    """
+    cache = get_response_cache() if is_closed_period(endpoint, params) else None
+    if cache is not None:
+        key = ResponseCache.make_key(
+            endpoint, fsym=params.get("fsym"), tsym=params.get("tsym"), toTs=params["toTs"], limit=params.get("limit")
+        )
+        result = cache.get(key)
+        if result is not None:
+            metrics.inc("api_requests_total", endpoint=endpoint, status="cache")
+            return result
+    get_api_rate_limiter().acquire()
+    with metrics.timer("api_request_seconds", endpoint=endpoint):
+        result = get_provider().request(endpoint, params)
+    metrics.inc("api_requests_total", endpoint=endpoint, status=result.get("Response", "Unknown"))
+    if cache is not None and result.get("Response") == "Success":
+        cache.put(key, result)
     return result
     
 
-def save_historic_data_to_db(session: Session, coin_id: int, valid_entries: list):
+def save_historic_data_to_db(session: Session, coin_id: int, candles: CandleBatch):
     """
-    Save valid historical data to the database in smaller batches.
+    Save a batch of valid daily candles to the database in a single transaction.
+
+    Rows are written with multi-row INSERT ... ON CONFLICT (coin_id, timestamp),
+    so re-running a backfill never duplicates candles; only all-zero placeholder
+    rows left by an unfinished day are overwritten.
+    Returns the number of rows actually inserted or filled in.
     """
-    batch = []
-    for i, entry in enumerate(valid_entries):
-        timestamp = datetime.utcfromtimestamp(entry["time"])
-        local_timestamp = timestamp.astimezone(LocalTz)
-        historic_data = CoinHistoric(
-            coin_id=coin_id,
-            high=entry["high"],
-            low=entry["low"],
-            open=entry["open"],
-            close=entry["close"],
-            timestamp=local_timestamp.timestamp(),
-        )
-        batch.append(historic_data)
+    if not len(candles):
+        return 0
+    rows = candles.to_rows(coin_id=coin_id)
 
-        # If the batch size is reached, add them to the session and commit
-        session.bulk_save_objects(batch)  # Efficient batch insert
-        session.commit()
-        batch.clear()  # Clear the batch after committing
+    inserted = 0
+    try:
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            statement = insert(CoinHistoric).values(rows[start:start + INSERT_BATCH_SIZE])
+            statement = statement.on_conflict_do_update(
+                index_elements=["coin_id", "timestamp"],
+                set_={column: statement.excluded[column] for column in ("open", "high", "low", "close")},
+                where=(CoinHistoric.open == 0) & (CoinHistoric.close == 0),
+            )
+            inserted += session.execute(statement).rowcount
+        if inserted:
+            merge_into_rollups(session, coin_id, int(candles.time.min()), int(candles.time.max()))
+            notify_written(session, coin_id, "daily")
+        with metrics.timer("db_commit_seconds", path="historic"):
+            session.commit()
+        metrics.inc("rows_inserted_total", inserted, table="coin_historic")
+    except Exception:
+        session.rollback()
+        raise
+    return inserted
 
 
 def count_days_between_timestamps(startDate: int, CurrentStartDateTimeStamp: int):
@@ -76,6 +138,79 @@ def count_days_between_timestamps(startDate: int, CurrentStartDateTimeStamp: int
     return days
 
 
+def plan_backfill_windows(start_ts: int, end_ts: int, limit: int):
+    """
+    Split the daily candles in [start_ts, end_ts) into independent windows of at
+    most `limit` days. Windows are aligned to multiples of `limit` days since the
+    epoch, so the same window always maps to the same request (and cache entry).
+    Returns a list of (first_candle_ts, last_candle_ts), newest first.
+    """
+    first_day = start_ts // DAY_SECONDS
+    end_day = -(-end_ts // DAY_SECONDS)  # Exclusive, rounded up
+    windows = []
+    day = first_day
+    while day < end_day:
+        window_end_day = min(end_day, (day // limit + 1) * limit)
+        windows.append((day * DAY_SECONDS, (window_end_day - 1) * DAY_SECONDS))
+        day = window_end_day
+    windows.reverse()
+    return windows
+
+
+def unfetched_part(window: tuple, checkpoints):
+    """
+    The part of `window` not covered by the stored (window_start, window_end)
+    checkpoints, or None. Only the newest window grows between runs (its end
+    follows today), so a resumed backfill fetches just the days after its
+    checkpoint instead of the whole window again.
+    """
+    window_start, window_end = window
+    covered_through = window_start - DAY_SECONDS
+    for start, end in sorted(checkpoints):
+        if start <= covered_through + DAY_SECONDS and end > covered_through:
+            covered_through = end
+    if covered_through >= window_end:
+        return None
+    return max(window_start, covered_through + DAY_SECONDS), window_end
+
+
+def fetch_backfill_window(coin_id: int, fsym: str, tsym: str, window: tuple, today_candle_ts: int, checkpoint: bool = True):
+    """
+    Fetch, store and (unless `checkpoint` is False) checkpoint one window in its
+    own session. Returns rows inserted.
+    """
+    window_start, window_end = window
+    params = {
+        "fsym": fsym,
+        "tsym": tsym,
+        "limit": (window_end - window_start) // DAY_SECONDS,  # API returns 'limit+1' data points
+        "toTs": window_end,
+        "api_key": API_KEY,
+    }
+    result = make_api_request(HISTODAY, params)
+    if result["Response"] != "Success":
+        raise RuntimeError(f"Error fetching data: {result['Message']}")
+
+    # Skip today's open candle and the all-zero candles from before the coin traded
+    candles = CandleBatch.from_api(result["Data"]["Data"])
+    valid = candles.between(window_start, min(window_end + 1, today_candle_ts)) & ~candles.zero_mask()
+
+    session = get_session()
+    try:
+        inserted = save_historic_data_to_db(session, coin_id, candles.select(valid))
+        if not checkpoint:
+            return inserted
+        session.execute(
+            insert(BackfillWindow)
+            .values(coin_id=coin_id, window_start=window_start, window_end=window_end, rows_inserted=inserted)
+            .on_conflict_do_nothing()
+        )
+        session.commit()
+        return inserted
+    finally:
+        session.close()
+
+
 def fetch_paginated_data_historic(
     session: Session,
     coin: Coin,
@@ -84,64 +219,121 @@ def fetch_paginated_data_historic(
     limit: int,
     total_days: int,
     CurrentStartDateTimeStamp: int,
-    make_historic: bool = True,
+    progress=None,
 ):
-    toTs = int(time.time())  # Current timestamp (most recent data)
-    valid_entries_count = 0
-    invalid_entry = 0
-    while total_days > 0 and invalid_entry == 0:
-        time.sleep(1)
-        # Adjust limit for the last batch if remaining days are fewer than the limit
-        days_to_fetch = min(limit, total_days)
-
-        # Build the request URL
-        params = {
-            "fsym": fsym,
-            "tsym": tsym,
-            "limit": days_to_fetch - 1,  # API returns 'limit+1' data points
-            "toTs": toTs,
-            "api_key": API_KEY,
+    """
+    Backfill the last `total_days` daily candles, `limit` days per request.
+
+    The range is split into windows that are fetched concurrently under the
+    shared rate limiter. Finished windows are checkpointed in backfill_windows,
+    so an interrupted backfill resumes with only the missing windows.
+    `progress`, if given, is called with (days_fetched, days_total) after every window.
+    """
+    # Daily candles are stamped at UTC midnight; today's is still open
+    current_date = datetime.fromtimestamp(CurrentStartDateTimeStamp, LocalTz).date()
+    today_candle_ts = int(datetime(current_date.year, current_date.month, current_date.day, tzinfo=pytz.utc).timestamp())
+    start_ts = today_candle_ts - total_days * DAY_SECONDS
+    windows = plan_backfill_windows(start_ts, today_candle_ts, limit)
+
+    checkpoints = [
+        (row.window_start, row.window_end)
+        for row in session.query(BackfillWindow).filter(BackfillWindow.coin_id == coin.id)
+    ]
+    pending = [part for part in (unfetched_part(window, checkpoints) for window in windows) if part is not None]
+    days_total = sum((end - start) // DAY_SECONDS + 1 for start, end in windows)
+    days_fetched = days_total - sum((end - start) // DAY_SECONDS + 1 for start, end in pending)
+    if checkpoints:
+        print(f"Resuming {coin.symbol} backfill: {days_fetched}/{days_total} days already stored.")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=BACKFILL_WINDOW_WORKERS, thread_name_prefix=f"backfill-{fsym}") as executor:
+        futures = {
+            executor.submit(fetch_backfill_window, coin.id, fsym, tsym, window, today_candle_ts): window
+            for window in pending
         }
-        result = make_api_request(API_HISTORIC_BASE_URL, params)
+        for future in as_completed(futures):
+            window_start, window_end = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{coin.symbol} window {window_start}-{window_end} failed: {e}")
+                continue
+            days_fetched += (window_end - window_start) // DAY_SECONDS + 1
+            if progress is not None:
+                progress(days_fetched, days_total)
 
-        if result["Response"] == "Success":
-            batch_data = result["Data"]["Data"]
-            sorted_data = sorted(batch_data, key=lambda x: x["time"], reverse=True)
-            # Check if any entry has all values (high, low, open, close) as 0
-            valid_entries = []
-            for entry in sorted_data:
-                dt = datetime.utcfromtimestamp(entry["time"])
-                utc_dt = dt.astimezone(pytz.UTC)
-                utc_unix_time = int(utc_dt.timestamp())
-                if (utc_unix_time != CurrentStartDateTimeStamp):
-                    if (
-                        entry["high"] == 0
-                        and entry["low"] == 0
-                        and entry["open"] == 0
-                        and entry["close"] == 0
-                    ):
-                        invalid_entry += 1
-                    else:
-                        valid_entries_count += 1
-                        valid_entries.append(entry)
-            save_historic_data_to_db(session, coin.id, valid_entries)
-            total_days -= days_to_fetch
-            toTs = result["Data"]["TimeFrom"]
+    if failed:
+        print(f"{coin.symbol} backfill incomplete: {failed} window(s) failed, they will be retried on the next run.")
+        return
+    coin.history_check = True
+    coin.last_time_tracked = CurrentStartDateTimeStamp
+    # The whole range is stored, checkpoints are only needed while it is incomplete
+    session.query(BackfillWindow).filter(BackfillWindow.coin_id == coin.id).delete()
+    try:
+        session.commit()
+        send_message(f"{coin.name} historic was inserted successfully!", coin.webhook_url, coin.name, 'historic')
+        record_indicators(session, coin.id, PERIODS["daily"])
+    except Exception as e:
+        session.rollback()
+        print(f"Error commiting session: {e}")
+
+
+def save_hourly_data_to_db(session: Session, coin_id: int, hour_rows: list):
+    """Insert hourly candles; hours that are already stored are left untouched."""
+    if not hour_rows:
+        return 0
+    statement = (
+        insert(CoinHourly)
+        .values([dict(row, coin_id=coin_id) for row in hour_rows])
+        .on_conflict_do_nothing(index_elements=["coin_id", "timestamp"])
+    )
+    inserted = session.execute(statement).rowcount
+    if inserted:
+        notify_written(session, coin_id, "hourly")
+    metrics.inc("rows_inserted_total", inserted, table="coin_hourly")
+    return inserted
+
+
+def close_daily_candle(session: Session, coin_historic: CoinHistoric, day_start: int, day_end: int,
+                       merge_rollups: bool = True):
+    """
+    Derive the daily OHLC row from the day's hourly candles in one query and
+    fold it into the weekly/monthly/yearly rollups, unless the caller rebuilds
+    the affected periods itself.
+    """
+    first_open, last_close, highest_high, lowest_low = session.query(
+        array_agg(aggregate_order_by(CoinHourly.open, CoinHourly.timestamp.asc()))[1],
+        array_agg(aggregate_order_by(CoinHourly.close, CoinHourly.timestamp.desc()))[1],
+        func.max(CoinHourly.high),
+        func.min(CoinHourly.low),
+    ).filter(
+        CoinHourly.coin_id == coin_historic.coin_id,
+        CoinHourly.timestamp >= day_start,
+        CoinHourly.timestamp < day_end,
+    ).one()
+    coin_historic.open = first_open
+    coin_historic.close = last_close
+    coin_historic.high = highest_high
+    coin_historic.low = lowest_low
+    session.flush()
+    notify_written(session, coin_historic.coin_id, "daily")
+    if merge_rollups:
+        merge_into_rollups(session, coin_historic.coin_id, coin_historic.timestamp, coin_historic.timestamp)
+    return coin_historic
+
+
+def hourly_request_params(fsym, tsym):
+    """Last 25 hourly candles up to the start of the current (still open) hour."""
+    start_of_hour = datetime.now(pytz.utc).replace(minute=0, second=0, microsecond=0)
+    return {
+        "fsym": fsym,
+        "tsym": tsym,
+        "limit": 24,
+        "api_key": API_KEY,
+        "toTs": int(start_of_hour.timestamp()),
+    }
 
-        else:
-            print(f"Error fetching data: {result['Message']}")
-            break
-    count_inserted = session.query(CoinHistoric).filter_by(coin_id=coin.id).count()
-    if count_inserted >= valid_entries_count:
-        coin.history_check = True
-        coin.last_time_tracked = CurrentStartDateTimeStamp
-        try:
-            session.commit()
-            send_message(f"{coin.name} historic was inserted successfully!", coin.webhook_url, coin.name, 'historic')
-        except Exception as e:
-            session.rollback()
-            print(f"Error commiting session: {e}")
-         
 
 def fetch_paginated_data_historic_hourly(
     session: Session,
@@ -150,33 +342,20 @@ def fetch_paginated_data_historic_hourly(
     tsym: str,
     CurrentStartDateTimeStamp: int,
     make_historic: bool = True,
+    last_hour_ts=UNKNOWN,
 ) -> None:
-    to_ts = int(datetime.now(pytz.utc).timestamp())
-    valid_entries: List[dict] = []
+    """
+    Store the hours of the current day that are not saved yet. `last_hour_ts`
+    is the coin's latest stored hour if the caller already knows it.
+    """
     try:
         # Get the current daily historic entry
         coin_historic = session.query(CoinHistoric).filter(
             (CoinHistoric.coin_id == coin.id) & 
             (CoinHistoric.timestamp == CurrentStartDateTimeStamp)
         ).first()
-       
-        last_saved_hour = None
-        now = datetime.now(pytz.utc)
-        now_local = now.astimezone(LocalTz)
-        if now_local.hour == 0:
-            now_local -= timedelta(hours=1)
-        previous_day = now - timedelta(days=1)
-        previous_day_start = previous_day.replace(hour=0,minute=0,second=0)
-        previous_day_unixtime_stamp = int(previous_day_start.timestamp())
-        # Initialize or load the hourly_historic field as a list
-        if coin_historic and coin_historic.hourly_historic:
-            hourly_historic_data = coin_historic.hourly_historic
-            last_saved_hour = max([entry["hour"] for entry in hourly_historic_data])
-        else:
-            
-            # Initialize as a new entry
-            hourly_historic_data = []
-            last_saved_hour = None
+        if coin_historic is None:
+            # Placeholder daily row, filled in when the day closes
             coin_historic = CoinHistoric(
                 coin_id=coin.id,
                 high=0,
@@ -184,97 +363,78 @@ def fetch_paginated_data_historic_hourly(
                 open=0,
                 close=0,
                 timestamp=CurrentStartDateTimeStamp,
-                hourly_historic=hourly_historic_data  # Initialize with an empty list
             )
-            session.add(coin_historic)  # Add the new record to the session
-        # Determine the Unix timestamp for the last saved hour
-        if last_saved_hour is not None:
-            
-            last_saved_datetime = now_local.replace(hour=last_saved_hour, minute=0, second=0, microsecond=0) + timedelta(hours=1)
-            start_from_unix = int(last_saved_datetime.timestamp())
+            session.add(coin_historic)
+
+        # Continue after the last hour already stored for the current day
+        if last_hour_ts is UNKNOWN:
+            last_saved_timestamp = session.query(func.max(CoinHourly.timestamp)).filter(
+                CoinHourly.coin_id == coin.id,
+                CoinHourly.timestamp >= CurrentStartDateTimeStamp,
+            ).scalar()
+        elif last_hour_ts is not None and last_hour_ts >= CurrentStartDateTimeStamp:
+            last_saved_timestamp = last_hour_ts
+        else:
+            last_saved_timestamp = None
+        if last_saved_timestamp is not None:
+            start_from_unix = last_saved_timestamp + 3600
         else:
             start_from_unix = CurrentStartDateTimeStamp
-        
-
-        # Calculate the Unix timestamp for the start of the previous hour
-        start_of_hour = now.replace(minute=0, second=0, microsecond=0)
-        unix_start_of_previous_hour = int(start_of_hour.timestamp())
-
-        # Prepare parameters for the API request to get hourly data
-        params = {
-            "fsym": fsym,
-            "tsym": tsym,
-            "limit": 24,
-            "api_key": API_KEY,
-            "toTs": unix_start_of_previous_hour,
-        }
-        
+
         # Make the API request for hourly data
-        result = make_api_request(API_HISTORIC_BASE_URL_HOURLY, params)
+        result = make_api_request(HISTOHOUR, hourly_request_params(fsym, tsym))
         if result["Response"] == "Success":
-            hourly_data = result["Data"]["Data"]
-            sorted_data = sorted(hourly_data, key=lambda x: x["time"])
-            # Collect valid hourly entries
-            last_entry_time = 0
+            # Collect the closed hours not stored yet
+            day_end = None
             current_time = datetime.now()
             start_of_current_time = current_time.replace(minute=0,second=0)
             limit_hour_unix = int(start_of_current_time.timestamp())
-            for entry in sorted_data:
-                entry_time_dt = datetime.utcfromtimestamp(entry["time"]).replace(tzinfo=pytz.utc)
-                utc_time_entry = entry_time_dt.astimezone(LocalTz)
-                entry_unix_time = int(utc_time_entry.timestamp())
-                if entry_unix_time >= start_from_unix and entry_unix_time < limit_hour_unix and(last_saved_hour is None or utc_time_entry.hour != last_saved_hour):
-                    if (utc_time_entry.hour) == 23:
-                        highest_high = max(data_historic["high"] for data_historic in hourly_historic_data)
-                        if entry["high"] > highest_high:
-                            highest_high = entry["high"]
-                        lowest_low = min(data_historic["low"] for data_historic in hourly_historic_data)
-                        if entry["low"] < lowest_low:
-                            lowest_low = entry["low"]
-                        first_open = hourly_historic_data[0]["open"]
-                        last_close = entry["close"]
-
-                        coin_historic.close = last_close
-                        coin_historic.open = first_open
-                        coin_historic.high =highest_high
-                        coin_historic.low = lowest_low
-                        if coin_historic.open != 0:
-                            percentage_change = ((coin_historic.close - coin_historic.open)/( coin_historic.open)*100)
-                        else:
-                            percentage_change = 0
-                        if coin_historic.open > coin_historic.close:
-                            send_message(f"Daily Resume -> Open: {coin_historic.open}, Close: {coin_historic.close}.Price dropped {percentage_change:.2f}%", coin.webhook_url, coin.name, 'historic', True, 'red', daily=True)
-                        elif coin_historic.open < coin_historic.close:
-                            send_message(f"Daily Resume -> Open: {coin_historic.open}, Close: {coin_historic.close}. Price increased {percentage_change:.2f}%", coin.webhook_url, coin.name, 'historic', True, 'green', daily=True)
-                        else:
-                            send_message(f"Daily Resume -> Open: {coin_historic.open}, Close: {coin_historic.close}. No change in price!", coin.webhook_url, coin.name, 'historic', True, 'yellow', daily=True)
-                    hour_entry = {
-                        "hour": utc_time_entry.hour,
-                        "high": entry["high"],
-                        "low": entry["low"],
-                        "open": entry["open"],
-                        "close": entry["close"],
-                    }
-                    last_entry_time = utc_time_entry
-                    valid_entries.append(hour_entry)
-            # Append new valid hourly entries to the hourly_historic list
+            candles = CandleBatch.from_api(result["Data"]["Data"]).sorted()
+            candles = candles.select(candles.between(start_from_unix, limit_hour_unix))
+            local_hours = (candles.time + candles.utc_offsets(LocalTz)) % DAY_SECONDS // 3600
+            closing_hours = candles.time[local_hours == 23]
+            if len(closing_hours):
+                day_end = int(closing_hours[-1]) + 3600
+            valid_entries = candles.to_rows()
             if valid_entries:
+                last_entry_hour = int(local_hours[-1])
+                save_hourly_data_to_db(session, coin.id, valid_entries)
+                session.flush()  # Ensure pending changes are sent to the DB
+                if day_end is not None:
+                    close_daily_candle(session, coin_historic, CurrentStartDateTimeStamp, day_end)
+                    if coin_historic.open != 0:
+                        percentage_change = ((coin_historic.close - coin_historic.open)/( coin_historic.open)*100)
+                    else:
+                        percentage_change = 0
+                    if coin_historic.open > coin_historic.close:
+                        send_message(f"Daily Resume -> Open: {coin_historic.open}, Close: {coin_historic.close}.Price dropped {percentage_change:.2f}%", coin.webhook_url, coin.name, 'historic', True, 'red', daily=True)
+                    elif coin_historic.open < coin_historic.close:
+                        send_message(f"Daily Resume -> Open: {coin_historic.open}, Close: {coin_historic.close}. Price increased {percentage_change:.2f}%", coin.webhook_url, coin.name, 'historic', True, 'green', daily=True)
+                    else:
+                        send_message(f"Daily Resume -> Open: {coin_historic.open}, Close: {coin_historic.close}. No change in price!", coin.webhook_url, coin.name, 'historic', True, 'yellow', daily=True)
                 last_entry = valid_entries[-1]
                 if last_entry["open"] != 0:
                     percentage_change = ((last_entry["close"] - last_entry["open"]) /( last_entry["open"])*100)
                 else:
                     percentage_change = 0
                 if last_entry["open"] > last_entry["close"]:
-                    send_message(f"Open: {last_entry['open']}, Close: {last_entry['close']}. Price dropped {percentage_change:.2f}%", coin.webhook_url, coin.name, 'historic', True, 'red',hour=last_entry_time.hour)
+                    send_message(f"Open: {last_entry['open']}, Close: {last_entry['close']}. Price dropped {percentage_change:.2f}%", coin.webhook_url, coin.name, 'historic', True, 'red',hour=last_entry_hour)
                 elif last_entry["open"] < last_entry["close"]:
-                    send_message(f"Open: {last_entry['open']}, Close: {last_entry['close']}. Price increased {percentage_change:.2f}%", coin.webhook_url, coin.name, 'historic', True, 'green',hour=last_entry_time.hour)
+                    send_message(f"Open: {last_entry['open']}, Close: {last_entry['close']}. Price increased {percentage_change:.2f}%", coin.webhook_url, coin.name, 'historic', True, 'green',hour=last_entry_hour)
                 else:
-                    send_message(f"Open: {last_entry['open']}, Close: {last_entry['close']}. No change in price", coin.webhook_url, coin.name, 'historic', True, 'yellow',hour=last_entry_time.hour)
-                coin_historic.hourly_historic.extend(valid_entries)
-                session.flush()  # Ensure pending changes are sent to the DB
+                    send_message(f"Open: {last_entry['open']}, Close: {last_entry['close']}. No change in price", coin.webhook_url, coin.name, 'historic', True, 'yellow',hour=last_entry_hour)
                 try:
-                    session.commit()
+                    with metrics.timer("db_commit_seconds", path="hourly"):
+                        session.commit()
                     print(f"Committed hourly data to the database for {coin.symbol}.")
+                    record_indicators(session, coin.id, PERIODS["hourly"], candles)
+                    if day_end is not None:
+                        day_candle = CandleBatch(
+                            [coin_historic.timestamp], [coin_historic.open], [coin_historic.high],
+                            [coin_historic.low], [coin_historic.close],
+                        )
+                        record_indicators(session, coin.id, PERIODS["daily"], day_candle)
+                    get_alert_engine().notify(coin, candles, session)
                 except Exception as e:
                     session.rollback()
                     print(f"Error committing session: {e}")
@@ -288,7 +448,11 @@ def fetch_paginated_data_historic_hourly(
         session.rollback()  # Rollback any changes if an exception occurs
 
     
-def main(coin: Coin, hourly = False):
+def main(coin: Coin, hourly = False, progress=None, last_hour_ts=UNKNOWN):
+    """
+    Run the hourly update or the historic backfill for `coin`. The coin is used
+    as loaded by the caller (e.g. the cycle plan) rather than fetched again.
+    """
     now_utc = datetime.now(pytz.utc)
     now_local = now_utc.astimezone(LocalTz)
     if now_local.hour == 0:
@@ -298,7 +462,7 @@ def main(coin: Coin, hourly = False):
     
     try:
         session = get_session()
-        coin = session.query(Coin).filter(Coin.id == coin.id).first()
+        coin = session.merge(coin, load=False)
         symbol = coin.symbol
         tsym = "USD"
         limit = 1500
@@ -306,11 +470,11 @@ def main(coin: Coin, hourly = False):
         total_days = count_days_between_timestamps(coin.last_time_tracked, CurrentStartDateTimeStamp)
         if hourly:
             fetch_paginated_data_historic_hourly(
-                session, coin, symbol, tsym, CurrentStartDateTimeStamp, True
+                session, coin, symbol, tsym, CurrentStartDateTimeStamp, True, last_hour_ts=last_hour_ts
             )
         else:
             fetch_paginated_data_historic(
-                session, coin, symbol, tsym, limit, total_days, CurrentStartDateTimeStamp, True
+                session, coin, symbol, tsym, limit, total_days, CurrentStartDateTimeStamp, progress
             )
     finally:
         session.close()  
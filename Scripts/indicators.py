@@ -0,0 +1,285 @@
+﻿"""
+SMA/EMA/RSI/volatility per coin, maintained from coin_historic and coin_hourly.
+
+A coin's series is computed in one vectorised pass over its stored candles
+(after a backfill, a gap repair, or the first time it is needed). After that
+each new candle is folded into the running state kept in coin_indicator_state,
+which costs a fixed amount of work however long the history is.
+
+Usage: python -m Scripts.indicators rebuild [SYMBOL]
+"""
+import logging
+import math
+import sys
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from Models.coins import Coin, CoinHistoric, CoinHourly, CoinIndicator, CoinIndicatorState, SessionLocal
+from Scripts import metrics
+
+
+PERIODS = {"daily": 86400, "hourly": 3600}
+SMA_LENGTHS = (20, 50)
+EMA_LENGTHS = (12, 26)
+RSI_LENGTH = 14
+VOLATILITY_LENGTH = 20
+COLUMNS = ("sma_20", "sma_50", "ema_12", "ema_26", "rsi_14", "volatility_20")
+# Closes kept in the running state: enough for the longest window
+STATE_CLOSES = max(SMA_LENGTHS + (VOLATILITY_LENGTH + 1, RSI_LENGTH + 1) + EMA_LENGTHS)
+# Rows per insert statement when a whole series is rewritten
+INSERT_CHUNK = 5000
+# Values smoothed per closed-form block; keeps decay ** -BLOCK well inside float64
+SMOOTH_BLOCK = 256
+
+
+def smooth(values: np.ndarray, alpha: float, seed: float) -> np.ndarray:
+    """
+    y[i] = alpha * values[i] + (1 - alpha) * y[i - 1], starting from y[-1] = seed,
+    evaluated a block at a time with cumulative sums instead of a Python loop.
+    """
+    out = np.empty(len(values))
+    decay = 1.0 - alpha
+    previous = seed
+    for start in range(0, len(values), SMOOTH_BLOCK):
+        block = values[start:start + SMOOTH_BLOCK]
+        steps = np.arange(len(block))
+        weights = decay ** steps
+        smoothed = weights * decay * previous + alpha * weights * np.cumsum(block / weights)
+        out[start:start + len(block)] = smoothed
+        previous = smoothed[-1]
+    return out
+
+
+def rsi_value(avg_gain: float, avg_loss: float):
+    if avg_loss == 0:
+        return 50.0 if avg_gain == 0 else 100.0
+    return 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+
+def compute_indicators(close: np.ndarray):
+    """
+    Every indicator for a whole close series in one pass. Returns
+    ({column: array, NaN until defined}, running state after the last close).
+    """
+    count = len(close)
+    series = {column: np.full(count, np.nan) for column in COLUMNS}
+    state = {"closes": close[-STATE_CLOSES:].tolist(), "count": count}
+    for length in SMA_LENGTHS:
+        if count >= length:
+            series[f"sma_{length}"][length - 1:] = sliding_window_view(close, length).mean(axis=1)
+    for length in EMA_LENGTHS:
+        state[f"ema_{length}"] = None
+        if count >= length:
+            seed = close[:length].mean()
+            ema = series[f"ema_{length}"]
+            ema[length - 1] = seed
+            ema[length:] = smooth(close[length:], 2.0 / (length + 1), seed)
+            state[f"ema_{length}"] = float(ema[-1])
+    state["avg_gain"] = state["avg_loss"] = None
+    if count > RSI_LENGTH:
+        change = np.diff(close)
+        gains, losses = np.maximum(change, 0.0), np.maximum(-change, 0.0)
+        avg_gain = np.empty(count - RSI_LENGTH)
+        avg_loss = np.empty(count - RSI_LENGTH)
+        avg_gain[0], avg_loss[0] = gains[:RSI_LENGTH].mean(), losses[:RSI_LENGTH].mean()
+        avg_gain[1:] = smooth(gains[RSI_LENGTH:], 1.0 / RSI_LENGTH, avg_gain[0])
+        avg_loss[1:] = smooth(losses[RSI_LENGTH:], 1.0 / RSI_LENGTH, avg_loss[0])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+        rsi[avg_loss == 0] = 100.0
+        rsi[(avg_loss == 0) & (avg_gain == 0)] = 50.0
+        series["rsi_14"][RSI_LENGTH:] = rsi
+        state["avg_gain"], state["avg_loss"] = float(avg_gain[-1]), float(avg_loss[-1])
+    if count > VOLATILITY_LENGTH:
+        returns = np.diff(np.log(close))
+        series["volatility_20"][VOLATILITY_LENGTH:] = (
+            sliding_window_view(returns, VOLATILITY_LENGTH).std(axis=1, ddof=1) * 100
+        )
+    return series, state
+
+
+class RunningIndicators:
+    """The per-candle counterpart of compute_indicators, resumed from a stored state."""
+
+    def __init__(self, state: dict):
+        self.closes = list(state["closes"])
+        self.count = state["count"]
+        self.ema = {length: state.get(f"ema_{length}") for length in EMA_LENGTHS}
+        self.avg_gain = state.get("avg_gain")
+        self.avg_loss = state.get("avg_loss")
+
+    def update(self, close: float) -> dict:
+        """Fold in one close and return the indicator values after it (None until defined)."""
+        previous = self.closes[-1] if self.closes else None
+        self.closes.append(close)
+        if len(self.closes) > STATE_CLOSES:
+            del self.closes[0]
+        self.count += 1
+        values = dict.fromkeys(COLUMNS)
+        for length in SMA_LENGTHS:
+            if self.count >= length:
+                values[f"sma_{length}"] = sum(self.closes[-length:]) / length
+        for length in EMA_LENGTHS:
+            if self.count == length:
+                self.ema[length] = sum(self.closes[-length:]) / length
+            elif self.count > length:
+                alpha = 2.0 / (length + 1)
+                self.ema[length] = alpha * close + (1 - alpha) * self.ema[length]
+            values[f"ema_{length}"] = self.ema[length]
+        if self.count == RSI_LENGTH + 1:
+            window = self.closes[-(RSI_LENGTH + 1):]
+            changes = [b - a for a, b in zip(window, window[1:])]
+            self.avg_gain = sum(max(change, 0.0) for change in changes) / RSI_LENGTH
+            self.avg_loss = sum(max(-change, 0.0) for change in changes) / RSI_LENGTH
+        elif self.count > RSI_LENGTH + 1:
+            change = close - previous
+            self.avg_gain += (max(change, 0.0) - self.avg_gain) / RSI_LENGTH
+            self.avg_loss += (max(-change, 0.0) - self.avg_loss) / RSI_LENGTH
+        if self.avg_gain is not None:
+            values["rsi_14"] = rsi_value(self.avg_gain, self.avg_loss)
+        if self.count > VOLATILITY_LENGTH:
+            window = self.closes[-(VOLATILITY_LENGTH + 1):]
+            returns = [math.log(b / a) for a, b in zip(window, window[1:])]
+            mean = sum(returns) / VOLATILITY_LENGTH
+            variance = sum((value - mean) ** 2 for value in returns) / (VOLATILITY_LENGTH - 1)
+            values["volatility_20"] = math.sqrt(variance) * 100
+        return values
+
+    def state(self) -> dict:
+        state = {"closes": self.closes, "count": self.count, "avg_gain": self.avg_gain, "avg_loss": self.avg_loss}
+        for length in EMA_LENGTHS:
+            state[f"ema_{length}"] = self.ema[length]
+        return state
+
+
+def _candle_model(period: int):
+    return CoinHistoric if period == PERIODS["daily"] else CoinHourly
+
+
+def _save_state(session: Session, coin_id: int, period: int, timestamp: int, state: dict):
+    statement = insert(CoinIndicatorState).values(coin_id=coin_id, period=period, timestamp=timestamp, state=state)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=["coin_id", "period"],
+        set_={"timestamp": statement.excluded.timestamp, "state": statement.excluded.state},
+    ))
+
+
+def rebuild_indicators(session: Session, coin_id: int, period: int):
+    """Recompute a coin's whole series from its stored candles in one vectorised pass. Returns rows written."""
+    model = _candle_model(period)
+    rows = session.query(model.timestamp, model.close).filter(
+        model.coin_id == coin_id, model.open > 0, model.close > 0
+    ).order_by(model.timestamp).all()
+    session.query(CoinIndicator).filter(
+        CoinIndicator.coin_id == coin_id, CoinIndicator.period == period
+    ).delete(synchronize_session=False)
+    session.query(CoinIndicatorState).filter(
+        CoinIndicatorState.coin_id == coin_id, CoinIndicatorState.period == period
+    ).delete(synchronize_session=False)
+    if not rows:
+        return 0
+    times = np.array([row[0] for row in rows], dtype=np.int64)
+    close = np.array([row[1] for row in rows], dtype=np.float64)
+    series, state = compute_indicators(close)
+    columns = [series[column].tolist() for column in COLUMNS]
+    records = [
+        {"coin_id": coin_id, "period": period, "timestamp": timestamp,
+         **{column: None if math.isnan(value) else value for column, value in zip(COLUMNS, values)}}
+        for timestamp, *values in zip(times.tolist(), *columns)
+    ]
+    for start in range(0, len(records), INSERT_CHUNK):
+        session.execute(insert(CoinIndicator), records[start:start + INSERT_CHUNK])
+    _save_state(session, coin_id, period, int(times[-1]), state)
+    metrics.inc("rows_inserted_total", len(records), table="coin_indicators")
+    return len(records)
+
+
+def update_indicators(session: Session, coin_id: int, period: int, candles):
+    """
+    Fold newly stored candles (a CandleBatch) into the coin's running state and
+    store their indicator rows. Without a stored state the series is rebuilt.
+    Candles at or before the last one folded in are skipped; filling an older
+    hole needs a rebuild. Returns rows written.
+    """
+    stored = session.query(CoinIndicatorState).filter(
+        CoinIndicatorState.coin_id == coin_id, CoinIndicatorState.period == period
+    ).with_for_update().first()
+    if stored is None:
+        return rebuild_indicators(session, coin_id, period)
+    running = RunningIndicators(stored.state)
+    last_time = stored.timestamp
+    records = []
+    for timestamp, close in zip(candles.time.tolist(), candles.close.tolist()):
+        if timestamp <= last_time or not close:
+            continue
+        records.append({"coin_id": coin_id, "period": period, "timestamp": timestamp, **running.update(close)})
+        last_time = timestamp
+    if not records:
+        return 0
+    statement = insert(CoinIndicator).values(records)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=["coin_id", "period", "timestamp"],
+        set_={column: statement.excluded[column] for column in COLUMNS},
+    ))
+    _save_state(session, coin_id, period, last_time, running.state())
+    metrics.inc("rows_inserted_total", len(records), table="coin_indicators")
+    return len(records)
+
+
+def record_indicators(session: Session, coin_id: int, period: int, candles=None):
+    """
+    update_indicators (or rebuild_indicators when `candles` is None) in its own
+    commit; an indicator failure is logged and never fails the ingestion.
+    """
+    try:
+        with metrics.timer("indicator_update_seconds", period=period):
+            if candles is None:
+                written = rebuild_indicators(session, coin_id, period)
+            else:
+                written = update_indicators(session, coin_id, period, candles)
+            session.commit()
+        return written
+    except Exception as e:
+        session.rollback()
+        logging.exception(f"Could not update indicators of coin {coin_id}: {e}")
+        return 0
+
+
+def latest_indicators(session: Session, coin_id: int, period: int, count: int = 1):
+    """The coin's newest `count` indicator rows, newest first."""
+    return session.query(CoinIndicator).filter(
+        CoinIndicator.coin_id == coin_id, CoinIndicator.period == period
+    ).order_by(CoinIndicator.timestamp.desc()).limit(count).all()
+
+
+def indicators_between(session: Session, coin_id: int, period: int, start_ts: int, end_ts: int):
+    """{timestamp: {column: value}} for the candles in [start_ts, end_ts)."""
+    rows = session.query(CoinIndicator).filter(
+        CoinIndicator.coin_id == coin_id,
+        CoinIndicator.period == period,
+        CoinIndicator.timestamp >= start_ts,
+        CoinIndicator.timestamp < end_ts,
+    )
+    return {row.timestamp: {column: getattr(row, column) for column in COLUMNS} for row in rows}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print(__doc__)
+        sys.exit(1)
+    session = SessionLocal()
+    try:
+        coins = session.query(Coin.id, Coin.symbol)
+        if len(sys.argv) > 2:
+            coins = coins.filter(Coin.symbol == sys.argv[2].upper())
+        coins = coins.all()
+        if not coins:
+            print(f"{sys.argv[2].upper()} is not in the database")
+            sys.exit(1)
+        for coin_id, symbol in coins:
+            written = {name: rebuild_indicators(session, coin_id, period) for name, period in PERIODS.items()}
+            session.commit()
+            print(f"{symbol}: {written}")
+    finally:
+        session.close()
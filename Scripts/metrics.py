@@ -0,0 +1,237 @@
+﻿"""
+Lightweight in-process metrics with a Prometheus text endpoint.
+
+Disabled unless METRICS_ENABLED=1; every recording function then returns
+immediately, so instrumented hot paths pay one attribute check.
+
+    METRICS_PORT=9108             serve /metrics over HTTP
+    METRICS_DUMP_INTERVAL=300     also log a stats dump every N seconds
+"""
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _enabled_in_env():
+    return os.getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+
+
+ENABLED = _enabled_in_env()
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_help = {}
+_started = False
+_instrumented_engines = set()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+                break
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timer(name, **labels):
+    """Context manager observing the block's duration into histogram `name`."""
+    if not ENABLED:
+        return _NOOP_TIMER
+    return _Timer(name, labels)
+
+
+def _format_labels(labels, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in tuple(labels) + tuple(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: {"buckets": list(h["buckets"]), "count": h["count"], "sum": h["sum"]}
+                      for key, h in _histograms.items()}
+    lines = []
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, _ in series}):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(series.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def start_stats_dump(interval: float):
+    def dump():
+        while True:
+            time.sleep(interval)
+            logging.info("Metrics dump:\n" + render_prometheus())
+
+    threading.Thread(target=dump, name="metrics-dump", daemon=True).start()
+
+
+def start_from_env():
+    """
+    Re-read METRICS_ENABLED (the .env file may have been loaded after import)
+    and start the endpoint and/or periodic dump configured in the environment.
+    """
+    global ENABLED, _started
+    ENABLED = _enabled_in_env()
+    if not ENABLED or _started:
+        return
+    _started = True
+    port = os.getenv("METRICS_PORT")
+    if port:
+        start_metrics_server(int(port))
+    interval = os.getenv("METRICS_DUMP_INTERVAL")
+    if interval:
+        start_stats_dump(float(interval))
+
+
+def instrument_engine(engine):
+    """Time every SQL statement run through `engine` (only when metrics are enabled)."""
+    if not ENABLED or id(engine) in _instrumented_engines:
+        return
+    _instrumented_engines.add(id(engine))
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_query_start"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        observe("db_query_seconds", time.perf_counter() - started, statement=verb)
+
+
+describe("api_requests_total", "Market data API requests by endpoint and outcome")
+describe("api_request_seconds", "Market data API request latency")
+describe("rows_inserted_total", "Rows inserted by table")
+describe("db_query_seconds", "SQL statement execution time")
+describe("db_commit_seconds", "Session commit time")
+describe("webhook_send_seconds", "Discord webhook POST latency")
+describe("webhook_messages_total", "Webhook messages by result")
+describe("coin_job_seconds", "Per-coin ingestion job duration")
+describe("scheduler_lag_seconds", "Delay between a job's scheduled and actual start")
+describe("scheduler_missed_runs_total", "Scheduler runs missed or skipped")
+describe("scheduler_job_errors_total", "Scheduler jobs that raised")
+describe("bot_command_seconds", "Discord slash command duration")
+describe("event_loop_lag_seconds", "Latest measured event loop lag")
+describe("price_cache_requests_total", "Recent-price cache lookups by result")
+describe("price_cache_bytes", "Memory held by the recent-price cache")
+describe("stream_ticks_total", "Live prices received by streaming ingestion")
+describe("stream_candle_latency_seconds", "Delay between a stream candle closing and being stored")
+describe("stream_pending_candles", "Closed stream candles waiting to be written")
+describe("stream_candles_rejected_total", "Stream candles dropped because the database rejected them")
+describe("alert_rules", "Enabled price alert rules loaded by the alert engine")
+describe("alert_state_warmups_total", "Coins whose alert state was rebuilt from stored candles")
+describe("alerts_fired_total", "Price alerts fired")
+describe("indicator_update_seconds", "Time to update or rebuild a coin's indicator series")
@@ -0,0 +1,336 @@
+﻿"""
+In-memory cache of each coin's recent hourly and daily candles, so the bot can
+answer "last day/week/month" questions without going to Postgres.
+
+Every coin gets one fixed-size NumPy ring buffer per kind. Coins are evicted
+least recently used first once the buffers exceed the memory budget. A coin
+that is not cached is loaded from the database on first use.
+
+Ingestion runs in the scheduler process, so it announces every write with a
+Postgres NOTIFY on NOTIFY_CHANNEL (delivered when its transaction commits).
+The bot listens on a background thread and marks the written series stale;
+the next lookup tops the buffer up with only the candles after its newest one,
+and every other lookup is answered from memory. Without a listener the cache
+falls back to re-checking once a newer period should have closed.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from db import get_connection
+from Models.coins import CoinHistoric, CoinHourly
+from Scripts.candles import CandleBatch
+from Scripts import metrics
+
+
+KINDS = ("hourly", "daily")
+PERIOD_SECONDS = {"hourly": 3600, "daily": 86400}
+# A series whose newest candle looks stale is re-checked at most this often
+RECHECK_SECONDS = 60
+# Postgres channel ingestion notifies on; the payload is "<coin_id>:<kind>"
+NOTIFY_CHANNEL = "price_cache"
+
+_price_cache = None
+_price_cache_lock = threading.Lock()
+
+
+class RingBuffer:
+    """Fixed-capacity, time-ordered candles: int64 times and a (capacity, 4) float64 OHLC block."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.ohlc = np.zeros((capacity, 4), dtype=np.float64)
+        self.start = 0
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.ohlc.nbytes
+
+    def last_time(self):
+        if not self.count:
+            return None
+        return int(self.times[(self.start + self.count - 1) % self.capacity])
+
+    def first_time(self):
+        if not self.count:
+            return None
+        return int(self.times[self.start])
+
+    def _ordered(self):
+        index = (self.start + np.arange(self.count)) % self.capacity
+        return self.times[index], self.ohlc[index]
+
+    def extend(self, candles: CandleBatch):
+        """Add candles; newer ones are appended in place, anything else is merged."""
+        if not len(candles):
+            return
+        candles = candles.sorted()
+        block = np.column_stack((candles.open, candles.high, candles.low, candles.close))
+        last = self.last_time()
+        if last is None or (candles.time[0] > last and np.all(np.diff(candles.time) > 0)):
+            for t, row in zip(candles.time[-self.capacity:], block[-self.capacity:]):
+                slot = (self.start + self.count) % self.capacity
+                self.times[slot] = t
+                self.ohlc[slot] = row
+                if self.count < self.capacity:
+                    self.count += 1
+                else:
+                    self.start = (self.start + 1) % self.capacity
+            return
+        # Overlapping or out-of-order write (e.g. a day closing over its placeholder):
+        # rebuild, letting the new values win for equal times
+        times, ohlc = self._ordered()
+        times = np.concatenate((candles.time, times))
+        ohlc = np.concatenate((block, ohlc))
+        times, first = np.unique(times, return_index=True)
+        ohlc = ohlc[first][-self.capacity:]
+        times = times[-self.capacity:]
+        self.count = len(times)
+        self.start = 0
+        self.times[:self.count] = times
+        self.ohlc[:self.count] = ohlc
+
+    def range(self, start_ts: int, end_ts: int) -> CandleBatch:
+        """Candles with start_ts <= time < end_ts."""
+        times, ohlc = self._ordered()
+        lo, hi = np.searchsorted(times, [start_ts, end_ts])
+        return CandleBatch(times[lo:hi], *ohlc[lo:hi].T)
+
+
+class CoinSeries:
+    def __init__(self, hourly_capacity: int, daily_capacity: int):
+        self.buffers = {"hourly": RingBuffer(hourly_capacity), "daily": RingBuffer(daily_capacity)}
+        # Earliest time each buffer is known to hold every stored candle from
+        self.covered_from = {kind: None for kind in KINDS}
+        self.checked_at = {kind: 0.0 for kind in KINDS}
+        # Set when ingestion wrote candles of this kind since the last load
+        self.stale = {kind: False for kind in KINDS}
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+
+class PriceCache:
+    """LRU map of coin id -> CoinSeries under a byte budget, safe to share between threads."""
+
+    def __init__(self, max_bytes: int, hourly_capacity: int, daily_capacity: int):
+        self.max_bytes = max_bytes
+        self.hourly_capacity = hourly_capacity
+        self.daily_capacity = daily_capacity
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.size = 0
+        # True while a listener receives every ingestion NOTIFY
+        self.listening = False
+        self._series = OrderedDict()
+        self._coin_ids = {}
+        self._lock = threading.Lock()
+
+    def coin_id(self, symbol: str):
+        return self._coin_ids.get(symbol)
+
+    def remember_coin(self, symbol: str, coin_id: int):
+        self._coin_ids[symbol] = coin_id
+
+    def recent(self, session_factory, coin_id: int, kind: str, start_ts: int, end_ts: int) -> CandleBatch:
+        """
+        Candles of one kind in [start_ts, end_ts). Served from memory when the
+        buffer covers the range and is current; otherwise only the missing
+        candles are read through `session_factory`.
+        """
+        with self._lock:
+            series = self._series.get(coin_id)
+            if series is not None:
+                self._series.move_to_end(coin_id)
+                covered = series.covered_from[kind]
+                buffer = series.buffers[kind]
+                if covered is not None and buffer.count == buffer.capacity:
+                    # Wrapped buffers have dropped their oldest candles
+                    covered = max(covered, buffer.first_time())
+                if covered is not None and covered <= start_ts:
+                    if self._is_current(series, kind):
+                        self.hits += 1
+                        metrics.inc("price_cache_requests_total", result="hit")
+                        return series.buffers[kind].range(start_ts, end_ts)
+                    since = series.buffers[kind].last_time()
+                else:
+                    since = None
+                # Writes notified while the database is read mark the series stale again
+                series.stale[kind] = False
+            else:
+                since = None
+
+        capacity = self.hourly_capacity if kind == "hourly" else self.daily_capacity
+        load_from = max(start_ts, end_ts - capacity * PERIOD_SECONDS[kind])
+        with session_factory() as session:
+            if since is not None:
+                candles = load_candles(session, coin_id, kind, since + 1)
+            else:
+                candles = load_candles(session, coin_id, kind, load_from)
+
+        with self._lock:
+            series = self._series.get(coin_id)
+            if series is None:
+                series = CoinSeries(self.hourly_capacity, self.daily_capacity)
+                self._series[coin_id] = series
+                self.size += series.nbytes
+                self._evict()
+            series.buffers[kind].extend(candles)
+            if since is None:
+                series.covered_from[kind] = load_from
+            series.checked_at[kind] = time.monotonic()
+            if since is not None:
+                self.refreshes += 1
+                metrics.inc("price_cache_requests_total", result="refresh")
+            else:
+                self.misses += 1
+                metrics.inc("price_cache_requests_total", result="miss")
+            metrics.set_gauge("price_cache_bytes", self.size)
+            return series.buffers[kind].range(start_ts, end_ts)
+
+    def _is_current(self, series, kind):
+        """
+        Nothing was written since the last load, when a listener is running;
+        otherwise the newest closed period is in the buffer, or the database was
+        asked very recently.
+        """
+        if series.stale[kind]:
+            return False
+        if self.listening:
+            return True
+        last = series.buffers[kind].last_time()
+        now = int(time.time())
+        if last is not None:
+            if kind == "daily" and day_number(last) >= now // PERIOD_SECONDS["daily"] - 1:
+                return True
+            if kind == "hourly" and last >= now // 3600 * 3600 - 3600:
+                return True
+        return time.monotonic() - series.checked_at[kind] < RECHECK_SECONDS
+
+    def invalidate(self, coin_id: int, kind: str):
+        """Mark one cached series stale; coins that are not cached are ignored."""
+        with self._lock:
+            series = self._series.get(coin_id)
+            if series is not None:
+                series.stale[kind] = True
+                self.invalidations += 1
+
+    def _set_listening(self, listening: bool):
+        with self._lock:
+            if listening:
+                # Writes made while nobody was listening were not notified
+                for series in self._series.values():
+                    for kind in KINDS:
+                        series.stale[kind] = True
+            self.listening = listening
+
+    def listen(self, connect=get_connection, stop_event: threading.Event = None):
+        """Apply ingestion's NOTIFYs on a daemon thread, reconnecting after errors."""
+        stop_event = stop_event or threading.Event()
+        thread = threading.Thread(target=self._listen, args=(connect, stop_event), name="price-cache-listener", daemon=True)
+        thread.start()
+        return stop_event
+
+    def _listen(self, connect, stop_event: threading.Event):
+        while not stop_event.is_set():
+            connection = None
+            try:
+                connection = connect()
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                self._set_listening(True)
+                while not stop_event.is_set():
+                    select.select([connection], [], [], RECHECK_SECONDS)
+                    connection.poll()
+                    while connection.notifies:
+                        coin_id, kind = connection.notifies.pop(0).payload.split(":")
+                        if kind in KINDS:
+                            self.invalidate(int(coin_id), kind)
+            except Exception as e:
+                logging.warning(f"Price cache listener failed, falling back to periodic checks: {e}")
+            finally:
+                self._set_listening(False)
+                if connection is not None:
+                    connection.close()
+            stop_event.wait(RECHECK_SECONDS)
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._series) > 1:
+            _, series = self._series.popitem(last=False)
+            self.size -= series.nbytes
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.refreshes
+            return {
+                "coins": len(self._series),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "listening": self.listening,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def day_number(timestamp: int) -> int:
+    """
+    Day of a daily candle by its nearest UTC midnight, as in Scripts.gaps:
+    backfills stamp UTC midnight but the hourly path stamps local midnight.
+    """
+    return (timestamp + 43200) // PERIOD_SECONDS["daily"]
+
+
+def notify_written(session: Session, coin_id: int, kind: str):
+    """Announce new `kind` candles of a coin to the bot's cache once `session` commits."""
+    session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": NOTIFY_CHANNEL, "payload": f"{coin_id}:{kind}"},
+    )
+
+
+def load_candles(session: Session, coin_id: int, kind: str, start_ts: int) -> CandleBatch:
+    """Stored candles of one kind from `start_ts` on, skipping unfilled placeholders."""
+    model = CoinHourly if kind == "hourly" else CoinHistoric
+    rows = session.query(model.timestamp, model.open, model.high, model.low, model.close).filter(
+        model.coin_id == coin_id,
+        model.timestamp >= start_ts,
+        model.open > 0,
+    ).order_by(model.timestamp).all()
+    if not rows:
+        return CandleBatch.empty()
+    return CandleBatch(*zip(*rows))
+
+
+def get_price_cache() -> PriceCache:
+    """
+    Process-wide cache sized by PRICE_CACHE_MAX_BYTES, PRICE_CACHE_HOURS and
+    PRICE_CACHE_DAYS, listening for ingestion's writes from its creation on.
+    """
+    global _price_cache
+    if _price_cache is None:
+        with _price_cache_lock:
+            if _price_cache is None:
+                _price_cache = PriceCache(
+                    int(os.getenv("PRICE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+                    int(os.getenv("PRICE_CACHE_HOURS", str(24 * 31))),
+                    int(os.getenv("PRICE_CACHE_DAYS", "400")),
+                )
+                _price_cache.listen()
+    return _price_cache
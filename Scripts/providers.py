@@ -0,0 +1,167 @@
+﻿"""
+Market data providers behind make_api_request.
+
+Requests name a logical endpoint (histoday, histohour, coininfo, pricemulti)
+and the provider decides where the response comes from:
+
+    MARKET_DATA_PROVIDER=http     the CryptoCompare URLs from the .env file (default)
+    MARKET_DATA_PROVIDER=record   like http, and every response is saved to MARKET_DATA_RECORD_DIR
+    MARKET_DATA_PROVIDER=replay   only serve responses saved in MARKET_DATA_RECORD_DIR, no network
+
+MARKET_DATA_BASE_URL points the http provider at another server that speaks
+the same paths, e.g. the local stand-in in Scripts/fake_market_server.py.
+"""
+import logging
+import os
+import threading
+import time
+from Scripts.http_client import get_http_session
+from Scripts.response_cache import ResponseCache
+
+
+HISTODAY = "histoday"
+HISTOHOUR = "histohour"
+COININFO = "coininfo"
+PRICE_MULTI = "pricemulti"
+
+# Paths of the CryptoCompare API, also served by the fake market server
+ENDPOINT_PATHS = {
+    HISTODAY: "/data/v2/histoday",
+    HISTOHOUR: "/data/v2/histohour",
+    COININFO: "/data/all/coinlist",
+    PRICE_MULTI: "/data/pricemulti",
+}
+# Retries of a single request that the server answered with HTTP 429
+MAX_RATE_LIMIT_RETRIES = 5
+
+
+class MarketDataProvider:
+    def supports(self, endpoint: str) -> bool:
+        raise NotImplementedError
+
+    def request(self, endpoint: str, params: dict) -> dict:
+        """Return the decoded JSON response of `endpoint` for `params`."""
+        raise NotImplementedError
+
+
+class HttpProvider(MarketDataProvider):
+    def __init__(self, urls: dict):
+        self.urls = {endpoint: url for endpoint, url in urls.items() if url}
+
+    def supports(self, endpoint):
+        return endpoint in self.urls
+
+    def request(self, endpoint, params):
+        if endpoint not in self.urls:
+            return {"Response": "Error", "Message": f"Endpoint {endpoint} is not configured"}
+        url = self.urls[endpoint]
+        params = dict(params)
+        if endpoint == COININFO and url.endswith("fsym="):
+            # The .env coininfo URL ends in "?fsym=", the symbol is appended to it
+            url = f"{url}{params.pop('fsym')}"
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            response = get_http_session().get(url, params=params)
+            if response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                break
+            retry_after = float(response.headers.get("Retry-After", 1))
+            logging.warning(f"{endpoint} rate limited, retrying in {retry_after}s")
+            time.sleep(retry_after)
+        return response.json()
+
+
+def _record_key(endpoint, params, exact=True):
+    fields = {name: value for name, value in params.items() if name != "api_key"}
+    if not exact:
+        # Fallback key ignoring time, for replaying requests made relative to "now"
+        fields.pop("toTs", None)
+    return ResponseCache.make_key(endpoint, **fields)
+
+
+class RecordingProvider(MarketDataProvider):
+    """Passes requests to `inner` and saves every successful response to `directory`."""
+
+    def __init__(self, inner: MarketDataProvider, directory: str):
+        self.inner = inner
+        self.store = ResponseCache(directory, max_bytes=2 ** 62)
+
+    def supports(self, endpoint):
+        return self.inner.supports(endpoint)
+
+    def request(self, endpoint, params):
+        result = self.inner.request(endpoint, params)
+        if result.get("Response") == "Success":
+            self.store.put(_record_key(endpoint, params), result)
+            self.store.put(_record_key(endpoint, params, exact=False), result)
+        return result
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Serves recorded responses without touching the network. A request that was
+    not recorded with the same toTs gets the latest recording for the same
+    endpoint and symbols. `latency` seconds are added to every request.
+    """
+
+    def __init__(self, directory: str, latency: float = 0.0):
+        self.store = ResponseCache(directory, max_bytes=2 ** 62)
+        self.latency = latency
+
+    def supports(self, endpoint):
+        return True
+
+    def request(self, endpoint, params):
+        if self.latency:
+            time.sleep(self.latency)
+        result = self.store.get(_record_key(endpoint, params))
+        if result is None:
+            result = self.store.get(_record_key(endpoint, params, exact=False))
+        if result is None:
+            return {"Response": "Error", "Message": f"No recorded {endpoint} response for {params}"}
+        return result
+
+
+def provider_urls(base_url: str = None) -> dict:
+    """Endpoint URLs from the environment, or all under `base_url` when given."""
+    if base_url:
+        base_url = base_url.rstrip("/")
+        return {endpoint: f"{base_url}{path}" for endpoint, path in ENDPOINT_PATHS.items()}
+    return {
+        HISTODAY: os.getenv("API_HISTORIC_BASE_URL"),
+        HISTOHOUR: os.getenv("API_HISTORIC_BASE_URL_HOURLY"),
+        COININFO: os.getenv("API_COIN_INFO_BASE_URL"),
+        PRICE_MULTI: os.getenv("API_PRICE_MULTI_BASE_URL"),
+    }
+
+
+def build_provider() -> MarketDataProvider:
+    mode = os.getenv("MARKET_DATA_PROVIDER", "http")
+    record_dir = os.getenv("MARKET_DATA_RECORD_DIR", ".cache/recordings")
+    if mode == "replay":
+        return ReplayProvider(record_dir, float(os.getenv("MARKET_DATA_REPLAY_LATENCY", "0")))
+    provider = HttpProvider(provider_urls(os.getenv("MARKET_DATA_BASE_URL")))
+    if mode == "record":
+        return RecordingProvider(provider, record_dir)
+    if mode != "http":
+        raise ValueError(f"Unknown MARKET_DATA_PROVIDER {mode!r}")
+    return provider
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> MarketDataProvider:
+    """Process-wide provider, built on first use once the .env file is loaded."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = build_provider()
+    return _provider
+
+
+def set_provider(provider: MarketDataProvider):
+    """Swap the provider, e.g. to point a benchmark at a local fake server."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,61 @@
+﻿import os
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every caller of the market data API."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Block until `tokens` are available. Returns the time spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+_api_rate_limiter = None
+_api_rate_limiter_lock = threading.Lock()
+
+
+def get_api_rate_limiter() -> TokenBucket:
+    """One limiter per process, sized to the API quota.
+
+    Built on first use so the values from the .env file are already loaded.
+    """
+    global _api_rate_limiter
+    if _api_rate_limiter is None:
+        with _api_rate_limiter_lock:
+            if _api_rate_limiter is None:
+                rate = float(os.getenv("API_RATE_LIMIT_PER_SECOND", "10"))
+                burst = float(os.getenv("API_RATE_LIMIT_BURST", rate))
+                _api_rate_limiter = TokenBucket(rate, burst)
+    return _api_rate_limiter
@@ -0,0 +1,159 @@
+﻿from datetime import datetime, timedelta
+from sqlalchemy import func, and_, literal_column
+from sqlalchemy.dialects.postgresql import array_agg, aggregate_order_by
+from sqlalchemy.orm import Session
+from Models.coins import CoinHistoric, CoinRollup
+from Scripts.rollups import ROLLUP_INTERVALS
+import pytz
+
+
+LocalTz = pytz.timezone('Europe/London')
+INTERVALS = {"daily": "day", "weekly": "week", "monthly": "month", "yearly": "year"}
+# Rows fetched per round-trip while streaming a report
+REPORT_FETCH_SIZE = 500
+
+
+def period_bounds(start_date: datetime, end_date: datetime):
+    """
+    Unix range covered by a report from the first day of `start_date`'s month
+    up to the end of `end_date`'s month, in the candles' local time zone.
+    """
+    start = LocalTz.localize(start_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+    end_month = end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if end_month.month == 12:
+        end_month = end_month.replace(year=end_month.year + 1, month=1)
+    else:
+        end_month = end_month.replace(month=end_month.month + 1)
+    end = LocalTz.localize(end_month)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def local_period_start(timestamp: int, interval: str) -> int:
+    """Unix start of the Europe/London week/month/year containing `timestamp`, like date_trunc."""
+    local = datetime.fromtimestamp(timestamp, LocalTz).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    if interval == "weekly":
+        local -= timedelta(days=local.weekday())
+    elif interval == "monthly":
+        local = local.replace(day=1)
+    elif interval == "yearly":
+        local = local.replace(month=1, day=1)
+    return int(LocalTz.localize(local).timestamp())
+
+
+def next_local_period_start(timestamp: int, interval: str) -> int:
+    """Unix start of the period after the one containing `timestamp`."""
+    start = datetime.fromtimestamp(local_period_start(timestamp, interval), LocalTz).replace(tzinfo=None)
+    if interval == "weekly":
+        start += timedelta(days=7)
+    elif interval == "monthly":
+        start = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    else:
+        start = start.replace(year=start.year + 1)
+    return int(LocalTz.localize(start).timestamp())
+
+
+def report_spans(start_ts: int, end_ts: int, interval: str):
+    """
+    Split [start_ts, end_ts) into (start, end, whole_periods) spans. Rollup rows
+    cover whole periods, so only the periods lying fully inside the range are
+    read from them; a partial first or last period is aggregated from the daily
+    rows of the range alone.
+    """
+    if interval not in ROLLUP_INTERVALS:
+        return [(start_ts, end_ts, False)]
+    first_whole = start_ts if local_period_start(start_ts, interval) == start_ts else next_local_period_start(start_ts, interval)
+    whole_end = local_period_start(end_ts, interval)
+    if first_whole >= whole_end:
+        return [(start_ts, end_ts, False)]
+    spans = []
+    if start_ts < first_whole:
+        spans.append((start_ts, first_whole, False))
+    spans.append((first_whole, whole_end, True))
+    if whole_end < end_ts:
+        spans.append((whole_end, end_ts, False))
+    return spans
+
+
+def rollup_ohlc_query(session: Session, coin_id: int, start_ts: int, end_ts: int, interval: str):
+    """
+    Read pre-aggregated periods from coin_rollups; a decade of years is ten rows.
+    Each row covers its whole period, so the bounds must be period-aligned.
+    """
+    return (
+        session.query(
+            CoinRollup.period_start.label("period"),
+            CoinRollup.open,
+            CoinRollup.high,
+            CoinRollup.low,
+            CoinRollup.close,
+        )
+        .filter(
+            CoinRollup.coin_id == coin_id,
+            CoinRollup.interval == interval,
+            CoinRollup.period_start >= start_ts,
+            CoinRollup.period_start < end_ts,
+        )
+        .order_by(CoinRollup.period_start)
+        .execution_options(yield_per=REPORT_FETCH_SIZE)
+    )
+
+
+def interval_ohlc_query(session: Session, coin_id: int, start_ts: int, end_ts: int, interval: str, use_rollups: bool = True):
+    """
+    One query returning open, high, low and close for every period of
+    `interval` ("daily", "weekly", "monthly" or "yearly"). Intervals with a
+    rollup table are read from it when `use_rollups` is set and both bounds
+    are period starts; otherwise they are aggregated from the daily rows in
+    the range.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown interval {interval!r}, expected one of {list(INTERVALS)}")
+    if use_rollups and report_spans(start_ts, end_ts, interval) == [(start_ts, end_ts, True)]:
+        return rollup_ohlc_query(session, coin_id, start_ts, end_ts, interval)
+    local_time = func.timezone(literal_column("'Europe/London'"), func.to_timestamp(CoinHistoric.timestamp))
+    period = func.date_trunc(INTERVALS[interval], local_time).label("period")
+    # Placeholder rows for the open day are all zeros, skip them like the old report did
+    complete = and_(CoinHistoric.open > 0, CoinHistoric.close > 0)
+    first_open = array_agg(
+        aggregate_order_by(CoinHistoric.open, CoinHistoric.timestamp.asc())
+    ).filter(complete)[1].label("open")
+    last_close = array_agg(
+        aggregate_order_by(CoinHistoric.close, CoinHistoric.timestamp.desc())
+    ).filter(complete)[1].label("close")
+    high = func.max(CoinHistoric.high).filter(complete).label("high")
+    low = func.min(CoinHistoric.low).filter(complete).label("low")
+    return (
+        session.query(period, first_open, high, low, last_close)
+        .filter(
+            CoinHistoric.coin_id == coin_id,
+            CoinHistoric.timestamp >= start_ts,
+            CoinHistoric.timestamp < end_ts,
+        )
+        .group_by(period)
+        .order_by(period)
+        .execution_options(yield_per=REPORT_FETCH_SIZE)
+    )
+
+
+def iter_interval_ohlc(session: Session, coin_id: int, start_ts: int, end_ts: int, interval: str, use_rollups: bool = True):
+    """
+    Stream report rows as dicts, one per period that has complete candles.
+    Partial first and last periods only cover the days inside the range.
+    """
+    for span_start, span_end, whole_periods in report_spans(start_ts, end_ts, interval):
+        rows = interval_ohlc_query(session, coin_id, span_start, span_end, interval, use_rollups and whole_periods)
+        for row in rows:
+            if row.open is None or row.close is None:
+                continue
+            period = row.period
+            if isinstance(period, int):
+                # Rollups store the unix start; match the naive local datetime of date_trunc
+                period = datetime.fromtimestamp(period, LocalTz).replace(tzinfo=None)
+            yield {
+                "period": period,
+                "open": row.open,
+                "high": row.high,
+                "low": row.low,
+                "close": row.close,
+                "change": (row.close - row.open) / row.open * 100,
+            }
@@ -0,0 +1,130 @@
+﻿import csv
+import gzip
+import importlib.util
+import io
+from datetime import datetime
+from Scripts.report import iter_interval_ohlc, REPORT_FETCH_SIZE, LocalTz
+from Scripts.indicators import indicators_between, COLUMNS as INDICATORS, PERIODS
+
+
+FORMATS = ("csv", "parquet")
+# Formats that can be written here; Parquet needs the optional pyarrow package
+AVAILABLE_FORMATS = tuple(fmt for fmt in FORMATS if fmt != "parquet" or importlib.util.find_spec("pyarrow"))
+# Daily reports longer than this are gzip-compressed unless the caller decides otherwise
+GZIP_THRESHOLD_DAYS = 366
+
+REPORT_COLUMNS = {
+    "daily": (["Date"], lambda period: [period.strftime('%d/%m/%Y')]),
+    "weekly": (["Week Starting"], lambda period: [period.strftime('%d/%m/%Y')]),
+    "monthly": (["Month", "Year"], lambda period: [period.strftime('%B'), period.strftime('%Y')]),
+    "yearly": (["Year"], lambda period: [period.strftime('%Y')]),
+}
+# Optional columns of daily reports, from coin_indicators
+INDICATOR_COLUMNS = ["SMA 20", "SMA 50", "EMA 12", "EMA 26", "RSI 14", "Volatility 20"]
+
+
+def should_compress(interval, start_ts, end_ts):
+    return interval == "daily" and (end_ts - start_ts) / 86400 > GZIP_THRESHOLD_DAYS
+
+
+def with_indicators(rows, session, coin_id, start_ts, end_ts):
+    """Add the day's indicator values to each daily report row (None where there are none)."""
+    # Daily candles are stamped at UTC or local midnight, both fall on the local date
+    by_day = {
+        datetime.fromtimestamp(timestamp, LocalTz).date(): values
+        for timestamp, values in indicators_between(session, coin_id, PERIODS["daily"], start_ts, end_ts).items()
+    }
+    empty = dict.fromkeys(INDICATORS)
+    for row in rows:
+        row.update(by_day.get(row["period"].date(), empty))
+        yield row
+
+
+def write_csv(rows, binary_stream, interval, indicators=False):
+    period_columns, format_period = REPORT_COLUMNS[interval]
+    text_stream = io.TextIOWrapper(binary_stream, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text_stream)
+    writer.writerow(period_columns + ['Open', 'High', 'Low', 'Close', 'Percentage Change']
+                    + (INDICATOR_COLUMNS if indicators else []))
+    for row in rows:
+        writer.writerow(format_period(row["period"]) + [
+            row["open"],
+            row["high"],
+            row["low"],
+            row["close"],
+            f"{row['change']:.2f}%",
+        ] + ([
+            "" if row[name] is None else f"{row[name]:.6g}" for name in INDICATORS
+        ] if indicators else []))
+    # Hand the underlying stream back without closing it
+    text_stream.detach()
+
+
+def write_parquet(rows, binary_stream, indicators=False):
+    """Columnar export written one row group at a time, needs the optional pyarrow package."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([
+        ("period", pa.timestamp("s")),
+        ("open", pa.float64()),
+        ("high", pa.float64()),
+        ("low", pa.float64()),
+        ("close", pa.float64()),
+        ("change", pa.float64()),
+    ] + ([(name, pa.float32()) for name in INDICATORS] if indicators else []))
+
+    def flush(writer, chunk):
+        columns = {name: [row[name] for row in chunk] for name in schema.names}
+        for name in ("open", "high", "low", "close", "change"):
+            columns[name] = [float(value) for value in columns[name]]
+        writer.write_table(pa.table(columns, schema=schema))
+
+    with pq.ParquetWriter(binary_stream, schema, compression="zstd") as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= REPORT_FETCH_SIZE:
+                flush(writer, chunk)
+                chunk = []
+        if chunk:
+            flush(writer, chunk)
+
+
+def export_report(session, coin_id, start_ts, end_ts, interval, fmt="csv", compress=None, basename="report", indicators=False):
+    """
+    Stream report rows from the DB cursor into an in-memory buffer.
+
+    Returns (buffer, filename); the buffer is rewound and ready for discord.File.
+    CSV output is gzip-compressed when `compress` is True, or by default for long
+    daily ranges. Parquet is compressed internally. `indicators` adds the
+    SMA/EMA/RSI/volatility columns, daily reports only.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {FORMATS}")
+    if indicators and interval != "daily":
+        raise ValueError("Indicator columns are only available in daily reports")
+    rows = iter_interval_ohlc(session, coin_id, start_ts, end_ts, interval)
+    if indicators:
+        rows = with_indicators(rows, session, coin_id, start_ts, end_ts)
+    buffer = io.BytesIO()
+
+    if fmt == "parquet":
+        write_parquet(rows, buffer, indicators)
+        filename = f"{basename}.parquet"
+    else:
+        if compress is None:
+            compress = should_compress(interval, start_ts, end_ts)
+        if compress:
+            with gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
+                write_csv(rows, gz, interval, indicators)
+            filename = f"{basename}.csv.gz"
+        else:
+            write_csv(rows, buffer, interval, indicators)
+            filename = f"{basename}.csv"
+
+    buffer.seek(0)
+    return buffer, filename
@@ -0,0 +1,94 @@
+﻿import hashlib
+import json
+import os
+import threading
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache for API responses that can no longer change.
+
+    Entries are JSON files named after the SHA-256 of their key. When the total
+    size exceeds `max_bytes` the least recently used files (by mtime, refreshed
+    on every hit) are evicted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                self._sizes[name] = os.path.getsize(os.path.join(directory, name))
+        self.size = sum(self._sizes.values())
+
+    @staticmethod
+    def make_key(endpoint: str, **fields) -> str:
+        raw = json.dumps([endpoint, sorted(fields.items())], separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, key: str):
+        name = f"{key}.json"
+        try:
+            with open(self._path(name), "rb") as f:
+                value = json.loads(f.read())
+            os.utime(self._path(name))
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value):
+        name = f"{key}.json"
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        # Write then rename so readers never see a partial file
+        tmp = self._path(f"{name}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(name))
+        with self._lock:
+            self.size += len(data) - self._sizes.get(name, 0)
+            self._sizes[name] = len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        def mtime(name):
+            try:
+                return os.path.getmtime(self._path(name))
+            except FileNotFoundError:
+                return 0
+
+        # Drop down to 90% of the budget so eviction doesn't run on every put
+        for name in sorted(self._sizes, key=mtime):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+            self.size -= self._sizes.pop(name)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._sizes),
+                "bytes": self.size,
+            }
@@ -0,0 +1,124 @@
+﻿"""
+Incrementally maintained weekly/monthly/yearly OHLC rollups.
+
+Usage: python -m Scripts.rollups rebuild [SYMBOL]
+"""
+import sys
+from sqlalchemy import func, and_, case, literal, literal_column, select, cast, Integer
+from sqlalchemy.dialects.postgresql import insert, array_agg, aggregate_order_by
+from sqlalchemy.orm import Session
+from Models.coins import Coin, CoinHistoric, CoinRollup, SessionLocal
+
+
+ROLLUP_INTERVALS = {"weekly": "week", "monthly": "month", "yearly": "year"}
+
+
+def local_period_start(unit: str, timestamp_column):
+    """Unix start of the Europe/London day/week/month/year containing `timestamp_column`."""
+    london = literal_column("'Europe/London'")
+    local_time = func.timezone(london, func.to_timestamp(timestamp_column))
+    return cast(func.extract("epoch", func.timezone(london, func.date_trunc(unit, local_time))), Integer)
+
+
+def merge_into_rollups(session: Session, coin_id: int, start_ts: int, end_ts: int, intervals=ROLLUP_INTERVALS):
+    """
+    Fold the daily candles of one coin in [start_ts, end_ts] into the rollups.
+
+    Only the new rows are aggregated; the result is merged with the existing
+    period row (earliest open, latest close, max high, min low), so the update
+    is idempotent and costs O(new rows) rather than O(period).
+    """
+    complete = and_(CoinHistoric.open > 0, CoinHistoric.close > 0)
+    for interval in intervals:
+        period = local_period_start(ROLLUP_INTERVALS[interval], CoinHistoric.timestamp)
+        source = (
+            select(
+                CoinHistoric.coin_id,
+                literal(interval),
+                period,
+                array_agg(aggregate_order_by(CoinHistoric.open, CoinHistoric.timestamp.asc()))[1],
+                func.max(CoinHistoric.high),
+                func.min(CoinHistoric.low),
+                array_agg(aggregate_order_by(CoinHistoric.close, CoinHistoric.timestamp.desc()))[1],
+                func.min(CoinHistoric.timestamp),
+                func.max(CoinHistoric.timestamp),
+            )
+            .where(
+                CoinHistoric.coin_id == coin_id,
+                CoinHistoric.timestamp >= start_ts,
+                CoinHistoric.timestamp <= end_ts,
+                complete,
+            )
+            .group_by(CoinHistoric.coin_id, period)
+        )
+        statement = insert(CoinRollup).from_select(
+            ["coin_id", "interval", "period_start", "open", "high", "low", "close", "first_ts", "last_ts"],
+            source,
+        )
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(
+            index_elements=["coin_id", "interval", "period_start"],
+            set_={
+                "open": case((excluded.first_ts < CoinRollup.first_ts, excluded.open), else_=CoinRollup.open),
+                "first_ts": func.least(excluded.first_ts, CoinRollup.first_ts),
+                "close": case((excluded.last_ts > CoinRollup.last_ts, excluded.close), else_=CoinRollup.close),
+                "last_ts": func.greatest(excluded.last_ts, CoinRollup.last_ts),
+                "high": func.greatest(excluded.high, CoinRollup.high),
+                "low": func.least(excluded.low, CoinRollup.low),
+            },
+        )
+        session.execute(statement)
+
+
+def rebuild_rollup_periods(session: Session, coin_id: int, start_ts: int, end_ts: int):
+    """
+    Recompute from scratch the periods of one coin that contain [start_ts, end_ts].
+    Merging can only widen a period's high and low, so this is needed when
+    existing daily rows were rewritten rather than added.
+    """
+    for interval, unit in ROLLUP_INTERVALS.items():
+        first = session.scalar(select(local_period_start(unit, literal(start_ts))))
+        last = session.scalar(select(local_period_start(unit, literal(end_ts))))
+        session.query(CoinRollup).filter(
+            CoinRollup.coin_id == coin_id,
+            CoinRollup.interval == interval,
+            CoinRollup.period_start.between(first, last),
+        ).delete(synchronize_session=False)
+        # A row never lies before the start of its own period
+        low, high = session.query(func.min(CoinHistoric.timestamp), func.max(CoinHistoric.timestamp)).filter(
+            CoinHistoric.coin_id == coin_id,
+            CoinHistoric.timestamp >= first,
+            local_period_start(unit, CoinHistoric.timestamp).between(first, last),
+        ).one()
+        if low is not None:
+            merge_into_rollups(session, coin_id, low, high, intervals=(interval,))
+
+
+def rebuild_rollups(session: Session, coin_id: int = None):
+    """Recompute the rollups from scratch, e.g. after a bulk backfill or a repair."""
+    coins = session.query(Coin.id)
+    if coin_id is not None:
+        coins = coins.filter(Coin.id == coin_id)
+    for (current_id,) in coins.all():
+        session.query(CoinRollup).filter(CoinRollup.coin_id == current_id).delete()
+        merge_into_rollups(session, current_id, 0, 2 ** 31 - 1)
+    session.commit()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print(__doc__)
+        sys.exit(1)
+    session = SessionLocal()
+    try:
+        coin_id = None
+        if len(sys.argv) > 2:
+            coin = session.query(Coin).filter(Coin.symbol == sys.argv[2].upper()).first()
+            if coin is None:
+                print(f"{sys.argv[2].upper()} is not in the database")
+                sys.exit(1)
+            coin_id = coin.id
+        rebuild_rollups(session, coin_id)
+        print("Rollups rebuilt")
+    finally:
+        session.close()
@@ -1,8 +1,8 @@
-﻿import requests
+﻿from Scripts.webhook_dispatcher import get_dispatcher
 from datetime import datetime,timedelta
 
 
-def send_message(content, webHook, username, type, embed = False, color = "", hour = 0, daily = False):
+def send_message(content, webHook, username, type, embed = False, color = "", hour = 0, daily = False, title = None):
     icon_list = {
         'plus': "https://as2.ftcdn.net/v2/jpg/02/22/71/79/1000_F_222717975_8TfDJLKSAjUmukqhJFcfrhGaNP9xaePZ.jpg",
         "historic": "https://cdn-icons-png.flaticon.com/512/2961/2961948.png",
@@ -15,7 +15,9 @@ def send_message(content, webHook, username, type, embed = False, color = "", ho
             "green": 3066993,    # Green color
             "yellow": 16776960   # Yellow color
         }
-        if daily:
+        if title is not None:
+            pass
+        elif daily:
             title = f" {username} Daily Update"
         else:
             title = f" {username} Hourly Update on {run_time}"
@@ -37,8 +39,5 @@ def send_message(content, webHook, username, type, embed = False, color = "", ho
             "username": username,
             "avatar_url": icon_list[type]
         }
-    response = requests.post(webHook, json=message)
-    if response.status_code == 204:
-        print("Message sent successfully!")
-    else:
-        print(f"Failed to send message: {response.status_code}")
+    # Queued; the dispatcher batches, retries and honours per-webhook rate limits
+    get_dispatcher().submit(webHook, message)
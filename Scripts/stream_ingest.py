@@ -0,0 +1,292 @@
+﻿"""
+Streaming ingestion: poll live prices every few seconds, aggregate them into
+minute and hour candles in memory and store each candle within seconds of it
+closing, instead of waiting for the next hourly cron run.
+
+Usage: python -m Scripts.stream_ingest
+or set STREAM_INGEST=1 to run it inside the scheduler process (main.py).
+
+Candles go to coin_stream_candles. The cron's coin_hourly candles stay the
+authoritative history; stream candles are the live view.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from sqlalchemy import func
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.dialects.postgresql import insert
+from Models.coins import Coin, CoinStreamCandle, SessionLocal
+from Scripts.get_historic_coin_data import API_KEY, make_api_request
+from Scripts.providers import PRICE_MULTI
+from Scripts import metrics
+
+
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", "2"))
+STREAM_FLUSH_SECONDS = float(os.getenv("STREAM_FLUSH_SECONDS", "5"))
+STREAM_FLUSH_BATCH = int(os.getenv("STREAM_FLUSH_BATCH", "1000"))
+# Closed candles kept while the database is unreachable; the oldest are dropped beyond this
+STREAM_MAX_PENDING = int(os.getenv("STREAM_MAX_PENDING", "100000"))
+STREAM_MINUTE_RETENTION_HOURS = int(os.getenv("STREAM_MINUTE_RETENTION_HOURS", "48"))
+# Symbols per pricemulti request
+STREAM_PRICE_BATCH_SIZE = int(os.getenv("STREAM_PRICE_BATCH_SIZE", "50"))
+COIN_REFRESH_SECONDS = 60
+PERIODS = (60, 3600)
+# Errors meaning the database could not be reached, as opposed to a rejected row
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+
+class CandleAggregator:
+    """One open candle per (coin, period), so memory stays constant per coin."""
+
+    def __init__(self, periods=PERIODS):
+        self.periods = periods
+        self._open = {}  # (coin_id, period) -> [start, open, high, low, close]
+
+    def __len__(self):
+        return len(self._open)
+
+    @staticmethod
+    def _row(key, candle):
+        coin_id, period = key
+        start, open_price, high, low, close = candle
+        return {"coin_id": coin_id, "period": period, "timestamp": start,
+                "open": open_price, "high": high, "low": low, "close": close}
+
+    def add_tick(self, coin_id: int, timestamp: int, price: float):
+        """Fold one price into the coin's open candles; returns the candles this tick closed."""
+        closed = []
+        for period in self.periods:
+            start = timestamp - timestamp % period
+            key = (coin_id, period)
+            candle = self._open.get(key)
+            if candle is not None and candle[0] != start:
+                if start < candle[0]:
+                    continue  # Late tick for a candle that is already closed
+                closed.append(self._row(key, candle))
+                candle = None
+            if candle is None:
+                self._open[key] = [start, price, price, price, price]
+            else:
+                candle[2] = max(candle[2], price)
+                candle[3] = min(candle[3], price)
+                candle[4] = price
+        return closed
+
+    def close_due(self, now: int):
+        """Close every candle whose period has ended, even if no later tick arrived."""
+        closed = []
+        for key, candle in list(self._open.items()):
+            if candle[0] + key[1] <= now:
+                closed.append(self._row(key, candle))
+                del self._open[key]
+        return closed
+
+    def forget(self, coin_ids):
+        """Drop the state of coins that are no longer tracked."""
+        for key in [key for key in self._open if key[0] in coin_ids]:
+            del self._open[key]
+
+
+class StreamIngestor:
+    def __init__(self, tsym: str = "USD", poll_seconds: float = STREAM_POLL_SECONDS,
+                 flush_seconds: float = STREAM_FLUSH_SECONDS, flush_batch: int = STREAM_FLUSH_BATCH):
+        self.tsym = tsym
+        self.poll_seconds = poll_seconds
+        self.flush_seconds = flush_seconds
+        self.flush_batch = flush_batch
+        self.aggregator = CandleAggregator()
+        self.pending = deque()
+        self.coins = {}  # symbol -> coin id
+        self.ticks = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.max_latency = 0.0
+        self._last_flush = time.monotonic()
+        self._last_refresh = 0.0
+        self._last_prune = 0.0
+
+    def refresh_coins(self, session):
+        coins = dict(session.query(Coin.symbol, Coin.id))
+        removed = set(self.coins.values()) - set(coins.values())
+        if removed:
+            self.aggregator.forget(removed)
+        self.coins = coins
+
+    def _queue(self, rows):
+        for row in rows:
+            if len(self.pending) >= STREAM_MAX_PENDING:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append(row)
+
+    def poll(self):
+        """One round of live prices for every tracked coin."""
+        symbols = list(self.coins)
+        received = 0
+        for start in range(0, len(symbols), STREAM_PRICE_BATCH_SIZE):
+            batch = symbols[start:start + STREAM_PRICE_BATCH_SIZE]
+            try:
+                result = make_api_request(PRICE_MULTI, {"fsyms": ",".join(batch), "tsyms": self.tsym, "api_key": API_KEY})
+            except Exception as e:
+                print(f"Error polling prices for {batch}: {e}")
+                continue
+            if result.get("Response") == "Error":
+                print(f"Error polling prices for {batch}: {result.get('Message')}")
+                continue
+            now = int(time.time())
+            for symbol, prices in result.items():
+                price = prices.get(self.tsym) if isinstance(prices, dict) else None
+                if symbol in self.coins and price:
+                    received += 1
+                    self._queue(self.aggregator.add_tick(self.coins[symbol], now, float(price)))
+        self.ticks += received
+        metrics.inc("stream_ticks_total", received)
+
+    def _write(self, session, rows):
+        statement = insert(CoinStreamCandle).values(rows)
+        # A candle restarted after a crash is merged with what was stored before
+        statement = statement.on_conflict_do_update(
+            index_elements=["coin_id", "period", "timestamp"],
+            set_={
+                "high": func.greatest(CoinStreamCandle.high, statement.excluded.high),
+                "low": func.least(CoinStreamCandle.low, statement.excluded.low),
+                "close": statement.excluded.close,
+            },
+        )
+        with metrics.timer("db_commit_seconds", path="stream"):
+            session.execute(statement)
+            session.commit()
+
+    def _write_singly(self, session, rows):
+        """
+        Write `rows` one at a time after their batch was rejected, dropping the
+        rows that still fail. Returns (rows handled, rows stored); it stops
+        early if the database becomes unreachable.
+        """
+        stored = []
+        for handled, row in enumerate(rows):
+            try:
+                self._write(session, [row])
+            except CONNECTION_ERRORS as e:
+                session.rollback()
+                print(f"Error flushing stream candles: {e}")
+                return handled, stored
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Dropping stream candle {row} the database rejected: {e}")
+                self.rejected += 1
+                metrics.inc("stream_candles_rejected_total")
+                continue
+            stored.append(row)
+        return len(rows), stored
+
+    def flush(self, session):
+        """
+        Write the closed candles, `flush_batch` rows per statement. While the
+        database is unreachable the rows stay queued for the next flush. A batch
+        the database rejects is retried row by row and the rows that still fail
+        are dropped, so one bad candle cannot hold up the rest of the queue.
+        """
+        written = 0
+        while self.pending:
+            rows = [self.pending[i] for i in range(min(len(self.pending), self.flush_batch))]
+            try:
+                self._write(session, rows)
+                handled, stored = len(rows), rows
+            except CONNECTION_ERRORS as e:
+                session.rollback()
+                print(f"Error flushing {len(rows)} stream candles: {e}")
+                break
+            except Exception as e:
+                session.rollback()
+                print(f"Error flushing {len(rows)} stream candles, retrying them one by one: {e}")
+                handled, stored = self._write_singly(session, rows)
+            for _ in range(handled):
+                self.pending.popleft()
+            now = time.time()
+            for row in stored:
+                latency = now - (row["timestamp"] + row["period"])
+                self.max_latency = max(self.max_latency, latency)
+                metrics.observe("stream_candle_latency_seconds", latency, period=row["period"])
+            written += len(stored)
+            if handled < len(rows):
+                break
+        self.flushed += written
+        metrics.inc("rows_inserted_total", written, table="coin_stream_candles")
+        return written
+
+    def prune(self, session):
+        """Drop minute candles older than STREAM_MINUTE_RETENTION_HOURS."""
+        cutoff = int(time.time()) - STREAM_MINUTE_RETENTION_HOURS * 3600
+        session.query(CoinStreamCandle).filter(
+            CoinStreamCandle.period == 60, CoinStreamCandle.timestamp < cutoff
+        ).delete(synchronize_session=False)
+        session.commit()
+
+    def step(self, session):
+        """One poll, plus whatever refresh, flush or prune is due."""
+        now = time.monotonic()
+        if now - self._last_refresh >= COIN_REFRESH_SECONDS:
+            self.refresh_coins(session)
+            session.commit()
+            self._last_refresh = now
+        self.poll()
+        self._queue(self.aggregator.close_due(int(time.time())))
+        if len(self.pending) >= self.flush_batch or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush(session)
+            self._last_flush = time.monotonic()
+        if now - self._last_prune >= 3600:
+            self.prune(session)
+            self._last_prune = now
+        metrics.set_gauge("stream_pending_candles", len(self.pending))
+
+    def run(self, stop_event: threading.Event = None):
+        """Poll every `poll_seconds` until `stop_event` is set, then flush what is left."""
+        stop_event = stop_event or threading.Event()
+        session = SessionLocal()
+        try:
+            while not stop_event.is_set():
+                started = time.monotonic()
+                try:
+                    self.step(session)
+                except Exception as e:
+                    session.rollback()
+                    logging.exception(f"Stream ingestion step failed: {e}")
+                stop_event.wait(max(0.0, self.poll_seconds - (time.monotonic() - started)))
+            self._queue(self.aggregator.close_due(int(time.time())))
+            self.flush(session)
+        finally:
+            session.close()
+
+    def stats(self):
+        return {
+            "coins": len(self.coins),
+            "open_candles": len(self.aggregator),
+            "ticks": self.ticks,
+            "pending": len(self.pending),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "max_latency_seconds": round(self.max_latency, 3),
+        }
+
+
+def start_stream_ingest():
+    """Run a StreamIngestor on a daemon thread; returns (ingestor, stop_event)."""
+    ingestor = StreamIngestor()
+    stop_event = threading.Event()
+    threading.Thread(target=ingestor.run, args=(stop_event,), name="stream-ingest", daemon=True).start()
+    return ingestor, stop_event
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    metrics.start_from_env()
+    stop = threading.Event()
+    try:
+        StreamIngestor().run(stop)
+    except KeyboardInterrupt:
+        stop.set()
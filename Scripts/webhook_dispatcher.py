@@ -0,0 +1,244 @@
+﻿import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from Scripts import metrics
+
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_RETRIES = int(os.getenv("WEBHOOK_MAX_RETRIES", "5"))
+# Discord accepts at most 10 embeds per webhook message
+MAX_EMBEDS_PER_MESSAGE = 10
+
+
+class WebhookDispatcher:
+    """
+    Queues webhook messages and sends them from a small worker pool over one
+    keep-alive session. Each webhook is its own rate-limit bucket: a 429 (or an
+    exhausted X-RateLimit-Remaining) parks that webhook until Retry-After while
+    other webhooks keep flowing. Queued embed messages for the same webhook and
+    sender are coalesced into one request of up to 10 embeds.
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, max_retries: int = WEBHOOK_MAX_RETRIES, session=None):
+        self.max_retries = max_retries
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="webhook")
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._pending = {}          # (webhook, username, avatar_url) -> deque of queued messages
+        self._blocked_until = {}    # webhook -> time.monotonic() when it may send again
+        self._in_flight = set()
+        self._outstanding = 0
+        self._stopped = False
+        self._started = time.monotonic()
+        self.counters = {
+            "submitted": 0,
+            "sent": 0,
+            "requests": 0,
+            "coalesced": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "dropped": 0,
+        }
+        self._scheduler = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+        self._scheduler.start()
+
+    def submit(self, webhook: str, message: dict):
+        """Queue a message; it is sent asynchronously."""
+        key = (webhook, message.get("username"), message.get("avatar_url"))
+        with self._lock:
+            self._pending.setdefault(key, deque()).append({"message": message, "attempts": 0})
+            self._outstanding += 1
+            self.counters["submitted"] += 1
+        self._wakeup.set()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every queued message has been sent or dropped."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._outstanding:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["queued"] = self._outstanding
+        elapsed = time.monotonic() - self._started
+        stats["messages_per_second"] = stats["sent"] / elapsed if elapsed else 0.0
+        return stats
+
+    def close(self, timeout: float = 10):
+        self.flush(timeout)
+        self._stopped = True
+        self._wakeup.set()
+        self._pool.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.clear()
+            delay = self._dispatch_ready()
+            self._wakeup.wait(delay)
+
+    def _dispatch_ready(self):
+        """Hand every sendable batch to the pool; return seconds until the next bucket reopens."""
+        now = time.monotonic()
+        next_ready = None
+        with self._lock:
+            for key, queued in self._pending.items():
+                if not queued or key in self._in_flight:
+                    continue
+                blocked_until = self._blocked_until.get(key[0], 0)
+                if blocked_until > now:
+                    wait = blocked_until - now
+                    next_ready = wait if next_ready is None else min(next_ready, wait)
+                    continue
+                batch = self._take_batch(queued)
+                self._in_flight.add(key)
+                self._pool.submit(self._send, key, batch)
+            self._pending = {key: queued for key, queued in self._pending.items() if queued or key in self._in_flight}
+        return next_ready
+
+    @staticmethod
+    def _take_batch(queued):
+        first = queued.popleft()
+        batch = [first]
+        if "embeds" not in first["message"]:
+            return batch
+        embeds = len(first["message"]["embeds"])
+        while queued and "embeds" in queued[0]["message"]:
+            size = len(queued[0]["message"]["embeds"])
+            if embeds + size > MAX_EMBEDS_PER_MESSAGE:
+                break
+            batch.append(queued.popleft())
+            embeds += size
+        return batch
+
+    @staticmethod
+    def _build_payload(batch):
+        if len(batch) == 1:
+            return batch[0]["message"]
+        payload = dict(batch[0]["message"])
+        payload["embeds"] = [embed for item in batch for embed in item["message"]["embeds"]]
+        return payload
+
+    def _send(self, key, batch):
+        """
+        Post one batch. The in-flight and outstanding bookkeeping always runs, so
+        an unexpected error drops the batch instead of wedging its webhook.
+        """
+        done = len(batch)
+        try:
+            done = self._post(key, batch)
+        except Exception:
+            logging.exception(f"Unexpected error sending to a webhook, dropping {len(batch)} message(s)")
+            with self._lock:
+                self.counters["dropped"] += len(batch)
+            metrics.inc("webhook_messages_total", len(batch), result="dropped")
+        finally:
+            with self._lock:
+                self._outstanding -= done
+                self._in_flight.discard(key)
+                self._idle.notify_all()
+            self._wakeup.set()
+
+    def _post(self, key, batch):
+        """Send the batch and requeue what should be retried; returns how many messages are finished."""
+        webhook = key[0]
+        retry_after = None
+        try:
+            with metrics.timer("webhook_send_seconds"):
+                response = self.session.post(webhook, json=self._build_payload(batch), timeout=10)
+            status = response.status_code
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                reset_after = float(response.headers.get("X-RateLimit-Reset-After", 0))
+                self._block(webhook, reset_after)
+            if status == 429:
+                retry_after = self._retry_after(response)
+        except requests.RequestException as e:
+            logging.warning(f"Webhook request failed: {e}")
+            status = None
+
+        with self._lock:
+            self.counters["requests"] += 1
+            done = 0
+            if status is not None and 200 <= status < 300:
+                self.counters["sent"] += len(batch)
+                self.counters["coalesced"] += len(batch) - 1
+                done = len(batch)
+                metrics.inc("webhook_messages_total", len(batch), result="sent")
+            elif status == 429 or status is None or status >= 500:
+                if status == 429:
+                    self.counters["rate_limited"] += 1
+                    metrics.inc("webhook_messages_total", len(batch), result="rate_limited")
+                    self._blocked_until[webhook] = time.monotonic() + retry_after
+                else:
+                    # Back off exponentially on network and server errors
+                    attempts = max(item["attempts"] for item in batch)
+                    self._blocked_until[webhook] = time.monotonic() + min(30, 2 ** attempts)
+                retry = []
+                for item in batch:
+                    item["attempts"] += 1
+                    if item["attempts"] > self.max_retries:
+                        self.counters["dropped"] += 1
+                        done += 1
+                        metrics.inc("webhook_messages_total", result="dropped")
+                    else:
+                        self.counters["retries"] += 1
+                        retry.append(item)
+                # Put them back at the front so ordering per webhook is preserved
+                self._pending.setdefault(key, deque()).extendleft(reversed(retry))
+            else:
+                logging.error(f"Failed to send message: {status}, dropping {len(batch)} message(s)")
+                self.counters["dropped"] += len(batch)
+                done = len(batch)
+                metrics.inc("webhook_messages_total", len(batch), result="dropped")
+        return done
+
+    def _block(self, webhook, seconds):
+        with self._lock:
+            self._blocked_until[webhook] = max(self._blocked_until.get(webhook, 0), time.monotonic() + seconds)
+
+    @staticmethod
+    def _retry_after(response):
+        header = response.headers.get("Retry-After")
+        if header is not None:
+            try:
+                return float(header)
+            except ValueError:
+                pass
+        try:
+            body = response.json()
+            return float(body.get("retry_after", 1)) if isinstance(body, dict) else 1.0
+        except (ValueError, TypeError):
+            return 1.0
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> WebhookDispatcher:
+    """Process-wide dispatcher, started on first use and flushed at exit."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = WebhookDispatcher()
+                atexit.register(_dispatcher.close)
+    return _dispatcher
@@ -0,0 +1,127 @@
+﻿"""
+Per-cycle coin leases that let several scheduler processes share the coin set.
+
+A worker claims a coin for the current cycle by inserting its row into
+coin_cycle_claims. The insert only wins if nobody holds the coin, or if the
+holder's lease has expired. While a worker is busy, a heartbeat thread renews
+its unfinished leases. When a worker crashes its leases expire after
+WORKER_LEASE_SECONDS, and whoever claims them next takes the coins over.
+"""
+import os
+import socket
+import threading
+import time
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from Models.coins import CoinCycleClaim
+
+
+def lease_seconds():
+    return int(os.getenv("WORKER_LEASE_SECONDS", "120"))
+
+
+def worker_id():
+    """WORKER_ID, or host-pid so workers on different machines never collide."""
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def claim_coins(session: Session, cycle_start: int, coin_ids: list, worker: str, lease: int = None) -> set:
+    """
+    Try to claim `coin_ids` for the cycle in one statement. Returns the ids this
+    worker now holds: new claims, its own claims, and expired unfinished
+    claims taken over from another worker.
+    """
+    if not coin_ids:
+        return set()
+    lease = lease_seconds() if lease is None else lease
+    now = int(time.time())
+    statement = insert(CoinCycleClaim).values([
+        {"coin_id": coin_id, "cycle_start": cycle_start, "worker_id": worker, "heartbeat_at": now}
+        for coin_id in coin_ids
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=["coin_id", "cycle_start"],
+        set_={"worker_id": statement.excluded.worker_id, "heartbeat_at": statement.excluded.heartbeat_at},
+        where=CoinCycleClaim.finished_at.is_(None) & (
+            (CoinCycleClaim.worker_id == worker) | (CoinCycleClaim.heartbeat_at < now - lease)
+        ),
+    ).returning(CoinCycleClaim.coin_id)
+    claimed = {coin_id for (coin_id,) in session.execute(statement)}
+    session.commit()
+    return claimed
+
+
+def finish_coin(session: Session, cycle_start: int, coin_id: int, worker: str):
+    """Mark the coin done for the cycle, unless another worker took the lease over meanwhile."""
+    session.query(CoinCycleClaim).filter(
+        CoinCycleClaim.coin_id == coin_id,
+        CoinCycleClaim.cycle_start == cycle_start,
+        CoinCycleClaim.worker_id == worker,
+    ).update({"finished_at": int(time.time())}, synchronize_session=False)
+    session.commit()
+
+
+def renew_leases(session: Session, cycle_start: int, worker: str):
+    renewed = session.query(CoinCycleClaim).filter(
+        CoinCycleClaim.cycle_start == cycle_start,
+        CoinCycleClaim.worker_id == worker,
+        CoinCycleClaim.finished_at.is_(None),
+    ).update({"heartbeat_at": int(time.time())}, synchronize_session=False)
+    session.commit()
+    return renewed
+
+
+def unfinished_claims(session: Session, cycle_start: int, coin_ids: list, lease: int = None):
+    """
+    Unfinished claims among `coin_ids` for the cycle, as (expired coin ids,
+    number still held by a live worker).
+    """
+    lease = lease_seconds() if lease is None else lease
+    cutoff = int(time.time()) - lease
+    rows = session.query(CoinCycleClaim.coin_id, CoinCycleClaim.heartbeat_at).filter(
+        CoinCycleClaim.cycle_start == cycle_start,
+        CoinCycleClaim.coin_id.in_(coin_ids),
+        CoinCycleClaim.finished_at.is_(None),
+    ).all()
+    expired = [coin_id for coin_id, heartbeat_at in rows if heartbeat_at < cutoff]
+    return expired, len(rows) - len(expired)
+
+
+def prune_claims(session: Session, before_cycle: int):
+    """Drop the claims of cycles older than `before_cycle`."""
+    deleted = session.query(CoinCycleClaim).filter(
+        CoinCycleClaim.cycle_start < before_cycle
+    ).delete(synchronize_session=False)
+    session.commit()
+    return deleted
+
+
+class LeaseHeartbeat:
+    """Background thread renewing a worker's unfinished leases every third of the lease time."""
+
+    def __init__(self, session_factory, cycle_start: int, worker: str, lease: int = None):
+        self.session_factory = session_factory
+        self.cycle_start = cycle_start
+        self.worker = worker
+        self.interval = max(1, (lease_seconds() if lease is None else lease) // 3)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            session = self.session_factory()
+            try:
+                renew_leases(session, self.cycle_start, self.worker)
+            except Exception as e:
+                print(f"Error renewing leases for {self.worker}: {e}")
+                session.rollback()
+            finally:
+                session.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
@@ -1,19 +1,75 @@
-﻿import psycopg2
+﻿import os
+import threading
+import psycopg2
+from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
 
+# Load environment variables from .env file
+ENVIROMENT = os.getenv('ENVIRONMENT', 'development')
+if ENVIROMENT == 'development':
+    load_dotenv('.env.development', encoding="utf-8-sig")
+elif ENVIROMENT == 'production':
+    load_dotenv('.env.production', encoding="utf-8-sig")
+else:
+    load_dotenv(encoding="utf-8-sig")  # Default to a standard .env file
+
 # Connection settings
-DB_NAME = "crypto_tracker_db"
-DB_USER = "postgres"
-DB_PASS = "123"
-DB_HOST = "localhost"
-DB_PORT = "5432"
+DB_NAME = os.getenv("DB_NAME", "crypto_tracker_db")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASS = os.getenv("DB_PASS", "")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+# Pool settings; size it for INGEST_MAX_WORKERS x BACKFILL_WINDOW_WORKERS concurrent sessions
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+
+_engine = None
+_session_factory = None
+_engine_lock = threading.Lock()
+
+
+def connection_url():
+    return os.getenv("DATABASE_URL") or f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
 
 # SQLAlchemy engine for TimescaleDB
 def get_engine():
-    connection_url = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    engine = create_engine(connection_url, echo=False)
-    return engine
+    """The process-wide engine and connection pool, created on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    connection_url(),
+                    echo=False,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=DB_POOL_PRE_PING,
+                )
+    return _engine
+
+
+def get_session_factory():
+    global _session_factory
+    if _session_factory is None:
+        engine = get_engine()
+        with _engine_lock:
+            if _session_factory is None:
+                _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return _session_factory
+
+
+def SessionLocal():
+    """New session on the shared engine; drop-in for the old per-module sessionmaker."""
+    return get_session_factory()()
 
 
 # Raw psycopg2 connection for direct queries
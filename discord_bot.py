@@ -1,21 +1,28 @@
 ﻿from Scripts.sendDiscordMessage import send_message
-from db import get_engine
+from db import get_engine, SessionLocal
 import requests
 import discord
 from discord import app_commands
 from discord.ext import commands
-import csv
 from datetime import datetime, timezone, timedelta
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
 import time
 from Models.coins import Coin, CoinHistoric
 import asyncio
 from dotenv import load_dotenv
 import os
+import io
 from Scripts.get_historic_coin_data import main as get_coin_historic
-from Scripts.add_coin import add_coin
+from Scripts.add_coin import add_coin, add_coins, parse_symbols
 from contextlib import contextmanager
-from dateutil.relativedelta import relativedelta
+from Scripts.report import period_bounds
+from Scripts.report_export import export_report, INDICATOR_COLUMNS, AVAILABLE_FORMATS
+from Scripts import metrics
+from Scripts.price_cache import get_price_cache
+from Scripts.gaps import coverage_report, format_coverage
+from Scripts.indicators import latest_indicators, COLUMNS as INDICATORS, PERIODS
+from Scripts.alerts import add_rule, list_rules, remove_rule, describe_rule, validate_rule
+from Scripts.async_jobs import run_blocking, run_backfill, start_background_job, threadsafe_notifier, loop_lag_monitor
 
 # Load environment variables from .env file
 ENVIROMENT = os.getenv('ENVIRONMENT', 'development')
@@ -32,8 +39,8 @@ API_KEY = os.getenv("API_KEY")
 API_COIN_INFO_BASE_URL = os.getenv("API_COIN_INFO_BASE_URL")
 DISCORD_OWNER_ID= int(os.getenv("DISCORD_OWNER_ID"))
 DISCORD_SERVER_ID= int(os.getenv("DISCORD_SERVER_ID"))
-engine = get_engine()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Seconds between edits of the bulk onboarding progress message
+BULK_PROGRESS_INTERVAL = 5
 # Set up the bot
 intents = discord.Intents.default()
 bot = commands.Bot(command_prefix="!", intents=intents)
@@ -47,133 +54,208 @@ def session_scope():
     finally:
         session.close()
 
-def get_month_start_dates(start_date, end_date):
-    current_date = start_date.replace(day=1)
-    month_start_dates = []
-    
-    while current_date <= end_date:
-        month_start_dates.append(current_date)
-        current_date += relativedelta(months=1)
-    
-    return month_start_dates
+def validate_coin(coin,session: Session):
+    coin = session.query(Coin).filter(Coin.symbol== coin).first()
+    return coin
 
-def get_first_open_and_last_close(session, coin_id, month_start_date):
-    # Get the first day of the month
-    first_day = month_start_date
-    # Get the last day of the month
-    last_day = month_start_date + relativedelta(months=1) - relativedelta(days=1)
-    
-    # Convert to Unix timestamps
-    start_timestamp = int(first_day.timestamp())
-    end_timestamp = int(last_day.timestamp())
-
-    # Get first record (open of the month)
-    first_record = session.query(CoinHistoric).filter(
-        CoinHistoric.coin_id == coin_id,
-        CoinHistoric.timestamp >= start_timestamp,
-        CoinHistoric.timestamp < start_timestamp + 86400  # Start of the next day (midnight)
-    ).order_by(CoinHistoric.timestamp.asc()).first()
-
-    # Get last record (close of the month)
-    last_record = session.query(CoinHistoric).filter(
-        CoinHistoric.coin_id == coin_id,
-        CoinHistoric.timestamp >= start_timestamp,
-        CoinHistoric.timestamp <= end_timestamp,  # End of the last day of the month
-        CoinHistoric.close > 0,
-        CoinHistoric.open > 0
-    ).order_by(CoinHistoric.timestamp.desc()).first()
-
-    return first_record, last_record
-
-def create_csv_with_open_close(session, coin_id, start_date_obj, end_date_obj, csv_filename):
-    # Get all the start dates of each month
-    month_start_dates = get_month_start_dates(start_date_obj, end_date_obj)
-
-    # Create CSV file
-    with open(csv_filename, mode='w', newline='') as csv_file:
-        fieldnames = ['Month','Year', 'Open', 'Close', 'Percentage Change']
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-
-        # Write the header
-        writer.writeheader()
-
-        # Loop through each month and get the data
-        for month_start_date in month_start_dates:
-            first_record, last_record = get_first_open_and_last_close(
-                session, coin_id, month_start_date
-            )
+def find_coin(symbol):
+    """Blocking lookup returning a detached Coin (or None), safe to hand back to the event loop."""
+    with session_scope() as session:
+        coin = validate_coin(symbol, session)
+        if coin is not None:
+            session.expunge(coin)
+        return coin
+
+def build_report_export(coin_id, start_date_obj, end_date_obj, interval, fmt, basename, indicators=False):
+    """Build the report in memory; returns (buffer, filename) for discord.File."""
+    start_ts, end_ts = period_bounds(start_date_obj, end_date_obj)
+    with session_scope() as session:
+        return export_report(session, coin_id, start_ts, end_ts, interval, fmt, basename=basename, indicators=indicators)
 
-            # Ensure that both records are found
-            if first_record and last_record:
-                open_value = first_record.open
-                close_value = last_record.close
+def indicator_summary(symbol, interval):
+    """Latest indicator values of the coin as (timestamp, {column: value}), or None if the coin is unknown."""
+    with session_scope() as session:
+        coin = validate_coin(symbol, session)
+        if coin is None:
+            return None
+        rows = latest_indicators(session, coin.id, PERIODS[interval])
+        if not rows:
+            return (None, {})
+        return rows[0].timestamp, {column: getattr(rows[0], column) for column in INDICATORS}
+
+# Recent ranges answered from the in-memory price cache: (candle kind, seconds back)
+RECENT_SPANS = {"day": ("hourly", 86400), "week": ("hourly", 7 * 86400), "month": ("daily", 30 * 86400)}
+
+def recent_summary(symbol, span):
+    """OHLC summary of the coin's last day/week/month, or None if the coin is unknown."""
+    price_cache = get_price_cache()
+    coin_id = price_cache.coin_id(symbol)
+    if coin_id is None:
+        coin = find_coin(symbol)
+        if coin is None:
+            return None
+        coin_id = coin.id
+        price_cache.remember_coin(symbol, coin_id)
+    kind, seconds = RECENT_SPANS[span]
+    now = int(time.time())
+    candles = price_cache.recent(SessionLocal, coin_id, kind, now - seconds, now + 1)
+    if not len(candles):
+        return {"candles": 0}
+    return {
+        "candles": len(candles),
+        "open": float(candles.open[0]),
+        "close": float(candles.close[-1]),
+        "high": float(candles.high.max()),
+        "low": float(candles.low.min()),
+        "change": float((candles.close[-1] - candles.open[0]) / candles.open[0] * 100) if candles.open[0] else 0.0,
+    }
+
+def build_coverage_report(symbol=None):
+    """Coverage table text for one coin or all coins, or None if the coin is unknown."""
+    with session_scope() as session:
+        coin_ids = None
+        if symbol:
+            coin = validate_coin(symbol, session)
+            if coin is None:
+                return None
+            coin_ids = [coin.id]
+        return format_coverage(coverage_report(session, coin_ids))
+
+def create_alert(symbol, kind, value, window, direction, user_id):
+    """Store a new alert rule; returns (rule id, None) or (None, error text)."""
+    error = validate_rule(kind, value, window, direction)
+    if error:
+        return None, error
+    with session_scope() as session:
+        coin = validate_coin(symbol, session)
+        if coin is None:
+            return None, f"The coin `{symbol}` is not in the database."
+        return add_rule(session, coin.id, kind, value, window, direction, user_id), None
 
-                # Calculate the percentage change
-                percentage_change = ((close_value - open_value) / open_value) * 100
+def describe_alerts(user_id, symbol=None):
+    """One line per enabled rule of the user, or None if the coin is unknown."""
+    with session_scope() as session:
+        coin_id = None
+        if symbol:
+            coin = validate_coin(symbol, session)
+            if coin is None:
+                return None
+            coin_id = coin.id
+        return [describe_rule(rule, coin_symbol) for rule, coin_symbol in list_rules(session, user_id, coin_id)]
+
+def delete_alert(rule_id, user_id):
+    with session_scope() as session:
+        return remove_rule(session, rule_id, None if user_id == DISCORD_OWNER_ID else user_id)
 
-                # Write row to CSV
-                writer.writerow({
-                    'Month': month_start_date.strftime('%B'),
-                    'Year': month_start_date.strftime('%Y'),
-                    'Open': open_value,
-                    'Close': close_value,
-                    "Percentage Change": f"{percentage_change:.2f}%",
-                })
+async def backfill_coin(interaction: discord.Interaction, coin: Coin):
+    """Background job: run the historic backfill and report progress as followups."""
+    notify = threadsafe_notifier(asyncio.get_running_loop(), interaction.followup.send)
 
-def validate_coin(coin,session: Session):
-    coin = session.query(Coin).filter(Coin.symbol== coin).first()
-    return coin
+    def progress(days_done, days_total):
+        notify(f"`{coin.symbol}` backfill: {days_done}/{days_total} days fetched.")
+
+    try:
+        await run_backfill(get_coin_historic, coin, False, progress)
+        await interaction.followup.send(f"`{coin.symbol}` historic backfill finished.")
+    except Exception as e:
+        await interaction.followup.send(f"`{coin.symbol}` historic backfill failed: {e}")
+        raise
+
+async def onboard_coin(interaction: discord.Interaction, symbol: str, webhook: str):
+    """Add the coin without blocking the loop and queue its backfill as a background job."""
+    new_coin = await run_blocking(add_coin, symbol, webhook, backfill=False)
+    if new_coin is None:
+        return None
+    start_background_job(f"backfill-{symbol}", backfill_coin(interaction, new_coin))
+    return new_coin
+
+
+async def bulk_backfill(interaction: discord.Interaction, coins):
+    """
+    Background job: backfill many coins on the backfill executor and keep one
+    followup message updated with the progress as they complete.
+    """
+    status = await interaction.followup.send(f"Backfilling {len(coins)} coins: 0/{len(coins)} done.", wait=True)
+    tasks = {asyncio.ensure_future(run_backfill(get_coin_historic, coin, False)): coin for coin in coins}
+    done, failed = 0, []
+    last_edit = time.monotonic()
+    for finished in asyncio.as_completed(tasks):
+        try:
+            await finished
+        except Exception as e:
+            failed.append(str(e))
+        done += 1
+        # Discord rate limits message edits, so update at most every few seconds
+        if done == len(coins) or time.monotonic() - last_edit >= BULK_PROGRESS_INTERVAL:
+            last_edit = time.monotonic()
+            try:
+                await status.edit(content=f"Backfilling {len(coins)} coins: {done}/{len(coins)} done, {len(failed)} failed.")
+            except discord.HTTPException as e:
+                print(f"Could not update bulk backfill progress: {e}")
+    result = f"Bulk backfill finished: {len(coins) - len(failed)} ok, {len(failed)} failed."
+    try:
+        await interaction.followup.send(result)
+    except discord.HTTPException:
+        # Interaction tokens expire after 15 minutes, long backfills report in the channel instead
+        await interaction.channel.send(result)
 
 
 # Sync and register the slash command
 
 
 # Define the slash command
-# Define a slash command with interval choices
-@bot.tree.command(name="report", description="Sends a monthly report with open and close coin values.")
-@app_commands.describe(coin="The coin to report (e.g., BTC, ETH)", start_date="Start date (mm/yyyy)", end_date="End date (mm/yyyy)", interval="Choose an interval")
+# Define a slash command with interval choices; Parquet is only offered when pyarrow is installed
+FORMAT_NAMES = {"csv": "CSV", "parquet": "Parquet"}
+
+
+@bot.tree.command(name="report", description="Sends a daily, monthly or yearly report with open and close coin values.")
+@app_commands.describe(coin="The coin to report (e.g., BTC, ETH)", start_date="Start date (mm/yyyy)", end_date="End date (mm/yyyy)", interval="Choose an interval", format="File format (CSV by default)", indicators="Add SMA/EMA/RSI/volatility columns (daily reports only)")
 @app_commands.choices(interval=[
     app_commands.Choice(name="Daily", value="daily"),
     app_commands.Choice(name="Monthly", value="monthly"),
     app_commands.Choice(name="Yearly", value="yearly")
+], format=[
+    app_commands.Choice(name=FORMAT_NAMES[fmt], value=fmt) for fmt in AVAILABLE_FORMATS
 ])
-async def report(interaction: discord.Interaction, coin: str, start_date: str, end_date: str, interval: app_commands.Choice[str]):
+async def report(interaction: discord.Interaction, coin: str, start_date: str, end_date: str, interval: app_commands.Choice[str], format: app_commands.Choice[str] = None, indicators: bool = False):
     """Sends a report with open and close coin values for the specified date range."""
     print("report command registered")  # Debugging line
     
     await interaction.response.defer(thinking=True)  # Defer the response
+    with metrics.timer("bot_command_seconds", command="report"):
+        await send_report(interaction, coin, start_date, end_date, interval, format, indicators)
 
-    with session_scope() as session:
-        coin_obj = validate_coin(coin.upper(), session)
-        if not coin_obj:
-            await interaction.followup.send(f"The coin `{coin}` is not in the database. Would you like to add it? (Respond with 'yes' or 'no')")
-            
-            def check(msg):
-                return msg.author == interaction.user and msg.channel == interaction.channel and msg.content.lower() in ['yes', 'no']
-            try:
-                msg = await bot.wait_for('message', check=check, timeout=30.0)
-                if msg.content.lower() == 'yes':
-                    await interaction.followup.send(f"Please provide the webhook URL for {coin}:")
-                    # Check for the webhook URL
-                    def webhook_check(msg):
-                        return msg.author == interaction.user and msg.channel == interaction.channel
-
-                    webhook_msg = await bot.wait_for('message', check=webhook_check, timeout=30.0)
-                    webhook_url = webhook_msg.content
-                    
-                    # Add the coin with the provided webhook
-                    add_coin(coin.upper(), webhook_url)  # Pass session here if needed
-                    existing_coin = validate_coin(coin.upper(),session)
-                    if existing_coin:
-                        await interaction.followup.send(f"{coin.upper()} was added successfully!")
-                    else:
-                        await interaction.followup.send(f"{coin} was not added.")
+
+async def send_report(interaction: discord.Interaction, coin: str, start_date: str, end_date: str, interval: app_commands.Choice[str], format: app_commands.Choice[str] = None, indicators: bool = False):
+
+    coin_obj = await run_blocking(find_coin, coin.upper())
+    if not coin_obj:
+        await interaction.followup.send(f"The coin `{coin}` is not in the database. Would you like to add it? (Respond with 'yes' or 'no')")
+        
+        def check(msg):
+            return msg.author == interaction.user and msg.channel == interaction.channel and msg.content.lower() in ['yes', 'no']
+        try:
+            msg = await bot.wait_for('message', check=check, timeout=30.0)
+            if msg.content.lower() == 'yes':
+                await interaction.followup.send(f"Please provide the webhook URL for {coin}:")
+                # Check for the webhook URL
+                def webhook_check(msg):
+                    return msg.author == interaction.user and msg.channel == interaction.channel
+
+                webhook_msg = await bot.wait_for('message', check=webhook_check, timeout=30.0)
+                webhook_url = webhook_msg.content
+                
+                # Add the coin with the provided webhook, the backfill continues in the background
+                if await onboard_coin(interaction, coin.upper(), webhook_url):
+                    await interaction.followup.send(f"{coin.upper()} was added successfully! Its history is being backfilled.")
                 else:
                     await interaction.followup.send(f"{coin} was not added.")
-                return  # Ensure no further responses happen
-            except asyncio.TimeoutError:
-                await interaction.followup.send("You took too long to respond!")
-                return  # Ensure no further responses happen
+            else:
+                await interaction.followup.send(f"{coin} was not added.")
+            return  # Ensure no further responses happen
+        except asyncio.TimeoutError:
+            await interaction.followup.send("You took too long to respond!")
+            return  # Ensure no further responses happen
 
     # Convert the date strings to datetime objects
     try:
@@ -182,11 +264,13 @@ async def report(interaction: discord.Interaction, coin: str, start_date: str, e
     except ValueError:
         await interaction.followup.send("Invalid date format! Please use MM/YYYY.")
         return  # Ensure no further responses happen
-    with session_scope() as session:
-        existing_coin = validate_coin(coin.upper(),session)
-        coin_id = existing_coin.id
-    csv_filename = f'{coin.upper()}_{int(start_date_obj.timestamp())}_{int(end_date_obj.timestamp())}_monthly_open_close.csv'
-    create_csv_with_open_close(session, coin_id, start_date_obj, end_date_obj, csv_filename)
+    basename = f'{coin.upper()}_{int(start_date_obj.timestamp())}_{int(end_date_obj.timestamp())}_{interval.value}_open_close'
+    fmt = format.value if format else "csv"
+    try:
+        buffer, filename = await run_blocking(build_report_export, coin_obj.id, start_date_obj, end_date_obj, interval.value, fmt, basename, indicators)
+    except (RuntimeError, ValueError) as e:
+        await interaction.followup.send(str(e))
+        return
     # Create the embed message
     embed = discord.Embed(
         title=f"📈 {interval.name} Coin Report for {coin.upper()}",
@@ -198,8 +282,7 @@ async def report(interaction: discord.Interaction, coin: str, start_date: str, e
     embed.set_footer(text="Data provided by Crypto Bot")
 
     await interaction.followup.send(embed=embed)  # Use followup here
-    await interaction.followup.send(file=discord.File(csv_filename))  # Send CSV file as a followup
-    os.remove(csv_filename)
+    await interaction.followup.send(file=discord.File(buffer, filename=filename))  # Send the report file as a followup
 
 
 @bot.tree.command(name="add_crypto", description="Add a new cryptocurrency to the database.")
@@ -207,19 +290,185 @@ async def report(interaction: discord.Interaction, coin: str, start_date: str, e
 async def add_crypto(interaction: discord.Interaction, symbol: str, webhook: str):
     print("add_crypto command registered")  # Check if this prints when you start the bot
     await interaction.response.defer(thinking=True)
+    with metrics.timer("bot_command_seconds", command="add_crypto"):
+        await add_crypto_command(interaction, symbol, webhook)
 
-    with session_scope() as session:
-        existing_coin = validate_coin(symbol.upper(), session)
-        if existing_coin:
-            await interaction.followup.send(f"The cryptocurrency `{symbol.upper()}` is already in the database.")
+
+async def add_crypto_command(interaction: discord.Interaction, symbol: str, webhook: str):
+
+    existing_coin = await run_blocking(find_coin, symbol.upper())
+    if existing_coin:
+        await interaction.followup.send(f"The cryptocurrency `{symbol.upper()}` is already in the database.")
+        return
+
+    if await onboard_coin(interaction, symbol.upper(), webhook):
+        await interaction.followup.send(f"The cryptocurrency `{symbol.upper()}` has been added successfully. Its history is being backfilled in the background.")
+    else:
+        await interaction.followup.send(f"The cryptocurrency `{symbol.upper()}` does not exist.")
+
+
+@bot.tree.command(name="recent", description="Open, close, high and low of a coin over the last day, week or month.")
+@app_commands.describe(coin="The coin (e.g., BTC, ETH)", span="How far back to look")
+@app_commands.choices(span=[
+    app_commands.Choice(name="Last day", value="day"),
+    app_commands.Choice(name="Last week", value="week"),
+    app_commands.Choice(name="Last month", value="month")
+])
+async def recent(interaction: discord.Interaction, coin: str, span: app_commands.Choice[str]):
+    await interaction.response.defer(thinking=True)
+    with metrics.timer("bot_command_seconds", command="recent"):
+        summary = await run_blocking(recent_summary, coin.upper(), span.value)
+        if summary is None:
+            await interaction.followup.send(f"The coin `{coin.upper()}` is not in the database.")
+        elif not summary["candles"]:
+            await interaction.followup.send(f"No {span.name.lower()} data stored for `{coin.upper()}` yet.")
+        else:
+            await interaction.followup.send(
+                f"`{coin.upper()}` {span.name.lower()}: Open {summary['open']}, Close {summary['close']}, "
+                f"High {summary['high']}, Low {summary['low']} ({summary['change']:+.2f}%)"
+            )
+
+
+@bot.tree.command(name="indicators", description="Latest moving averages, RSI and volatility of a coin.")
+@app_commands.describe(coin="The coin (e.g., BTC, ETH)", interval="Daily or hourly candles (daily by default)")
+@app_commands.choices(interval=[
+    app_commands.Choice(name="Daily", value="daily"),
+    app_commands.Choice(name="Hourly", value="hourly")
+])
+async def indicators(interaction: discord.Interaction, coin: str, interval: app_commands.Choice[str] = None):
+    await interaction.response.defer(thinking=True)
+    with metrics.timer("bot_command_seconds", command="indicators"):
+        interval_value = interval.value if interval else "daily"
+        summary = await run_blocking(indicator_summary, coin.upper(), interval_value)
+        if summary is None:
+            await interaction.followup.send(f"The coin `{coin.upper()}` is not in the database.")
             return
-        
-        add_coin(symbol.upper(), webhook)  # Ensure this function handles adding to the session
-        existing_coin = validate_coin(symbol.upper(), session)
-        if existing_coin:
-            await interaction.followup.send(f"The cryptocurrency `{symbol.upper()}` has been added successfully.")
+        timestamp, values = summary
+        if timestamp is None:
+            await interaction.followup.send(f"No {interval_value} indicators stored for `{coin.upper()}` yet.")
+            return
+        when = datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+        parts = [
+            f"{label}: {'n/a' if values[column] is None else f'{values[column]:.6g}'}"
+            for label, column in zip(INDICATOR_COLUMNS, INDICATORS)
+        ]
+        await interaction.followup.send(f"`{coin.upper()}` {interval_value} indicators after the {when} candle: " + ", ".join(parts))
+
+
+@bot.tree.command(name="gaps", description="Admin: stored coverage and missing days/hours per coin.")
+@app_commands.describe(coin="Only this coin (all coins if empty)")
+async def gaps(interaction: discord.Interaction, coin: str = None):
+    if interaction.user.id != DISCORD_OWNER_ID:
+        await interaction.response.send_message("You are not the owner.", ephemeral=True)
+        return
+    await interaction.response.defer(thinking=True)
+    with metrics.timer("bot_command_seconds", command="gaps"):
+        table = await run_blocking(build_coverage_report, coin.upper() if coin else None)
+        if table is None:
+            await interaction.followup.send(f"The coin `{coin.upper()}` is not in the database.")
+        elif len(table) < 1900:
+            await interaction.followup.send(f"```\n{table}\n```")
+        else:
+            await interaction.followup.send(
+                "Coverage per coin:", file=discord.File(io.BytesIO(table.encode("utf-8")), filename="coverage.txt")
+            )
+
+
+@bot.command()
+async def price_cache(ctx: commands.Context):
+    if ctx.author.id == DISCORD_OWNER_ID:
+        stats = get_price_cache().stats()
+        await ctx.reply(
+            f"Price cache: {stats['coins']} coins, {stats['bytes'] / 1024:.0f}/{stats['max_bytes'] / 1024:.0f} KiB, "
+            f"hit rate {stats['hit_rate']:.1%} ({stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['refreshes']} refreshes, {stats['evictions']} evictions)"
+        )
+    else:
+        await ctx.reply("You are not the owner.")
+
+
+@bot.tree.command(name="add_cryptos", description="Add many cryptocurrencies at once from a list or a text file.")
+@app_commands.describe(webhook="Webhook URL for notifications", symbols="Symbols separated by commas or spaces", file="Text file with one or more symbols per line")
+async def add_cryptos(interaction: discord.Interaction, webhook: str, symbols: str = None, file: discord.Attachment = None):
+    await interaction.response.defer(thinking=True)
+    with metrics.timer("bot_command_seconds", command="add_cryptos"):
+        text = symbols or ""
+        if file is not None:
+            text += "\n" + (await file.read()).decode("utf-8-sig", errors="replace")
+        symbol_list = parse_symbols(text)
+        if not symbol_list:
+            await interaction.followup.send("Give a list of symbols or attach a file with them.")
+            return
+        added, skipped = await run_blocking(add_coins, symbol_list, webhook)
+        summary = f"Added {len(added)} of {len(symbol_list)} coins."
+        if skipped:
+            reasons = ", ".join(f"{symbol} ({reason})" for symbol, reason in sorted(skipped.items()))
+            summary += f" Skipped: {reasons}"
+        await interaction.followup.send(summary[:1990])
+        if added:
+            start_background_job(f"bulk-backfill-{interaction.id}", bulk_backfill(interaction, added))
+
+
+@bot.tree.command(name="alert", description="Get pinged in the coin's channel when its price moves.")
+@app_commands.describe(
+    coin="The coin (e.g., BTC, ETH)",
+    kind="What to watch for",
+    value="Percent for a move, price for a level, number of days for a new high/low",
+    direction="Which way (either by default)",
+    window="Hours a move is measured over (24 by default)",
+)
+@app_commands.choices(kind=[
+    app_commands.Choice(name="Move %", value="move"),
+    app_commands.Choice(name="Price level", value="level"),
+    app_commands.Choice(name="New N-day high/low", value="extreme")
+], direction=[
+    app_commands.Choice(name="Up / above / high", value="up"),
+    app_commands.Choice(name="Down / below / low", value="down"),
+    app_commands.Choice(name="Either", value="any")
+])
+async def alert(interaction: discord.Interaction, coin: str, kind: app_commands.Choice[str], value: float, direction: app_commands.Choice[str] = None, window: int = 24):
+    await interaction.response.defer(thinking=True)
+    with metrics.timer("bot_command_seconds", command="alert"):
+        rule_id, error = await run_blocking(
+            create_alert, coin.upper(), kind.value, value, window, direction.value if direction else "any", interaction.user.id
+        )
+        if error:
+            await interaction.followup.send(error)
+        else:
+            await interaction.followup.send(f"Alert #{rule_id} added for `{coin.upper()}`; it is checked every hour.")
+
+
+@bot.tree.command(name="alerts", description="List your price alerts.")
+@app_commands.describe(coin="Only this coin (all coins if empty)")
+async def alerts(interaction: discord.Interaction, coin: str = None):
+    await interaction.response.defer(thinking=True)
+    with metrics.timer("bot_command_seconds", command="alerts"):
+        lines = await run_blocking(describe_alerts, interaction.user.id, coin.upper() if coin else None)
+        if lines is None:
+            await interaction.followup.send(f"The coin `{coin.upper()}` is not in the database.")
+        elif not lines:
+            await interaction.followup.send("You have no alerts.")
         else:
-            await interaction.followup.send(f"The cryptocurrency `{symbol.upper()}` does not exist.")
+            await interaction.followup.send("\n".join(lines)[:1990])
+
+
+@bot.tree.command(name="alert_remove", description="Remove one of your price alerts.")
+@app_commands.describe(alert_id="The alert number shown by /alerts")
+async def alert_remove(interaction: discord.Interaction, alert_id: int):
+    await interaction.response.defer(thinking=True)
+    with metrics.timer("bot_command_seconds", command="alert_remove"):
+        if await run_blocking(delete_alert, alert_id, interaction.user.id):
+            await interaction.followup.send(f"Alert #{alert_id} removed.")
+        else:
+            await interaction.followup.send(f"You have no alert #{alert_id}.")
+
+
+@bot.command()
+async def loop_lag(ctx: commands.Context):
+    if ctx.author.id == DISCORD_OWNER_ID:
+        await ctx.reply(loop_lag_monitor.summary())
+    else:
+        await ctx.reply("You are not the owner.")
 
 
 @bot.command()
@@ -249,6 +498,9 @@ async def delete_commands(ctx: commands.Context):
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user}")
+    loop_lag_monitor.start()
+    metrics.start_from_env()
+    metrics.instrument_engine(get_engine())
     commands = [cmd.name for cmd in bot.tree.get_commands()]
     print(f"Available commands: {commands}")
 
@@ -1,25 +1,177 @@
-﻿from db import get_connection, get_engine
+﻿from db import get_engine, SessionLocal
 import logging
 import time
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_ERROR
 from sqlalchemy.orm import sessionmaker, Session
 from datetime import datetime, timezone, timedelta
-from Models.coins import Coin, CoinHistoric
-from sqlalchemy import Table, Column, Integer, String, MetaData, Float, TIMESTAMP, desc
-from Scripts.get_historic_coin_data import main as get_coin_historic
+from Models.coins import Coin, CoinHistoric, CoinHourly
+from sqlalchemy import Table, Column, Integer, String, MetaData, Float, TIMESTAMP, desc, func, text
+from Scripts.get_historic_coin_data import main as get_coin_historic, get_response_cache, UNKNOWN
+from Scripts.webhook_dispatcher import get_dispatcher
+from Scripts import metrics
+from Scripts.gaps import repair_coin, repair_all_gaps
+from Scripts.stream_ingest import start_stream_ingest
+from Scripts.alerts import get_alert_engine, sync_alert_rules, persist_alert_triggers
+from Scripts.worker_leases import (
+    worker_id, lease_seconds, claim_coins, finish_coin, unfinished_claims, prune_claims, LeaseHeartbeat,
+)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import zlib
 import pytz
 import logging
 
 
 logging.basicConfig(level=logging.INFO)
-engine = get_engine()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 LocalTz = pytz.timezone('Europe/London')
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "8"))
+WEBHOOK_FLUSH_TIMEOUT = 300
+# Several scheduler processes split the coins through per-cycle leases
+SCHEDULER_SHARDED = os.getenv("SCHEDULER_SHARDED", "0").lower() in ("1", "true", "yes")
+# Claims older than this are pruned at the start of a sharded cycle
+CLAIM_RETENTION_SECONDS = 24 * 3600
+# Advisory lock key that lets only one sharded worker run the daily gap repair
+GAP_REPAIR_LOCK_KEY = 7_240_021
+# Also aggregate live prices into minute/hour candles from this process
+STREAM_INGEST = os.getenv("STREAM_INGEST", "0").lower() in ("1", "true", "yes")
 
 """ logging.basicConfig(level=logging.INFO) """
 
 
-def process_all_cryptos():
+def process_coin(coin: Coin, mode: str, last_hour_ts=UNKNOWN):
+    """
+    Ingest a single coin and return how long it took in seconds. `mode` is
+    "historic" (full backfill), "hourly", or "repair" (fill the detected gaps,
+    then run the hourly update).
+    """
+    started = time.perf_counter()
+    try:
+        if mode == "repair":
+            repair_coin(coin)
+            last_hour_ts = UNKNOWN
+        get_coin_historic(coin, mode != "historic", last_hour_ts=last_hour_ts)
+    except Exception as e:
+        logging.exception(f"Coin: {coin.symbol} failed: {e}")
+    elapsed = time.perf_counter() - started
+    metrics.observe("coin_job_seconds", elapsed, mode=mode)
+    logging.info(f"Coin: {coin.symbol}, mode: {mode}, took {elapsed:.2f}s")
+    return elapsed
+
+
+def plan_cycle(session, PreviousDateUnix: int):
+    """
+    Decide what every coin needs this cycle from one grouped query over coins,
+    their latest daily candle and their latest hourly candle.
+
+    Coins that were never backfilled are backfilled in full; backfilled coins
+    that fell behind only get their gaps repaired.
+
+    Returns {"backfill": [...], "repair": [...], "hourly": [...], "idle": [...]},
+    each a list of (coin, last_hour_ts) with the coins detached and ready to
+    hand to workers.
+    """
+    last_daily = (
+        session.query(CoinHistoric.coin_id, func.max(CoinHistoric.timestamp).label("last_ts"))
+        .group_by(CoinHistoric.coin_id)
+        .subquery()
+    )
+    last_hourly = (
+        session.query(CoinHourly.coin_id, func.max(CoinHourly.timestamp).label("last_ts"))
+        .group_by(CoinHourly.coin_id)
+        .subquery()
+    )
+    rows = (
+        session.query(Coin, last_daily.c.last_ts, last_hourly.c.last_ts)
+        .outerjoin(last_daily, last_daily.c.coin_id == Coin.id)
+        .outerjoin(last_hourly, last_hourly.c.coin_id == Coin.id)
+        .all()
+    )
+    # Start of the last closed hour; hourly coins that already have it are up to date
+    last_closed_hour = int(datetime.now(pytz.utc).replace(minute=0, second=0, microsecond=0).timestamp()) - 3600
+    plan = {"backfill": [], "repair": [], "hourly": [], "idle": []}
+    for coin, last_daily_ts, last_hour_ts in rows:
+        session.expunge(coin)
+        if last_daily_ts is None or coin.history_check == False:
+            plan["backfill"].append((coin, last_hour_ts))
+        elif last_daily_ts < PreviousDateUnix:
+            plan["repair"].append((coin, last_hour_ts))
+        elif last_hour_ts is not None and last_hour_ts >= last_closed_hour:
+            plan["idle"].append((coin, last_hour_ts))
+        else:
+            plan["hourly"].append((coin, last_hour_ts))
+    return plan
+
+
+def run_jobs(jobs, max_workers: int, timings: dict, on_done=None):
+    """Run (coin, mode, last_hour_ts) jobs, recording per-coin seconds in `timings`."""
+    # Every worker opens its own session; API calls share the rate limiter
+    if max_workers <= 1:
+        for coin, mode, last_hour_ts in jobs:
+            timings[coin.symbol] = process_coin(coin, mode, last_hour_ts)
+            if on_done is not None:
+                on_done(coin)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest") as executor:
+            futures = {
+                executor.submit(process_coin, coin, mode, last_hour_ts): coin
+                for coin, mode, last_hour_ts in jobs
+            }
+            for future in as_completed(futures):
+                timings[futures[future].symbol] = future.result()
+                if on_done is not None:
+                    on_done(futures[future])
+
+
+def run_sharded_jobs(jobs, max_workers: int, timings: dict, cycle_start: int):
+    """
+    Run only the jobs this worker wins a lease for. Coins are claimed a few at a
+    time, so a fast worker keeps taking coins a slow one has not reached. Once
+    its own pass is done the worker takes over the coins of crashed workers,
+    until every planned coin is finished or the cycle runs out.
+    """
+    worker = worker_id()
+    by_id = {coin.id: (coin, mode, last_hour_ts) for coin, mode, last_hour_ts in jobs}
+    if jobs:
+        # Start at a worker-specific offset so concurrent workers mostly claim different coins
+        offset = zlib.crc32(worker.encode("utf-8")) % len(jobs)
+        jobs = jobs[offset:] + jobs[:offset]
+    chunk = max(2 * max_workers, 1)
+    session = SessionLocal()
+    try:
+        prune_claims(session, cycle_start - CLAIM_RETENTION_SECONDS)
+
+        def done(coin):
+            finish_coin(session, cycle_start, coin.id, worker)
+
+        with LeaseHeartbeat(SessionLocal, cycle_start, worker):
+            for start in range(0, len(jobs), chunk):
+                batch = jobs[start:start + chunk]
+                claimed = claim_coins(session, cycle_start, [coin.id for coin, mode, last_hour_ts in batch], worker)
+                run_jobs([job for job in batch if job[0].id in claimed], max_workers, timings, done)
+
+            deadline = cycle_start + 3600 - lease_seconds()
+            while by_id and time.time() < deadline:
+                expired, running = unfinished_claims(session, cycle_start, list(by_id))
+                if expired:
+                    claimed = claim_coins(session, cycle_start, expired, worker)
+                    if claimed:
+                        logging.warning(f"Worker {worker} taking over {len(claimed)} coins with expired leases")
+                        run_jobs([by_id[coin_id] for coin_id in claimed], max_workers, timings, done)
+                elif not running:
+                    break
+                else:
+                    time.sleep(max(1, lease_seconds() // 3))
+    finally:
+        session.close()
+    logging.info(f"Worker {worker} ingested {len(timings)} of {len(by_id)} planned coins")
+
+
+def process_all_cryptos(max_workers: int = None, sharded: bool = None):
+    if max_workers is None:
+        max_workers = INGEST_MAX_WORKERS
+    if sharded is None:
+        sharded = SCHEDULER_SHARDED
     session = SessionLocal()
     now_utc = datetime.now(pytz.utc)
     now_local = now_utc.astimezone(LocalTz)
@@ -27,27 +179,88 @@ def process_all_cryptos():
     PreviousDate = CurrentStartDate- timedelta(days=1)
     PreviousDateUnix = int(PreviousDate.timestamp())
     logging.info("Running process_all_cryptos...")
+    logging.info(f"Current Start Date: {CurrentStartDate}")
+    logging.info(f"Previous Start Date: {PreviousDate}")
+    cycle_started = time.perf_counter()
     try:
-        coins_list = session.query(Coin).all()
-        if coins_list:
-            for coin in coins_list:
-                last_row_historic = session.query(CoinHistoric).filter(CoinHistoric.coin_id == coin.id).order_by(desc(CoinHistoric.timestamp)).first()
-                if last_row_historic is None or coin.history_check == False or last_row_historic.timestamp < PreviousDateUnix:
-                    get_coin_historic(coin, False)
-                else:
-                    get_coin_historic(coin, True)
-        logging.info(f"Current Start Date: {CurrentStartDate}")
-        logging.info(f"Previous Start Date: {PreviousDate}")
-        logging.info(f"Coin: {coin.symbol}, Last Historic Timestamp: {last_row_historic.timestamp}")
+        plan = plan_cycle(session, PreviousDateUnix)
     finally:
         session.close()
-        
+    logging.info(
+        f"Cycle plan: {len(plan['backfill'])} backfill, {len(plan['repair'])} repair, {len(plan['hourly'])} hourly, "
+        f"{len(plan['idle'])} with nothing due"
+    )
+    sync_alert_rules(SessionLocal)
+    jobs = [(coin, "historic", last_hour_ts) for coin, last_hour_ts in plan["backfill"]]
+    jobs += [(coin, "repair", last_hour_ts) for coin, last_hour_ts in plan["repair"]]
+    jobs += [(coin, "hourly", last_hour_ts) for coin, last_hour_ts in plan["hourly"]]
+
+    timings = {}
+    if sharded:
+        cycle_start = int(now_utc.replace(minute=0, second=0, microsecond=0).timestamp())
+        run_sharded_jobs(jobs, max_workers, timings, cycle_start)
+    else:
+        run_jobs(jobs, max_workers, timings)
+    persist_alert_triggers(SessionLocal)
+    logging.info(f"Alert engine: {get_alert_engine().stats()}")
+
+    dispatcher = get_dispatcher()
+    if not dispatcher.flush(timeout=WEBHOOK_FLUSH_TIMEOUT):
+        logging.warning("Webhook queue not drained before the flush timeout")
+    logging.info(f"Webhook dispatcher: {dispatcher.stats()}")
+    cache = get_response_cache()
+    if cache is not None:
+        logging.info(f"API response cache: {cache.stats()}")
+
+    total = time.perf_counter() - cycle_started
+    busy = sum(timings.values())
+    logging.info(
+        f"Processed {len(timings)} coins with {max_workers} workers in {total:.2f}s "
+        f"(sum of per-coin time {busy:.2f}s, speedup {busy / total if total else 0:.2f}x)"
+    )
+    return timings
+
+
+def scheduled_gap_repair():
+    """Daily gap repair; with sharded workers only the one holding the advisory lock runs it."""
+    if not SCHEDULER_SHARDED:
+        return repair_all_gaps()
+    with get_engine().connect() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": GAP_REPAIR_LOCK_KEY}).scalar():
+            logging.info("Gap repair already running on another worker")
+            return None
+        try:
+            return repair_all_gaps()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": GAP_REPAIR_LOCK_KEY})
+
+
+def on_scheduler_event(event):
+    """Record scheduler lag, missed/skipped runs and job errors."""
+    if event.code == EVENT_JOB_SUBMITTED:
+        for scheduled in event.scheduled_run_times:
+            metrics.observe("scheduler_lag_seconds", (datetime.now(scheduled.tzinfo) - scheduled).total_seconds())
+    elif event.code in (EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES):
+        reason = "missed" if event.code == EVENT_JOB_MISSED else "still_running"
+        metrics.inc("scheduler_missed_runs_total", reason=reason)
+        logging.warning(f"Scheduled run of {event.job_id} skipped ({reason})")
+    elif event.code == EVENT_JOB_ERROR:
+        metrics.inc("scheduler_job_errors_total")
 
 
 if __name__ == "__main__":
+    metrics.start_from_env()
+    metrics.instrument_engine(get_engine())
     scheduler = BackgroundScheduler(debug=True)
+    scheduler.add_listener(
+        on_scheduler_event,
+        EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_ERROR,
+    )
     scheduler.add_job(process_all_cryptos, 'cron', minute=1, second=0)
+    # Holes left by failed pages or missed runs are filled once a day
+    scheduler.add_job(scheduled_gap_repair, 'cron', hour=3, minute=30)
     scheduler.start()
+    stream = start_stream_ingest() if STREAM_INGEST else None
 
     print("Press Ctrl+C to stop the scheduler")
     try:
@@ -55,5 +268,7 @@ if __name__ == "__main__":
             time.sleep(1)
     except (KeyboardInterrupt, SystemExit):
         scheduler.shutdown(wait=False)
+        if stream is not None:
+            stream[1].set()
         print("Scheduler stopped")
     
\ No newline at end of file
@@ -0,0 +1,303 @@
+﻿"""
+Schema setup and migrations for the crypto tracker database. Nothing creates
+tables at import time any more; run this once per deployment or upgrade.
+
+Usage:
+    python migrations.py                 # create missing tables and apply pending migrations
+    python migrations.py --partition     # also partition coin_historic by time
+    python migrations.py --explain BTC   # show query plans for the hot lookups
+"""
+import sys
+import time
+from sqlalchemy import text
+from db import get_engine
+from sqlalchemy.orm import Session
+from Models.coins import (
+    Base, Coin, CoinHourly, BackfillWindow, CoinRollup, CoinCycleClaim, CoinStreamCandle, AlertRule,
+    CoinIndicator, CoinIndicatorState,
+)
+from Scripts.rollups import merge_into_rollups
+from Scripts.indicators import rebuild_indicators, PERIODS
+
+# Candles are stored with a unix `timestamp`, so chunks/partitions are ranges of seconds
+PARTITION_INTERVAL_SECONDS = 365 * 24 * 3600
+
+
+def _table_exists(conn, name):
+    return conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+
+
+def _constraint_exists(conn, name):
+    return conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = :name)"), {"name": name}
+    ).scalar()
+
+
+def migration_0001_coin_historic_unique_key(conn):
+    """Drop duplicate candles and add the unique (coin_id, timestamp) key."""
+    if _constraint_exists(conn, "uq_coin_historic_coin_id_timestamp"):
+        return
+    conn.execute(text("""
+        DELETE FROM coin_historic a
+        USING coin_historic b
+        WHERE a.coin_id = b.coin_id
+          AND a.timestamp = b.timestamp
+          AND a.id > b.id
+    """))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_coin_historic_coin_id_timestamp
+        ON coin_historic (coin_id, timestamp)
+    """))
+    conn.execute(text("""
+        ALTER TABLE coin_historic
+        ADD CONSTRAINT uq_coin_historic_coin_id_timestamp
+        UNIQUE USING INDEX uq_coin_historic_coin_id_timestamp
+    """))
+
+
+def migration_0002_coin_hourly_table(conn):
+    """Create coin_hourly and unpack the hourly_historic JSON arrays into it."""
+    CoinHourly.__table__.create(conn, checkfirst=True)
+    # `hour` in the JSON is the Europe/London hour of the day the row's timestamp starts
+    conn.execute(text("""
+        INSERT INTO coin_hourly (coin_id, timestamp, high, low, open, close)
+        SELECT h.coin_id,
+               CAST(EXTRACT(EPOCH FROM (
+                   (date_trunc('day', to_timestamp(h.timestamp) AT TIME ZONE 'Europe/London')
+                    + make_interval(hours => CAST(e ->> 'hour' AS INTEGER)))
+                   AT TIME ZONE 'Europe/London'
+               )) AS INTEGER),
+               CAST(e ->> 'high' AS NUMERIC),
+               CAST(e ->> 'low' AS NUMERIC),
+               CAST(e ->> 'open' AS NUMERIC),
+               CAST(e ->> 'close' AS NUMERIC)
+        FROM coin_historic h
+        CROSS JOIN LATERAL json_array_elements(h.hourly_historic) AS e
+        WHERE h.hourly_historic IS NOT NULL
+          AND json_typeof(h.hourly_historic) = 'array'
+        ON CONFLICT (coin_id, timestamp) DO NOTHING
+    """))
+
+
+def migration_0003_backfill_windows_table(conn):
+    """Create backfill_windows for resumable backfill checkpoints."""
+    BackfillWindow.__table__.create(conn, checkfirst=True)
+
+
+def migration_0004_coin_rollups_table(conn):
+    """Create coin_rollups and fill it from the existing daily candles."""
+    CoinRollup.__table__.create(conn, checkfirst=True)
+    session = Session(bind=conn)
+    for (coin_id,) in session.query(Coin.id).all():
+        merge_into_rollups(session, coin_id, 0, 2 ** 31 - 1)
+    session.flush()
+
+
+def migration_0005_coin_cycle_claims_table(conn):
+    """Create coin_cycle_claims for sharded scheduler workers."""
+    CoinCycleClaim.__table__.create(conn, checkfirst=True)
+
+
+def migration_0006_coin_stream_candles_table(conn):
+    """Create coin_stream_candles for streaming ingestion."""
+    CoinStreamCandle.__table__.create(conn, checkfirst=True)
+
+
+def migration_0007_alert_rules_table(conn):
+    """Create alert_rules for user price alerts."""
+    AlertRule.__table__.create(conn, checkfirst=True)
+
+
+def migration_0008_coin_indicators_tables(conn):
+    """Create coin_indicators and coin_indicator_state and compute them from the stored candles."""
+    CoinIndicator.__table__.create(conn, checkfirst=True)
+    CoinIndicatorState.__table__.create(conn, checkfirst=True)
+    session = Session(bind=conn)
+    for (coin_id,) in session.query(Coin.id).all():
+        for period in PERIODS.values():
+            rebuild_indicators(session, coin_id, period)
+    session.flush()
+
+
+MIGRATIONS = [
+    ("0001", migration_0001_coin_historic_unique_key),
+    ("0002", migration_0002_coin_hourly_table),
+    ("0003", migration_0003_backfill_windows_table),
+    ("0004", migration_0004_coin_rollups_table),
+    ("0005", migration_0005_coin_cycle_claims_table),
+    ("0006", migration_0006_coin_stream_candles_table),
+    ("0007", migration_0007_alert_rules_table),
+    ("0008", migration_0008_coin_indicators_tables),
+]
+
+
+def applied_versions(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """))
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def create_schema(engine=None):
+    """Create every table of the models that does not exist yet."""
+    engine = engine or get_engine()
+    Base.metadata.create_all(engine)
+
+
+def migrate(engine=None):
+    """Apply every pending migration, each in its own transaction."""
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    for version, migration in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            if not _table_exists(conn, "coin_historic"):
+                print("coin_historic does not exist yet, nothing to migrate")
+                return
+            migration(conn)
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version})
+        print(f"Applied migration {version}: {migration.__doc__}")
+
+
+def is_partitioned(conn):
+    timescale = conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb')"
+    )).scalar()
+    if timescale and conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM timescaledb_information.hypertables "
+        "WHERE hypertable_name = 'coin_historic')"
+    )).scalar():
+        return True
+    return conn.execute(text("""
+        SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p
+                       JOIN pg_class c ON c.oid = p.partrelid
+                       WHERE c.relname = 'coin_historic')
+    """)).scalar()
+
+
+def _timescale_available(conn):
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb')"
+    )).scalar()
+
+
+def _convert_to_hypertable(conn):
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+    # Every unique index on a hypertable has to include the time column
+    conn.execute(text("ALTER TABLE coin_historic DROP CONSTRAINT IF EXISTS coin_historic_pkey"))
+    conn.execute(text("ALTER TABLE coin_historic ADD PRIMARY KEY (id, timestamp)"))
+    conn.execute(text("""
+        SELECT create_hypertable('coin_historic', 'timestamp',
+                                 chunk_time_interval => CAST(:interval AS INTEGER),
+                                 migrate_data => true)
+    """), {"interval": PARTITION_INTERVAL_SECONDS})
+
+
+def _convert_to_range_partitions(conn):
+    bounds = conn.execute(text("SELECT min(timestamp), max(timestamp) FROM coin_historic")).first()
+    conn.execute(text("""
+        CREATE TABLE coin_historic_partitioned (
+            LIKE coin_historic INCLUDING DEFAULTS,
+            PRIMARY KEY (id, timestamp),
+            CONSTRAINT uq_coin_historic_partitioned_coin_id_timestamp UNIQUE (coin_id, timestamp),
+            FOREIGN KEY (coin_id) REFERENCES coins (id)
+        ) PARTITION BY RANGE (timestamp)
+    """))
+    now = int(time.time())
+    # An empty table starts at the current year rather than at the epoch
+    low = bounds[0] if bounds[0] is not None else now
+    high = max(bounds[1] if bounds[1] is not None else low, now)
+    # Yearly partitions over the existing data plus a few years of headroom
+    start = low - low % PARTITION_INTERVAL_SECONDS
+    end = high + 5 * PARTITION_INTERVAL_SECONDS
+    while start <= end:
+        stop = start + PARTITION_INTERVAL_SECONDS
+        conn.execute(text(
+            f"CREATE TABLE coin_historic_p{start} PARTITION OF coin_historic_partitioned "
+            f"FOR VALUES FROM ({start}) TO ({stop})"
+        ))
+        start = stop
+    conn.execute(text("CREATE TABLE coin_historic_default PARTITION OF coin_historic_partitioned DEFAULT"))
+    conn.execute(text("INSERT INTO coin_historic_partitioned SELECT * FROM coin_historic"))
+    conn.execute(text("ALTER SEQUENCE coin_historic_id_seq OWNED BY NONE"))
+    conn.execute(text("DROP TABLE coin_historic"))
+    conn.execute(text("ALTER TABLE coin_historic_partitioned RENAME TO coin_historic"))
+    conn.execute(text("ALTER SEQUENCE coin_historic_id_seq OWNED BY coin_historic.id"))
+    conn.execute(text(
+        "ALTER TABLE coin_historic RENAME CONSTRAINT uq_coin_historic_partitioned_coin_id_timestamp "
+        "TO uq_coin_historic_coin_id_timestamp"
+    ))
+
+
+def partition_coin_historic(engine=None):
+    """
+    Partition coin_historic by timestamp: a TimescaleDB hypertable when the
+    extension is installed, otherwise native Postgres range partitions.
+    """
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            print("coin_historic is already partitioned")
+            return
+        if _timescale_available(conn):
+            _convert_to_hypertable(conn)
+            print("coin_historic converted to a TimescaleDB hypertable")
+        else:
+            _convert_to_range_partitions(conn)
+            print("coin_historic converted to native range partitions")
+
+
+HOT_QUERIES = {
+    "last row per coin": """
+        SELECT * FROM coin_historic WHERE coin_id = :coin_id
+        ORDER BY timestamp DESC LIMIT 1
+    """,
+    "current day lookup": """
+        SELECT * FROM coin_historic WHERE coin_id = :coin_id AND timestamp = :ts
+        LIMIT 1
+    """,
+    "month open": """
+        SELECT * FROM coin_historic WHERE coin_id = :coin_id
+        AND timestamp >= :ts AND timestamp < :ts + 86400
+        ORDER BY timestamp ASC LIMIT 1
+    """,
+    "month close": """
+        SELECT * FROM coin_historic WHERE coin_id = :coin_id
+        AND timestamp >= :ts AND timestamp <= :ts + 2592000 AND close > 0 AND open > 0
+        ORDER BY timestamp DESC LIMIT 1
+    """,
+}
+
+
+def explain_hot_queries(symbol, engine=None):
+    """Print the query plan of every hot coin_historic lookup for one coin."""
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT c.id, max(h.timestamp) FROM coins c LEFT JOIN coin_historic h ON h.coin_id = c.id "
+            "WHERE c.symbol = :symbol GROUP BY c.id"
+        ), {"symbol": symbol}).first()
+        if row is None:
+            print(f"{symbol} is not in the database")
+            return
+        params = {"coin_id": row[0], "ts": row[1] or 0}
+        for name, query in HOT_QUERIES.items():
+            plan = conn.execute(text("EXPLAIN " + query), params).scalars().all()
+            print(f"-- {name}")
+            print("\n".join(plan))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--explain" in args:
+        explain_hot_queries(args[args.index("--explain") + 1].upper())
+    else:
+        create_schema()
+        migrate()
+        if "--partition" in args:
+            partition_coin_historic()
@@ -0,0 +1,29 @@
+﻿"""
+Resumable backfill planning: checkpoints of an interrupted backfill still
+cover its windows on a later day, when the newest window has grown.
+
+Usage: python -m pytest tests
+"""
+import unittest
+
+from Scripts.get_historic_coin_data import DAY_SECONDS, plan_backfill_windows, unfetched_part
+
+
+class BackfillWindowsTest(unittest.TestCase):
+    def test_resumed_backfill_fetches_only_the_new_days(self):
+        today = 20000 * DAY_SECONDS
+        checkpoints = plan_backfill_windows(today - 100 * DAY_SECONDS, today, 30)
+        later = plan_backfill_windows(today - 100 * DAY_SECONDS, today + 2 * DAY_SECONDS, 30)
+        pending = [part for part in (unfetched_part(window, checkpoints) for window in later) if part is not None]
+        self.assertEqual(pending, [(today, today + DAY_SECONDS)])
+
+    def test_partial_checkpoints_leave_the_first_hole(self):
+        window = (0, 9 * DAY_SECONDS)
+        self.assertEqual(unfetched_part(window, []), window)
+        self.assertEqual(unfetched_part(window, [(0, 2 * DAY_SECONDS), (4 * DAY_SECONDS, 9 * DAY_SECONDS)]),
+                         (3 * DAY_SECONDS, 9 * DAY_SECONDS))
+        self.assertIsNone(unfetched_part(window, [(0, 9 * DAY_SECONDS)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+﻿"""
+PriceCache freshness: ingestion NOTIFYs, the listener fallback and daily rows
+stamped at London midnight, with load_candles replaced by an in-memory store.
+
+Usage: python -m pytest tests
+"""
+import contextlib
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from Scripts import price_cache
+from Scripts.candles import CandleBatch
+
+
+class FakeStore:
+    def __init__(self, times):
+        self.times = list(times)
+        self.loads = 0
+
+    def load_candles(self, session, coin_id, kind, start_ts):
+        self.loads += 1
+        times = np.array([t for t in self.times if t >= start_ts], dtype=np.int64)
+        close = np.ones(len(times))
+        return CandleBatch(times, close, close, close, close)
+
+
+class PriceCacheTest(unittest.TestCase):
+    def lookup(self, cache, store, kind, seconds):
+        now = int(time.time())
+        with mock.patch.object(price_cache, "load_candles", store.load_candles):
+            return cache.recent(contextlib.nullcontext, 1, kind, now - seconds, now + 1)
+
+    def test_notified_write_is_read_once(self):
+        hour = int(time.time()) // 3600 * 3600
+        store = FakeStore(range(hour - 10 * 3600, hour - 3600, 3600))
+        cache = price_cache.PriceCache(1 << 20, 48, 10)
+        cache.listening = True
+        self.lookup(cache, store, "hourly", 86400)
+        self.lookup(cache, store, "hourly", 86400)
+        self.assertEqual(store.loads, 1)
+
+        store.times.append(hour - 3600)
+        cache.invalidate(1, "hourly")
+        candles = self.lookup(cache, store, "hourly", 86400)
+        self.assertEqual((store.loads, int(candles.time[-1])), (2, hour - 3600))
+        self.lookup(cache, store, "hourly", 86400)
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_daily_row_at_london_midnight_is_current(self):
+        # In summer the hourly path stamps yesterday's candle at 23:00 UTC the day before
+        today = int(time.time()) // 86400 * 86400
+        store = FakeStore([today - 86400 - 3600 + day * 86400 for day in range(-5, 1)])
+        cache = price_cache.PriceCache(1 << 20, 48, 10)
+        self.lookup(cache, store, "daily", 5 * 86400)
+        with mock.patch.object(price_cache, "RECHECK_SECONDS", 0):
+            self.lookup(cache, store, "daily", 5 * 86400)
+        self.assertEqual(store.loads, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
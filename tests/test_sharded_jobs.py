@@ -0,0 +1,76 @@
+﻿"""
+Smoke test of the sharded scheduler path: leases, the per-chunk claims and
+the take-over of expired claims, with the lease table and ingestion replaced
+by in-memory fakes so no database or API is needed.
+
+Usage: python -m pytest tests
+"""
+import contextlib
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import main as scheduler
+
+
+class FakeSession:
+    def close(self):
+        pass
+
+
+class ShardedJobsSmokeTest(unittest.TestCase):
+    def run_cycle(self, jobs, first_pass_skips):
+        """Run one sharded cycle where `first_pass_skips` are held elsewhere until their lease expires."""
+        processed = []
+        finished = []
+        expired = list(first_pass_skips)
+        taken_over = []
+
+        def claim_coins(session, cycle_start, coin_ids, worker):
+            # Coins held by the other worker are only won once their lease has expired
+            return {coin_id for coin_id in coin_ids if coin_id not in first_pass_skips or coin_id in taken_over}
+
+        def unfinished_claims(session, cycle_start, coin_ids):
+            # The other worker's leases have expired by the time this worker finished its own pass
+            newly_expired = list(expired)
+            taken_over.extend(expired)
+            expired.clear()
+            return newly_expired, 0
+
+        def process_coin(coin, mode, last_hour_ts=None):
+            processed.append((coin.id, mode, last_hour_ts))
+            return 0.0
+
+        patches = [
+            mock.patch.object(scheduler, "SessionLocal", FakeSession),
+            mock.patch.object(scheduler, "prune_claims", lambda *a: 0),
+            mock.patch.object(scheduler, "LeaseHeartbeat", lambda *a: contextlib.nullcontext()),
+            mock.patch.object(scheduler, "claim_coins", claim_coins),
+            mock.patch.object(scheduler, "unfinished_claims", unfinished_claims),
+            mock.patch.object(scheduler, "finish_coin", lambda session, cycle, coin_id, worker: finished.append(coin_id)),
+            mock.patch.object(scheduler, "process_coin", process_coin),
+        ]
+        with contextlib.ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            timings = {}
+            scheduler.run_sharded_jobs(jobs, 2, timings, int(time.time()))
+        return processed, finished, timings
+
+    def test_every_job_runs_once_with_its_mode(self):
+        modes = ["hourly", "historic", "repair", "hourly", "hourly"]
+        jobs = [(SimpleNamespace(id=index, symbol=f"C{index}"), mode, 1000 + index) for index, mode in enumerate(modes)]
+        processed, finished, timings = self.run_cycle(jobs, first_pass_skips={1, 3})
+
+        self.assertEqual(sorted(processed), sorted((coin.id, mode, ts) for coin, mode, ts in jobs))
+        self.assertEqual(sorted(finished), [coin.id for coin, _, _ in jobs])
+        self.assertEqual(set(timings), {coin.symbol for coin, _, _ in jobs})
+
+    def test_no_jobs(self):
+        processed, finished, timings = self.run_cycle([], first_pass_skips=set())
+        self.assertEqual((processed, finished, timings), ([], [], {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
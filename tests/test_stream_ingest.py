@@ -0,0 +1,54 @@
+﻿"""
+StreamIngestor.flush under write errors, with the database write replaced by
+an in-memory fake.
+
+Usage: python -m pytest tests
+"""
+import unittest
+from unittest import mock
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from Scripts.stream_ingest import StreamIngestor
+
+
+class FakeSession:
+    def rollback(self):
+        pass
+
+
+def candle(coin_id, timestamp=0):
+    return {"coin_id": coin_id, "period": 60, "timestamp": timestamp, "open": 1, "high": 1, "low": 1, "close": 1}
+
+
+class StreamFlushTest(unittest.TestCase):
+    def flush(self, ingestor, write):
+        with mock.patch.object(ingestor, "_write", write):
+            return ingestor.flush(FakeSession())
+
+    def test_rejected_row_is_dropped_and_the_rest_written(self):
+        stored = []
+
+        def write(session, rows):
+            if any(row["coin_id"] == 2 for row in rows):
+                raise IntegrityError("INSERT", {}, Exception("no such coin"))
+            stored.extend(rows)
+
+        ingestor = StreamIngestor(flush_batch=2)
+        ingestor._queue([candle(coin_id) for coin_id in (1, 2, 3, 4, 5)])
+        self.assertEqual(self.flush(ingestor, write), 4)
+        self.assertEqual([row["coin_id"] for row in stored], [1, 3, 4, 5])
+        self.assertEqual((len(ingestor.pending), ingestor.rejected), (0, 1))
+
+    def test_unreachable_database_keeps_rows_queued(self):
+        def write(session, rows):
+            raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+        ingestor = StreamIngestor(flush_batch=2)
+        ingestor._queue([candle(coin_id) for coin_id in (1, 2, 3)])
+        self.assertEqual(self.flush(ingestor, write), 0)
+        self.assertEqual((len(ingestor.pending), ingestor.rejected), (3, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+﻿"""
+WebhookDispatcher bookkeeping under failures, with a fake HTTP session.
+
+Usage: python -m pytest tests
+"""
+import unittest
+
+from Scripts.webhook_dispatcher import WebhookDispatcher
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.headers = {}
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Replies from a per-webhook script of responses; an exception in the script is raised."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.posts = []
+
+    def post(self, url, json, timeout):
+        self.posts.append(url)
+        reply = self.replies[url].pop(0) if len(self.replies[url]) > 1 else self.replies[url][0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+class WebhookDispatcherTest(unittest.TestCase):
+    def test_unexpected_error_drops_batch_and_keeps_webhook_usable(self):
+        session = FakeSession({"broken": [KeyError("boom"), FakeResponse(204)]})
+        dispatcher = WebhookDispatcher(workers=2, session=session)
+        try:
+            dispatcher.submit("broken", {"content": "first"})
+            self.assertTrue(dispatcher.flush(timeout=5))
+            dispatcher.submit("broken", {"content": "second"})
+            self.assertTrue(dispatcher.flush(timeout=5))
+            stats = dispatcher.stats()
+            self.assertEqual((stats["dropped"], stats["sent"], stats["queued"]), (1, 1, 0))
+        finally:
+            dispatcher.close(timeout=1)
+
+    def test_rate_limit_with_non_dict_body_is_retried(self):
+        session = FakeSession({"limited": [FakeResponse(429, ["not", "a", "dict"]), FakeResponse(204)]})
+        dispatcher = WebhookDispatcher(workers=1, session=session)
+        try:
+            dispatcher.submit("limited", {"content": "hello"})
+            self.assertTrue(dispatcher.flush(timeout=5))
+            stats = dispatcher.stats()
+            self.assertEqual((stats["rate_limited"], stats["sent"], stats["dropped"]), (1, 1, 0))
+        finally:
+            dispatcher.close(timeout=1)
+
+
+if __name__ == "__main__":
+    unittest.main()